@@ -1,6 +1,6 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 
-from .models import Appointment, Notification
+from .models import Appointment, Notification, NotificationArchive
 
 
 @admin.register(Appointment)
@@ -9,6 +9,21 @@ class AppointmentAdmin(admin.ModelAdmin):
     list_filter = ('status', 'professional')
     search_fields = ('patient__user__first_name', 'patient__user__last_name')
     filter_horizontal = ('equipment',)
+    actions = ['invoice_completed']
+
+    @admin.action(description='Facturar las citas completadas seleccionadas')
+    def invoice_completed(self, request, queryset):
+        from billing.batch_invoicing import invoice_appointments
+
+        result = invoice_appointments(appointments=queryset, issued_by=request.user)
+        invoiced = sum(len(row['appointments']) for row in result['invoices'])
+        self.message_user(request, f"{invoiced} citas facturadas en {len(result['invoices'])} facturas.")
+        if result['skipped']:
+            self.message_user(
+                request,
+                f"{len(result['skipped'])} citas omitidas (sin servicio para el tratamiento o ya facturadas).",
+                level=messages.WARNING,
+            )
 
 
 @admin.register(Notification)
@@ -17,3 +32,11 @@ class NotificationAdmin(admin.ModelAdmin):
     list_filter = ('notification_type', 'channel', 'sent_at', 'read_at')
     search_fields = ('patient__user__first_name', 'patient__user__last_name', 'title')
     date_hierarchy = 'created_at'
+
+
+@admin.register(NotificationArchive)
+class NotificationArchiveAdmin(admin.ModelAdmin):
+    list_display = ('patient_id', 'notification_type', 'channel', 'created_at', 'archived_at')
+    list_filter = ('notification_type', 'channel')
+    search_fields = ('title',)
+    date_hierarchy = 'created_at'
@@ -0,0 +1,56 @@
+"""
+Asignación automática de sala para una cita.
+
+Entre las salas activas y disponibles que tienen el equipamiento requerido y
+están libres en el intervalo, se elige la de mejor ajuste (best-fit): la que
+deja el hueco libre más pequeño alrededor de la cita, de modo que las salas
+con grandes bloques libres quedan para citas largas. Todo se resuelve en una
+única consulta con subconsultas correlacionadas.
+"""
+from django.db.models import DurationField, Exists, ExpressionWrapper, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from core.dates import local_day_bounds
+
+from .intervals import ACTIVE_STATUSES
+
+
+def candidate_rooms(start_time, end_time, equipment_ids=(), exclude_pk=None):
+    """Salas libres para [start_time, end_time) ordenadas de mejor a peor ajuste."""
+    from resources.models import Equipment, Room
+
+    from .models import Appointment
+
+    day_start, day_end = local_day_bounds(timezone.localdate(start_time))
+    active = Appointment.objects.filter(room=OuterRef('pk'), status__in=ACTIVE_STATUSES)
+    if exclude_pk is not None:
+        active = active.exclude(pk=exclude_pk)
+
+    rooms = Room.objects.filter(is_active=True, status=Room.Status.AVAILABLE).filter(
+        ~Exists(active.filter(start_time__lt=end_time, end_time__gt=start_time)),
+    )
+
+    equipment_ids = list(equipment_ids)
+    if equipment_ids:
+        # Los equipos fijos (asociados a alguna sala) obligan a usar esa sala;
+        # los portátiles no restringen la elección
+        fixed_elsewhere = Equipment.objects.filter(
+            Q(rooms__isnull=False) | Q(room__isnull=False),
+            pk__in=equipment_ids,
+        ).exclude(Q(rooms=OuterRef('pk')) | Q(room=OuterRef('pk')))
+        rooms = rooms.filter(~Exists(fixed_elsewhere))
+
+    previous_end = active.filter(end_time__lte=start_time, end_time__gt=day_start).order_by('-end_time')
+    next_start = active.filter(start_time__gte=end_time, start_time__lt=day_end).order_by('start_time')
+    return rooms.annotate(
+        free_from=Coalesce(Subquery(previous_end.values('end_time')[:1]), Value(day_start)),
+        free_until=Coalesce(Subquery(next_start.values('start_time')[:1]), Value(day_end)),
+    ).annotate(
+        free_window=ExpressionWrapper(F('free_until') - F('free_from'), output_field=DurationField()),
+    ).order_by('free_window', 'pk')
+
+
+def allocate_room(start_time, end_time, equipment_ids=(), exclude_pk=None):
+    """Devuelve la sala de mejor ajuste para el intervalo o None si no hay ninguna libre."""
+    return candidate_rooms(start_time, end_time, equipment_ids, exclude_pk).first()
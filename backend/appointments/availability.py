@@ -0,0 +1,270 @@
+"""
+Cálculo de franjas libres reservables.
+
+Cruza el horario laboral de cada profesional con el tiempo libre de las salas
+(y de los equipos solicitados) usando aritmética sobre listas ordenadas de
+intervalos [inicio, fin). Todas las citas ocupadas del rango se leen con una
+sola consulta (más una para los equipos), de modo que el coste no depende del
+número de días ni de recursos consultados.
+"""
+from bisect import bisect_right
+from datetime import time, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+from core.dates import local_datetime, local_day_bounds
+from core.filters import parse_filter
+
+from .intervals import ACTIVE_STATUSES
+
+DEFAULT_START_HOUR = time(9, 0)
+DEFAULT_END_HOUR = time(18, 0)
+MAX_RANGE_DAYS = 62
+
+
+def merge(intervals):
+    """Ordena y fusiona intervalos solapados o contiguos."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def subtract(free, busy):
+    """Resta de ``free`` los intervalos ``busy`` (ambas listas ordenadas y fusionadas)."""
+    result = []
+    position = 0
+    for start, end in free:
+        cursor = start
+        while position < len(busy) and busy[position][1] <= cursor:
+            position += 1
+        scan = position
+        while scan < len(busy) and busy[scan][0] < end:
+            busy_start, busy_end = busy[scan]
+            if busy_start > cursor:
+                result.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+            scan += 1
+        if cursor < end:
+            result.append((cursor, end))
+    return result
+
+
+def contains(free, start, end):
+    """Indica si [start, end) cabe entero dentro de algún intervalo de ``free``."""
+    position = bisect_right(free, (start, end)) - 1
+    candidates = (position, position + 1)
+    return any(
+        0 <= index < len(free) and free[index][0] <= start and end <= free[index][1]
+        for index in candidates
+    )
+
+
+def compute_free_slots(
+    date_from,
+    date_to,
+    duration,
+    professionals,
+    rooms,
+    equipment_ids=(),
+    step=None,
+    not_before=None,
+):
+    """
+    Devuelve las franjas reservables de cada profesional entre date_from y
+    date_to (ambos incluidos), con las salas libres en cada franja.
+
+    ``duration`` y ``step`` son ``timedelta``. Una franja es reservable si el
+    profesional trabaja en ella, no tiene citas, alguna sala está libre durante
+    toda la franja y todos los equipos solicitados están operativos y libres.
+    """
+    from .models import Appointment
+
+    step = step or duration
+    not_before = not_before or timezone.now()
+    range_start, range_end = local_day_bounds(date_from, date_to)
+    professional_ids = [professional.pk for professional in professionals]
+    room_ids = [room.pk for room in rooms]
+    equipment_ids = list(equipment_ids)
+
+    busy_professional = {pk: [] for pk in professional_ids}
+    busy_room = {pk: [] for pk in room_ids}
+    occupied = Appointment.objects.filter(
+        Q(professional_id__in=professional_ids) | Q(room_id__in=room_ids),
+        status__in=ACTIVE_STATUSES,
+        start_time__lt=range_end,
+        end_time__gt=range_start,
+    ).values_list('professional_id', 'room_id', 'start_time', 'end_time')
+    for professional_id, room_id, start_time, end_time in occupied:
+        if professional_id in busy_professional:
+            busy_professional[professional_id].append((start_time, end_time))
+        if room_id in busy_room:
+            busy_room[room_id].append((start_time, end_time))
+
+    busy_equipment = []
+    if equipment_ids:
+        from resources.models import Equipment
+
+        usable = Equipment.objects.filter(pk__in=equipment_ids, status=Equipment.Status.AVAILABLE, is_active=True)
+        if usable.count() < len(set(equipment_ids)):
+            # Algún equipo está fuera de servicio o no existe: no hay franjas
+            busy_equipment.append((range_start, range_end))
+        busy_equipment += list(
+            Appointment.equipment.through.objects.filter(
+                equipment_id__in=equipment_ids,
+                appointment__status__in=ACTIVE_STATUSES,
+                appointment__start_time__lt=range_end,
+                appointment__end_time__gt=range_start,
+            ).values_list('appointment__start_time', 'appointment__end_time')
+        )
+
+    busy_professional = {pk: merge(items) for pk, items in busy_professional.items()}
+    busy_equipment = merge(busy_equipment)
+    room_free = {
+        pk: subtract([(range_start, range_end)], merge(items))
+        for pk, items in busy_room.items()
+    }
+
+    results = []
+    for professional in professionals:
+        weekdays = professional.get_working_weekdays()
+        start_hour = professional.start_hour or DEFAULT_START_HOUR
+        end_hour = professional.end_hour or DEFAULT_END_HOUR
+        windows = []
+        day = date_from
+        while day <= date_to:
+            if day.weekday() in weekdays:
+                window_start = max(local_datetime(day, start_hour), not_before)
+                window_end = local_datetime(day, end_hour)
+                if window_start < window_end:
+                    windows.append((window_start, window_end))
+            day += timedelta(days=1)
+
+        free = subtract(windows, busy_professional[professional.pk])
+        free = subtract(free, busy_equipment)
+
+        slots = []
+        for window_start, window_end in windows:
+            # Las franjas se alinean con el inicio de la jornada laboral
+            slot_start = local_datetime(timezone.localdate(window_end), start_hour)
+            while slot_start < window_start:
+                slot_start += step
+            while slot_start + duration <= window_end:
+                slot_end = slot_start + duration
+                if contains(free, slot_start, slot_end):
+                    # Cada sala por separado: la franja entera debe caber en una misma sala
+                    free_rooms = [pk for pk in room_ids if contains(room_free[pk], slot_start, slot_end)]
+                    if free_rooms:
+                        slots.append({
+                            'start': slot_start.isoformat(),
+                            'end': slot_end.isoformat(),
+                            'room_ids': free_rooms,
+                        })
+                slot_start += step
+
+        results.append({
+            'id': professional.pk,
+            'name': professional.user.get_full_name(),
+            'slots': slots,
+        })
+
+    return results
+
+
+def parse_id_list(query_params, name):
+    """Lee una lista de ids como "1,2,3" o como parámetro repetido."""
+    ids = []
+    for value in query_params.getlist(name):
+        for part in filter(None, value.split(',')):
+            if not part.strip().isdigit():
+                raise ValidationError({name: 'Debe ser una lista de identificadores numéricos.'})
+            ids.append(int(part))
+    return ids
+
+
+def parse_free_slot_query(query_params):
+    """Interpreta los parámetros comunes de la consulta de franjas libres."""
+    # parse_date lanza ValueError con fechas imposibles (2026-02-30): 400, no 500
+    date_from = parse_filter(query_params, 'date_from', parse_date)
+    if not date_from:
+        raise ValidationError({'date_from': 'Se requiere una fecha válida (AAAA-MM-DD).'})
+    date_to = parse_filter(query_params, 'date_to', parse_date) or date_from
+    if date_to < date_from:
+        raise ValidationError({'date_to': 'La fecha final debe ser igual o posterior a la inicial.'})
+    if (date_to - date_from).days >= MAX_RANGE_DAYS:
+        raise ValidationError({'date_to': f'El rango no puede superar {MAX_RANGE_DAYS} días.'})
+
+    try:
+        duration = int(query_params.get('duration', 60))
+        step = int(query_params.get('step', duration))
+    except ValueError:
+        raise ValidationError({'duration': 'La duración y el paso deben indicarse en minutos.'})
+    if duration <= 0 or step <= 0:
+        raise ValidationError({'duration': 'La duración y el paso deben ser positivos.'})
+
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'duration': timedelta(minutes=duration),
+        'step': timedelta(minutes=step),
+        'professional_ids': parse_id_list(query_params, 'professional_ids') + parse_id_list(query_params, 'professional_id'),
+        'room_ids': parse_id_list(query_params, 'room_ids') + parse_id_list(query_params, 'room_id'),
+        'equipment_ids': parse_id_list(query_params, 'equipment_ids'),
+    }
+
+
+def free_slots_payload(query, professionals, rooms):
+    """Respuesta común de los endpoints de disponibilidad por rango."""
+    return {
+        'date_from': query['date_from'].isoformat(),
+        'date_to': query['date_to'].isoformat(),
+        'duration': int(query['duration'].total_seconds() // 60),
+        'room_ids': [room.pk for room in rooms],
+        'equipment_ids': query['equipment_ids'],
+        'professionals': compute_free_slots(
+            query['date_from'],
+            query['date_to'],
+            query['duration'],
+            professionals,
+            rooms,
+            equipment_ids=query['equipment_ids'],
+            step=query['step'],
+        ),
+    }
+
+
+def free_slots_for(query_params, professional=None, room=None, equipment=None):
+    """
+    Respuesta de franjas libres a partir de los parámetros de la petición.
+
+    Un profesional, sala o equipo dados (los endpoints de detalle) sustituyen
+    al filtro correspondiente; si no, se consultan los profesionales de
+    ``professional_ids`` (o todos) y las salas operativas de ``room_ids`` (o
+    todas).
+    """
+    from resources.models import Room
+    from staff.models import ProfessionalProfile
+
+    query = parse_free_slot_query(query_params)
+    if equipment is not None:
+        query['equipment_ids'] = [equipment.pk]
+    if professional is not None:
+        professionals = [professional]
+    else:
+        professionals = ProfessionalProfile.objects.select_related('user')
+        if query['professional_ids']:
+            professionals = professionals.filter(pk__in=query['professional_ids'])
+    if room is not None:
+        rooms = [room]
+    else:
+        rooms = Room.objects.filter(is_active=True, status=Room.Status.AVAILABLE)
+        if query['room_ids']:
+            rooms = rooms.filter(pk__in=query['room_ids'])
+    return free_slots_payload(query, list(professionals), list(rooms))
@@ -0,0 +1,137 @@
+"""
+Backends de entrega de notificaciones por canal.
+
+Cada canal de ``Notification.Channel`` se asocia en ``NOTIFICATION_BACKENDS``
+a una clase con ``send_batch(notifications)``, que devuelve para cada
+notificación ``None`` si se entregó o el texto del error. Los backends
+incluidos sirven para desarrollo y para medir rendimiento sin servicios
+externos: el de email usa el ``EMAIL_BACKEND`` de Django (consola o fichero
+en local, SMTP en producción) y el de SMS simula una pasarela escribiendo en
+un fichero.
+"""
+import logging
+import random
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core import mail
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class BaseBackend:
+    """Entrega una a una; los backends con envío por lotes sobrescriben send_batch."""
+
+    def send(self, notification):
+        raise NotImplementedError
+
+    def send_batch(self, notifications):
+        errors = []
+        for notification in notifications:
+            try:
+                self.send(notification)
+            except Exception as exc:  # El error se guarda en la notificación
+                errors.append(str(exc) or exc.__class__.__name__)
+            else:
+                errors.append(None)
+        return errors
+
+
+class InAppBackend(BaseBackend):
+    """La notificación ya es visible en la aplicación: basta con marcarla como enviada."""
+
+    def send_batch(self, notifications):
+        return [None] * len(notifications)
+
+
+class LogBackend(BaseBackend):
+    """Registra el envío en el log (sustituto de push mientras no haya proveedor)."""
+
+    def send(self, notification):
+        logger.info('Notificación %s para el paciente %s: %s', notification.pk, notification.patient_id, notification.title)
+
+
+class EmailBackend(BaseBackend):
+    """Email a través de django.core.mail, con una sola conexión por lote."""
+
+    def send_batch(self, notifications):
+        errors = [None] * len(notifications)
+        messages = []
+        for position, notification in enumerate(notifications):
+            email = notification.patient.user.email
+            if not email:
+                errors[position] = 'El paciente no tiene email.'
+                continue
+            messages.append((position, mail.EmailMessage(
+                subject=notification.title,
+                body=notification.message,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                to=[email],
+            )))
+        if not messages:
+            return errors
+
+        if settings.EMAIL_BACKEND.endswith('filebased.EmailBackend'):
+            Path(settings.EMAIL_FILE_PATH).mkdir(parents=True, exist_ok=True)
+        connection = mail.get_connection()
+        try:
+            connection.open()
+            for position, message in messages:
+                try:
+                    connection.send_messages([message])
+                except Exception as exc:
+                    errors[position] = str(exc) or exc.__class__.__name__
+        except Exception as exc:
+            # Sin conexión con el servidor: falla todo el lote
+            for position, _ in messages:
+                errors[position] = str(exc) or exc.__class__.__name__
+        finally:
+            connection.close()
+        return errors
+
+
+class FakeSMSBackend(BaseBackend):
+    """Pasarela SMS simulada: escribe cada mensaje en un fichero.
+
+    ``FAKE_SMS_LATENCY_MS`` añade una espera por mensaje y
+    ``FAKE_SMS_FAILURE_RATE`` (0-1) provoca fallos aleatorios para probar los
+    reintentos.
+    """
+
+    def __init__(self):
+        config = settings.NOTIFICATION_DELIVERY
+        self.path = Path(config['FAKE_SMS_FILE'])
+        self.latency = config['FAKE_SMS_LATENCY_MS'] / 1000
+        self.failure_rate = config['FAKE_SMS_FAILURE_RATE']
+
+    def send_batch(self, notifications):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        errors = []
+        with self.path.open('a', encoding='utf-8') as output:
+            for notification in notifications:
+                if self.latency:
+                    time.sleep(self.latency)
+                phone = notification.patient.user.phone
+                if not phone:
+                    errors.append('El paciente no tiene teléfono.')
+                elif random.random() < self.failure_rate:
+                    errors.append('Pasarela SMS no disponible (fallo simulado).')
+                else:
+                    output.write(f'{phone}\t{notification.title}: {notification.message}\n')
+                    errors.append(None)
+        return errors
+
+
+_backends = {}
+
+
+def get_backend(channel):
+    """Instancia (cacheada) del backend configurado para un canal."""
+    path = settings.NOTIFICATION_BACKENDS.get(channel)
+    if path is None:
+        return None
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
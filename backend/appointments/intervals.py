@@ -0,0 +1,329 @@
+"""
+Índice en memoria de intervalos de citas activas.
+
+Mantiene, por cada profesional y cada sala, los intervalos [inicio, fin) de
+las citas PENDING/CONFIRMED ordenados por inicio, de modo que la comprobación
+de solapamiento se resuelve con una búsqueda binaria en lugar de una consulta
+a la base de datos.
+
+El índice vive en cada proceso: se construye desde la BD al arrancar el
+worker (``warm_up``) y se actualiza tras cada commit desde las señales de
+``Appointment``. Cuando tiene más de ``MAX_AGE`` segundos se reconstruye en un
+hilo aparte; mientras tanto las comprobaciones van a la BD.
+
+Limitación con varios workers: cada proceso solo ve al momento sus propias
+escrituras; las de otros workers (cancelaciones, cambios de hora, reservas)
+le llegan con la siguiente reconstrucción. Por eso el índice es solo un
+camino rápido: si no encuentra solapamiento se da por bueno (las restricciones
+de la migración 0006 son la garantía real ante reservas concurrentes), y si
+encuentra uno se confirma con una consulta indexada a la BD antes de rechazar
+la cita.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.dispatch import Signal
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('PENDING', 'CONFIRMED')
+
+PROFESSIONAL = 'professional'
+ROOM = 'room'
+
+DEFAULT_SETTINGS = {
+    'ENABLED': True,
+    'MAX_AGE': 300,
+    'HORIZON_DAYS': 1,
+}
+
+
+def get_index_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'APPOINTMENT_INTERVAL_INDEX', {})}
+
+
+class SortedIntervals:
+    """Intervalos semiabiertos [start, end) de un recurso, ordenados por inicio.
+
+    Los extremos se guardan como timestamps (float). ``_max_length`` es una
+    cota superior de la duración de cualquier intervalo almacenado y permite
+    cortar el recorrido hacia atrás aunque existan solapamientos heredados.
+    """
+
+    __slots__ = ('_starts', '_items', '_max_length')
+
+    def __init__(self, items=None):
+        items = sorted(items or [])
+        self._items = items
+        self._starts = [item[0] for item in items]
+        self._max_length = max((end - start for start, end, _ in items), default=0.0)
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, start, end, pk):
+        position = bisect_left(self._starts, start)
+        self._starts.insert(position, start)
+        self._items.insert(position, (start, end, pk))
+        self._max_length = max(self._max_length, end - start)
+
+    def remove(self, start, pk):
+        position = bisect_left(self._starts, start)
+        while position < len(self._starts) and self._starts[position] == start:
+            if self._items[position][2] == pk:
+                del self._starts[position]
+                del self._items[position]
+                return True
+            position += 1
+        return False
+
+    def find_overlap(self, start, end, exclude=None):
+        """Devuelve el pk de un intervalo que solapa con [start, end) o None."""
+        position = bisect_left(self._starts, end) - 1
+        lower_bound = start - self._max_length
+        while position >= 0 and self._starts[position] > lower_bound:
+            _, item_end, pk = self._items[position]
+            if item_end > start and pk != exclude:
+                return pk
+            position -= 1
+        return None
+
+
+class AppointmentIntervalIndex:
+    """Conjunto de ``SortedIntervals`` por (tipo de recurso, id de recurso)."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._trees = {}
+        self._entries = {}
+        self._built_at = None
+        self._horizon = None
+        self._rebuilding = False
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def is_fresh(self):
+        max_age = get_index_settings()['MAX_AGE']
+        built_at = self._built_at
+        return built_at is not None and not (max_age and time.monotonic() - built_at > max_age)
+
+    def rebuild(self):
+        """Carga desde la BD las citas activas que terminan después del horizonte."""
+        from .models import Appointment
+
+        config = get_index_settings()
+        horizon = timezone.now() - timedelta(days=config['HORIZON_DAYS'])
+        rows = Appointment.objects.filter(
+            status__in=ACTIVE_STATUSES,
+            end_time__gt=horizon,
+        ).values_list('pk', 'professional_id', 'room_id', 'start_time', 'end_time')
+
+        grouped = {}
+        entries = {}
+        for pk, professional_id, room_id, start_time, end_time in rows.iterator(chunk_size=5000):
+            start, end = start_time.timestamp(), end_time.timestamp()
+            keys = self._keys(professional_id, room_id)
+            for key in keys:
+                grouped.setdefault(key, []).append((start, end, pk))
+            entries[pk] = (keys, start)
+
+        trees = {key: SortedIntervals(items) for key, items in grouped.items()}
+        with self._lock:
+            self._trees = trees
+            self._entries = entries
+            self._horizon = horizon.timestamp()
+            self._built_at = time.monotonic()
+
+    def refresh_in_background(self):
+        """Reconstruye el índice en otro hilo (uno a la vez) sin bloquear la petición."""
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._background_rebuild, daemon=True).start()
+
+    def _background_rebuild(self):
+        from django.db import connection
+
+        try:
+            self.rebuild()
+        except DatabaseError:
+            logger.exception('No se pudo reconstruir el índice de intervalos de citas.')
+        finally:
+            # Conexión propia del hilo
+            connection.close()
+            with self._lock:
+                self._rebuilding = False
+
+    def clear(self):
+        with self._lock:
+            self._trees = {}
+            self._entries = {}
+            self._built_at = None
+            self._horizon = None
+
+    def sync(self, pk, professional_id, room_id, start_time, end_time, status):
+        """Refleja en el índice el estado actual de una cita."""
+        if not self.is_built:
+            return
+        with self._lock:
+            self._discard(pk)
+            if status in ACTIVE_STATUSES and end_time.timestamp() > self._horizon:
+                start, end = start_time.timestamp(), end_time.timestamp()
+                keys = self._keys(professional_id, room_id)
+                for key in keys:
+                    self._trees.setdefault(key, SortedIntervals()).add(start, end, pk)
+                self._entries[pk] = (keys, start)
+
+    def discard(self, pk):
+        if not self.is_built:
+            return
+        with self._lock:
+            self._discard(pk)
+
+    def covers(self, start_time):
+        """Indica si el índice puede responder sobre intervalos que empiezan en start_time."""
+        return self._horizon is not None and start_time.timestamp() >= self._horizon
+
+    def find_overlap(self, kind, resource_id, start_time, end_time, exclude_pk=None):
+        with self._lock:
+            tree = self._trees.get((kind, resource_id))
+            if tree is None:
+                return None
+            return tree.find_overlap(start_time.timestamp(), end_time.timestamp(), exclude_pk)
+
+    def _discard(self, pk):
+        entry = self._entries.pop(pk, None)
+        if entry is None:
+            return
+        keys, start = entry
+        for key in keys:
+            tree = self._trees.get(key)
+            if tree is not None:
+                tree.remove(start, pk)
+
+    @staticmethod
+    def _keys(professional_id, room_id):
+        keys = []
+        if professional_id is not None:
+            keys.append((PROFESSIONAL, professional_id))
+        if room_id is not None:
+            keys.append((ROOM, room_id))
+        return tuple(keys)
+
+
+appointment_index = AppointmentIntervalIndex()
+
+
+# Se emite tras el commit de escrituras de citas que no pasan por save()
+# (bulk_create, update), que no disparan post_save. Argumento: ``pks``.
+appointments_bulk_changed = Signal()
+
+
+def sync_after_commit(appointments):
+    """Actualiza el índice para citas escritas sin save() (bulk_create, update)."""
+    rows = [
+        (
+            appointment.pk,
+            appointment.professional_id,
+            appointment.room_id,
+            appointment.start_time,
+            appointment.end_time,
+            appointment.status,
+        )
+        for appointment in appointments
+    ]
+
+    def apply():
+        for row in rows:
+            appointment_index.sync(*row)
+        appointments_bulk_changed.send(sender=None, pks=[row[0] for row in rows])
+
+    transaction.on_commit(apply)
+
+
+def warm_up():
+    """Construir el índice al arrancar el worker (si está habilitado)."""
+    if not get_index_settings()['ENABLED']:
+        return
+    try:
+        appointment_index.rebuild()
+    except DatabaseError:
+        # Sin tablas (p. ej. antes de migrar): se construirá en el primer uso
+        logger.warning('No se pudo construir el índice de intervalos de citas al arrancar.')
+
+
+def query_overlap(kind, resource_id, start_time, end_time, exclude_pk=None):
+    """Comprobación de solapamiento contra la BD (camino sin índice)."""
+    from .models import Appointment
+
+    queryset = Appointment.objects.filter(
+        **{f'{kind}_id': resource_id},
+        status__in=ACTIVE_STATUSES,
+        start_time__lt=end_time,
+        end_time__gt=start_time,
+    )
+    if exclude_pk is not None:
+        queryset = queryset.exclude(pk=exclude_pk)
+    return queryset.exists()
+
+
+def equipment_conflicts(equipment_ids, start_time, end_time, exclude_pk=None):
+    """
+    Devuelve {id de equipo: motivo} para los equipos que no pueden usarse en
+    [start_time, end_time): fuera de servicio o reservados en otra cita activa.
+
+    Los equipos no están en el índice en memoria (cambian por M2M, sin
+    post_save); se comprueban todos a la vez con una sola consulta.
+    """
+    from django.db.models import Exists, OuterRef
+
+    from resources.models import Equipment
+
+    from .models import Appointment
+
+    equipment_ids = list(equipment_ids)
+    if not equipment_ids:
+        return {}
+    bookings = Appointment.equipment.through.objects.filter(
+        equipment_id=OuterRef('pk'),
+        appointment__status__in=ACTIVE_STATUSES,
+        appointment__start_time__lt=end_time,
+        appointment__end_time__gt=start_time,
+    )
+    if exclude_pk is not None:
+        bookings = bookings.exclude(appointment_id=exclude_pk)
+    rows = Equipment.objects.filter(pk__in=equipment_ids).annotate(
+        booked=Exists(bookings),
+    ).values_list('pk', 'name', 'status', 'is_active', 'booked')
+
+    conflicts = {}
+    for pk, name, status, is_active, booked in rows:
+        if status != Equipment.Status.AVAILABLE or not is_active:
+            conflicts[pk] = f'El equipo {name} no está disponible.'
+        elif booked:
+            conflicts[pk] = f'El equipo {name} ya está reservado en ese horario.'
+    return conflicts
+
+
+def has_overlap(kind, resource_id, start_time, end_time, exclude_pk=None):
+    """Indica si el recurso tiene alguna cita activa que solape con [start_time, end_time)."""
+    if resource_id is None:
+        return False
+    if get_index_settings()['ENABLED'] and appointment_index.is_built:
+        if not appointment_index.is_fresh():
+            appointment_index.refresh_in_background()
+        elif appointment_index.covers(start_time):
+            found = appointment_index.find_overlap(kind, resource_id, start_time, end_time, exclude_pk)
+            if found is None:
+                return False
+            # Puede ser una cita ya cancelada o movida desde otro worker: confirmar en la BD
+    return query_overlap(kind, resource_id, start_time, end_time, exclude_pk)
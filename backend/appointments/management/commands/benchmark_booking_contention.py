@@ -0,0 +1,115 @@
+"""
+Management command para medir la contención al reservar la misma franja
+desde varios hilos a la vez. Comprueba que la base de datos solo admite una
+de las reservas concurrentes.
+Uso: python manage.py benchmark_booking_contention --threads 16 --rounds 20
+
+Crea sus propios datos de prueba y los elimina al terminar.
+"""
+import threading
+import time
+from datetime import timedelta
+from statistics import median
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+from django.utils import timezone
+
+from appointments.models import Appointment
+from patients.models import PatientProfile
+from resources.models import Room
+from staff.models import ProfessionalProfile
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Lanza N hilos que reservan la misma franja y mide aciertos, rechazos y latencia'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--rounds', type=int, default=10)
+
+    def handle(self, *args, **options):
+        suffix = int(time.time())
+        patient_user = User.objects.create(username=f'contention.patient.{suffix}')
+        professional_user = User.objects.create(
+            username=f'contention.professional.{suffix}',
+            role=User.Roles.PROFESSIONAL,
+        )
+        patient = PatientProfile.objects.create(user=patient_user)
+        professional = ProfessionalProfile.objects.create(
+            user=professional_user,
+            specialty='Benchmark',
+            license_number=f'CONTENTION-{suffix}',
+            working_days='LUN-VIE',
+        )
+        room = Room.objects.create(name=f'Contención {suffix}')
+
+        try:
+            totals = {'booked': 0, 'rejected': 0, 'errors': 0}
+            latencies = []
+            base = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=2)
+            started = time.perf_counter()
+            for round_number in range(options['rounds']):
+                start = base + timedelta(hours=round_number)
+                outcome = self.run_round(options['threads'], patient, professional, room, start)
+                for key in totals:
+                    totals[key] += outcome[key]
+                latencies.extend(outcome['latencies'])
+                if outcome['booked'] != 1:
+                    self.stderr.write(self.style.ERROR(
+                        f"Ronda {round_number}: {outcome['booked']} reservas aceptadas para la misma franja."
+                    ))
+            elapsed = time.perf_counter() - started
+
+            attempts = options['threads'] * options['rounds']
+            self.stdout.write(f'Intentos: {attempts} ({options["threads"]} hilos x {options["rounds"]} rondas)')
+            self.stdout.write(f"Aceptadas: {totals['booked']}  Rechazadas: {totals['rejected']}  Errores: {totals['errors']}")
+            self.stdout.write(f'Latencia mediana: {median(latencies) * 1000:.1f} ms  máxima: {max(latencies) * 1000:.1f} ms')
+            self.stdout.write(f'Rendimiento: {attempts / elapsed:.0f} intentos/s')
+        finally:
+            Appointment.objects.filter(professional=professional).delete()
+            room.delete()
+            professional.delete()
+            patient.delete()
+            patient_user.delete()
+            professional_user.delete()
+
+    def run_round(self, threads, patient, professional, room, start):
+        barrier = threading.Barrier(threads)
+        lock = threading.Lock()
+        outcome = {'booked': 0, 'rejected': 0, 'errors': 0, 'latencies': []}
+
+        def book():
+            barrier.wait()
+            began = time.perf_counter()
+            try:
+                Appointment(
+                    patient=patient,
+                    professional=professional,
+                    room=room,
+                    start_time=start,
+                    end_time=start + timedelta(minutes=30),
+                    treatment_type='Benchmark',
+                ).save()
+                result = 'booked'
+            except ValidationError:
+                result = 'rejected'
+            except OperationalError:
+                # p. ej. "database is locked" en SQLite
+                result = 'errors'
+            finally:
+                connections.close_all()
+            with lock:
+                outcome[result] += 1
+                outcome['latencies'].append(time.perf_counter() - began)
+
+        workers = [threading.Thread(target=book) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return outcome
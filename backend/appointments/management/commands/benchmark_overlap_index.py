@@ -0,0 +1,137 @@
+"""
+Management command para comparar la comprobación de solapamiento mediante el
+índice de intervalos en memoria frente a la consulta a la base de datos.
+Uso: python manage.py benchmark_overlap_index --sizes 10000 100000 1000000
+
+Los datos se crean dentro de una transacción que se revierte al terminar.
+"""
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from appointments.intervals import (
+    PROFESSIONAL,
+    ROOM,
+    AppointmentIntervalIndex,
+    query_overlap,
+)
+from appointments.models import Appointment
+from patients.models import PatientProfile
+from resources.models import Room
+from staff.models import ProfessionalProfile
+
+User = get_user_model()
+
+SLOT = timedelta(minutes=30)
+
+
+class Command(BaseCommand):
+    help = 'Compara el índice de intervalos en memoria con la consulta de solapamiento en BD'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000, 1000000])
+        parser.add_argument('--lookups', type=int, default=1000)
+        parser.add_argument('--resources', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        with transaction.atomic():
+            self.run(options)
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Datos de prueba revertidos.'))
+
+    def run(self, options):
+        resources = options['resources']
+        patient, professionals, rooms = self.create_resources(resources)
+        base = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=2)
+
+        self.stdout.write(
+            f"{'citas':>10} {'rebuild (s)':>12} {'índice (µs)':>12} {'BD (µs)':>12} {'mejora':>8}"
+        )
+        created = 0
+        for size in sorted(options['sizes']):
+            batch = []
+            for position in range(created, size):
+                # Cada par profesional/sala recibe franjas consecutivas sin solapamiento
+                resource = position % resources
+                start = base + SLOT * (position // resources)
+                batch.append(Appointment(
+                    patient=patient,
+                    professional=professionals[resource],
+                    room=rooms[resource],
+                    start_time=start,
+                    end_time=start + SLOT,
+                    status=Appointment.Status.CONFIRMED,
+                    treatment_type='Benchmark',
+                ))
+                if len(batch) >= options['batch_size']:
+                    Appointment.objects.bulk_create(batch)
+                    batch = []
+            if batch:
+                Appointment.objects.bulk_create(batch)
+            created = size
+
+            span = SLOT * (size // resources + 1)
+            lookups = [
+                (
+                    random.choice((PROFESSIONAL, ROOM)),
+                    random.randrange(resources),
+                    base + timedelta(seconds=random.uniform(0, span.total_seconds())),
+                )
+                for _ in range(options['lookups'])
+            ]
+            lookups = [
+                (kind, (professionals if kind == PROFESSIONAL else rooms)[resource].pk, start, start + SLOT)
+                for kind, resource, start in lookups
+            ]
+
+            index = AppointmentIntervalIndex()
+            started = time.perf_counter()
+            index.rebuild()
+            rebuild_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            index_hits = [index.find_overlap(*lookup) is not None for lookup in lookups]
+            index_us = (time.perf_counter() - started) / len(lookups) * 1e6
+
+            started = time.perf_counter()
+            query_hits = [query_overlap(*lookup) for lookup in lookups]
+            query_us = (time.perf_counter() - started) / len(lookups) * 1e6
+
+            if index_hits != query_hits:
+                self.stderr.write(self.style.ERROR(f'Resultados distintos con {size} citas.'))
+
+            self.stdout.write(
+                f'{size:>10} {rebuild_seconds:>12.2f} {index_us:>12.1f} {query_us:>12.1f} '
+                f'{query_us / index_us:>7.0f}x'
+            )
+
+    def create_resources(self, count):
+        suffix = int(time.time())
+        patient_user = User.objects.create(
+            username=f'benchmark.patient.{suffix}',
+            role=User.Roles.PATIENT,
+        )
+        patient = PatientProfile.objects.create(user=patient_user)
+        professionals = []
+        rooms = []
+        for number in range(count):
+            user = User.objects.create(
+                username=f'benchmark.professional.{suffix}.{number}',
+                role=User.Roles.PROFESSIONAL,
+            )
+            professionals.append(ProfessionalProfile.objects.create(
+                user=user,
+                specialty='Benchmark',
+                license_number=f'BENCH-{suffix}-{number}',
+                working_days='LUN-VIE',
+            ))
+            rooms.append(Room.objects.create(name=f'Benchmark {suffix} {number}'))
+        return patient, professionals, rooms
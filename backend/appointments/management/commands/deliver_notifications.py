@@ -0,0 +1,42 @@
+"""
+Management command que entrega las notificaciones pendientes del outbox por
+su canal (email, SMS, push, en la aplicación).
+Uso: python manage.py deliver_notifications [--batch-size 100] [--loop --interval 5]
+
+Pueden ejecutarse varios workers a la vez: cada uno reclama lotes distintos.
+"""
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from appointments.outbox import get_delivery_settings, run_once
+
+
+class Command(BaseCommand):
+    help = 'Entrega por lotes las notificaciones pendientes y programa los reintentos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--max-batches', type=int, default=None, help='Lotes como máximo por ejecución')
+        parser.add_argument('--loop', action='store_true', help='Repetir indefinidamente')
+        parser.add_argument('--interval', type=float, default=5, help='Segundos de espera con la cola vacía')
+
+    def handle(self, *args, **options):
+        worker = f'{uuid.uuid4().hex[:12]}'
+        batch_size = options['batch_size'] or get_delivery_settings()['BATCH_SIZE']
+        while True:
+            started = time.perf_counter()
+            totals = run_once(worker, batch_size, options['max_batches'])
+            elapsed = time.perf_counter() - started
+            delivered = totals['sent'] + totals['failed']
+            if delivered or not options['loop']:
+                rate = delivered / elapsed if elapsed else 0
+                self.stdout.write(self.style.SUCCESS(
+                    f"Enviadas: {totals['sent']}, fallidas: {totals['failed']} "
+                    f"en {totals['batches']} lotes ({elapsed:.2f}s, {rate:.0f} notificaciones/s)"
+                ))
+            if not options['loop']:
+                break
+            if not delivered:
+                time.sleep(options['interval'])
@@ -0,0 +1,54 @@
+"""
+Management command de retención de notificaciones: archiva (o elimina) por
+lotes las notificaciones leídas antiguas y caduca el archivo.
+Uso: python manage.py purge_notifications [--mode archive|delete] [--older-than-days 90]
+
+Con --dry-run solo informa de cuántas notificaciones se procesarían.
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from appointments.models import Notification
+from appointments.retention import get_retention_settings, run_retention
+
+
+class Command(BaseCommand):
+    help = 'Archiva o elimina por lotes las notificaciones leídas antiguas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['archive', 'delete'], default=None)
+        parser.add_argument('--older-than-days', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--max-batches', type=int, default=None, help='Lotes como máximo por ejecución')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        config = get_retention_settings()
+        if options['dry_run']:
+            days = config['READ_MAX_AGE_DAYS'] if options['older_than_days'] is None else options['older_than_days']
+            eligible = Notification.objects.filter(
+                read_at__isnull=False,
+                created_at__lt=timezone.now() - timedelta(days=days),
+                delivery_status__in=[Notification.DeliveryStatus.SENT, Notification.DeliveryStatus.DEAD],
+            ).count()
+            self.stdout.write(f'Notificaciones que se procesarían: {eligible}')
+            return
+
+        metrics = run_retention(
+            mode=options['mode'],
+            max_age_days=options['older_than_days'],
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+        )
+        rate = metrics['deleted'] / metrics['elapsed'] if metrics['elapsed'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Lotes: {metrics['batches']}, archivadas: {metrics['archived']}, "
+            f"eliminadas: {metrics['deleted']} ({metrics['elapsed']:.2f}s, {rate:.0f} filas/s)"
+        ))
+        if 'partitions_dropped' in metrics:
+            self.stdout.write(
+                f"Archivo: {metrics['partitions_dropped']} particiones eliminadas, "
+                f"{metrics['archive_deleted']} filas eliminadas"
+            )
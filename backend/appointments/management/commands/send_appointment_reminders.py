@@ -0,0 +1,45 @@
+"""
+Management command que programa los recordatorios de citas confirmadas
+(24 h y 2 h antes) creando sus notificaciones por bloques.
+Uso: python manage.py send_appointment_reminders [--loop --interval 300]
+
+Es idempotente: puede ejecutarse desde cron cada pocos minutos o dejarse en
+marcha como worker con --loop.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from appointments.models import Notification
+from appointments.reminders import DEFAULT_CHUNK_SIZE, schedule_reminders
+
+
+class Command(BaseCommand):
+    help = 'Crea los recordatorios de las citas confirmadas que empiezan en las próximas 24 h'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument(
+            '--channel',
+            choices=Notification.Channel.values,
+            default=Notification.Channel.IN_APP,
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Solo cuenta los recordatorios pendientes')
+        parser.add_argument('--loop', action='store_true', help='Repetir indefinidamente')
+        parser.add_argument('--interval', type=int, default=300, help='Segundos entre ejecuciones con --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            created = schedule_reminders(
+                chunk_size=options['chunk_size'],
+                channel=options['channel'],
+                dry_run=options['dry_run'],
+            )
+            elapsed = time.perf_counter() - started
+            summary = ', '.join(f'{window}: {count}' for window, count in created.items())
+            verb = 'pendientes' if options['dry_run'] else 'creados'
+            self.stdout.write(self.style.SUCCESS(f'Recordatorios {verb} ({summary}) en {elapsed:.2f}s'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,127 @@
+# Restricciones de no solapamiento en base de datos.
+# PostgreSQL: restricciones de exclusión GiST sobre tstzrange(start_time, end_time).
+# SQLite: triggers equivalentes que abortan la inserción o actualización.
+# Antes de crearlas se comprueba que no haya ya citas activas solapadas: en
+# ese caso la migración se detiene con la lista de citas a revisar.
+#
+# Atención (SQLite): muchas operaciones posteriores sobre appointments_appointment
+# (AlterField, RemoveField, cambios de restricciones...) hacen que Django rehaga
+# la tabla (crear otra, copiar y renombrar) y los triggers se pierden sin aviso.
+# Una migración así debe volver a crearlos con create_guards de este módulo;
+# OverlapGuardTests comprueba en sqlite_master que siguen existiendo.
+
+from django.db import migrations
+
+ACTIVE_STATUSES = "('PENDING', 'CONFIRMED')"
+GUARDS = (
+    ('professional_id', 'appointment_professional_no_overlap'),
+    ('room_id', 'appointment_room_no_overlap'),
+)
+
+SQLITE_TRIGGER = """
+CREATE TRIGGER {name}_{operation}
+BEFORE {event} ON appointments_appointment
+WHEN NEW.status IN {statuses}
+BEGIN
+    SELECT RAISE(ABORT, '{name}')
+    WHERE EXISTS (
+        SELECT 1 FROM appointments_appointment AS other
+        WHERE other.{column} = NEW.{column}
+          AND other.status IN {statuses}
+          AND other.start_time < NEW.end_time
+          AND other.end_time > NEW.start_time
+          {exclude_self}
+    );
+END;
+"""
+
+
+OVERLAP_QUERY = """
+SELECT earlier.id, later.id
+FROM appointments_appointment AS earlier
+JOIN appointments_appointment AS later
+  ON later.{column} = earlier.{column}
+ AND later.id > earlier.id
+ AND later.start_time < earlier.end_time
+ AND later.end_time > earlier.start_time
+WHERE earlier.status IN {statuses}
+  AND later.status IN {statuses}
+ORDER BY earlier.id, later.id
+"""
+
+
+def find_overlaps(connection):
+    """Pares de citas activas que ya se solapan, por columna de la restricción."""
+    overlaps = {}
+    with connection.cursor() as cursor:
+        for column, _ in GUARDS:
+            cursor.execute(OVERLAP_QUERY.format(column=column, statuses=ACTIVE_STATUSES))
+            pairs = cursor.fetchall()
+            if pairs:
+                overlaps[column] = pairs
+    return overlaps
+
+
+def check_existing_overlaps(apps, schema_editor):
+    overlaps = find_overlaps(schema_editor.connection)
+    if overlaps:
+        lines = [
+            f'  {column}: ' + ', '.join(f'{first}/{second}' for first, second in pairs)
+            for column, pairs in overlaps.items()
+        ]
+        raise RuntimeError(
+            'Hay citas activas solapadas; cancele o mueva una de cada par y vuelva a migrar:\n'
+            + '\n'.join(lines)
+        )
+
+
+def create_guards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist;')
+        for column, name in GUARDS:
+            schema_editor.execute(
+                f'ALTER TABLE appointments_appointment ADD CONSTRAINT {name} '
+                f"EXCLUDE USING gist ({column} WITH =, tstzrange(start_time, end_time, '[)') WITH &&) "
+                f'WHERE (status IN {ACTIVE_STATUSES});'
+            )
+    elif vendor == 'sqlite':
+        for column, name in GUARDS:
+            schema_editor.execute(SQLITE_TRIGGER.format(
+                name=name,
+                operation='insert',
+                event='INSERT',
+                column=column,
+                statuses=ACTIVE_STATUSES,
+                exclude_self='',
+            ))
+            schema_editor.execute(SQLITE_TRIGGER.format(
+                name=name,
+                operation='update',
+                event=f'UPDATE OF {column}, start_time, end_time, status',
+                column=column,
+                statuses=ACTIVE_STATUSES,
+                exclude_self='AND other.id <> NEW.id',
+            ))
+
+
+def drop_guards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for _, name in GUARDS:
+        if vendor == 'postgresql':
+            schema_editor.execute(f'ALTER TABLE appointments_appointment DROP CONSTRAINT IF EXISTS {name};')
+        elif vendor == 'sqlite':
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}_insert;')
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}_update;')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0005_appointmenteditlock'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_existing_overlaps, migrations.RunPython.noop),
+        migrations.RunPython(create_guards, drop_guards),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.14 on 2026-10-18 14:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0006_appointment_no_overlap_guards'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['start_time', 'id'], name='appointment_start_t_073569_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['created_at', 'id'], name='appointment_created_23786c_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.14 on 2026-10-18 14:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0007_appointment_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['professional', 'status', 'start_time'], name='appointment_profess_d17d4f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['room', 'status', 'start_time'], name='appointment_room_id_d70d42_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['patient', 'start_time'], name='appointment_patient_fbd73b_idx'),
+        ),
+    ]
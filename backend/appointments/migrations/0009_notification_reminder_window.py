@@ -0,0 +1,26 @@
+# Generated by Django 5.0.14 on 2026-10-18 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0008_appointment_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='reminder_window',
+            field=models.CharField(blank=True, choices=[('24H', '24 horas antes'), ('2H', '2 horas antes')], default='', max_length=5),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['status', 'start_time'], name='appointment_status_74937b_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('reminder_window', ''), _negated=True), fields=('appointment', 'reminder_window'), name='notification_unique_reminder_window'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.0.14 on 2026-10-18 15:31
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def mark_sent(apps, schema_editor):
+    # Las notificaciones anteriores al outbox ya se mostraron o enviaron al
+    # crearlas (sent_at no se rellenaba): ninguna debe volver a la cola
+    Notification = apps.get_model('appointments', 'Notification')
+    Notification.objects.filter(sent_at__isnull=True).update(sent_at=models.F('created_at'))
+    Notification.objects.update(delivery_status='SENT')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0009_notification_reminder_window'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='claimed_by',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='delivery_status',
+            field=models.CharField(choices=[('PENDING', 'Pendiente'), ('SENDING', 'Enviando'), ('RETRY', 'Reintento programado'), ('SENT', 'Enviada'), ('DEAD', 'Descartada')], default='PENDING', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='last_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['delivery_status', 'next_attempt_at'], name='appointment_deliver_b5127e_idx'),
+        ),
+        migrations.RunPython(mark_sent, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.14 on 2026-10-18 15:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0010_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('read_at__isnull', True)), fields=['patient', 'created_at'], name='notification_unread_idx'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.0.14 on 2026-10-18 16:10
+# En PostgreSQL el archivo de notificaciones se crea particionado por mes de
+# created_at: la retención elimina particiones completas en lugar de filas.
+# Las particiones se crean bajo demanda (appointments.retention).
+
+from django.db import migrations, models
+
+PARTITIONED_TABLE = """
+CREATE TABLE appointments_notificationarchive (
+    id bigint NOT NULL,
+    patient_id bigint NOT NULL,
+    appointment_id bigint NULL,
+    notification_type varchar(30) NOT NULL,
+    channel varchar(20) NOT NULL,
+    title varchar(255) NOT NULL,
+    message text NOT NULL,
+    created_at timestamp with time zone NOT NULL,
+    sent_at timestamp with time zone NULL,
+    read_at timestamp with time zone NULL,
+    archived_at timestamp with time zone NOT NULL,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+"""
+
+
+def partition_archive(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP TABLE appointments_notificationarchive;')
+    schema_editor.execute(PARTITIONED_TABLE)
+    schema_editor.execute(
+        'CREATE INDEX notification_archive_patient ON appointments_notificationarchive (patient_id, created_at);'
+    )
+    schema_editor.execute(
+        'CREATE INDEX notification_archive_created ON appointments_notificationarchive (created_at);'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0011_notification_unread_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('patient_id', models.BigIntegerField()),
+                ('appointment_id', models.BigIntegerField(blank=True, null=True)),
+                ('notification_type', models.CharField(choices=[('APPOINTMENT_REMINDER', 'Recordatorio de cita'), ('APPOINTMENT_CONFIRMED', 'Cita confirmada'), ('APPOINTMENT_CANCELLED', 'Cita cancelada'), ('APPOINTMENT_MODIFIED', 'Cita modificada'), ('BUDGET_READY', 'Presupuesto disponible'), ('INVOICE_ISSUED', 'Factura emitida')], max_length=30)),
+                ('channel', models.CharField(choices=[('EMAIL', 'Email'), ('SMS', 'SMS'), ('PUSH', 'Push Notification'), ('IN_APP', 'En la aplicación')], max_length=20)),
+                ('title', models.CharField(max_length=255)),
+                ('message', models.TextField()),
+                ('created_at', models.DateTimeField()),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('read_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['patient_id', 'created_at'], name='notification_archive_patient'), models.Index(fields=['created_at'], name='notification_archive_created')],
+            },
+        ),
+        migrations.RunPython(partition_archive, migrations.RunPython.noop),
+    ]
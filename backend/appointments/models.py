@@ -1,9 +1,21 @@
 from django.conf import settings
-from django.db import models
+from django.db import IntegrityError, models
 from django.db import transaction
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
+from .intervals import ACTIVE_STATUSES, PROFESSIONAL, ROOM, has_overlap, sync_after_commit
+
+# Restricciones de no solapamiento creadas en la migración 0006
+OVERLAP_CONSTRAINT_MESSAGES = {
+    'appointment_professional_no_overlap': 'Ya existe una cita en ese horario para este profesional.',
+    'appointment_room_no_overlap': 'La sala no está disponible en ese horario.',
+}
+
+
+class StaleVersionError(Exception):
+    """La cita ha cambiado de versión desde que se leyó (otro usuario la ha modificado)."""
+
 
 class Appointment(models.Model):
     class Status(models.TextChoices):
@@ -53,9 +65,17 @@ class Appointment(models.Model):
 
     class Meta:
         ordering = ['start_time']
+        indexes = [
+            models.Index(fields=['start_time', 'id']),
+            models.Index(fields=['professional', 'status', 'start_time']),
+            models.Index(fields=['room', 'status', 'start_time']),
+            models.Index(fields=['patient', 'start_time']),
+            models.Index(fields=['status', 'start_time']),
+        ]
         constraints = [
             # Solo validamos que end_time > start_time
-            # La validación de solapamiento se hace en clean() y en el serializer
+            # El solapamiento lo impiden las restricciones de exclusión (PostgreSQL)
+            # o los triggers (SQLite) de la migración 0006
             models.CheckConstraint(
                 check=models.Q(end_time__gt=models.F('start_time')),
                 name='end_time_after_start_time',
@@ -70,49 +90,75 @@ class Appointment(models.Model):
         if self.end_time <= self.start_time:
             raise ValidationError('La hora de fin debe ser posterior a la hora de inicio.')
         
+        # Las citas canceladas o completadas no ocupan franja
+        if self.status not in ACTIVE_STATUSES:
+            return
+
         # Validar que no haya solapamiento con otras citas para el mismo profesional
-        if self.pk:
-            overlapping_professional = Appointment.objects.filter(
-                professional=self.professional,
-                status__in=[Appointment.Status.PENDING, Appointment.Status.CONFIRMED],
-                start_time__lt=self.end_time,
-                end_time__gt=self.start_time,
-            ).exclude(pk=self.pk)
-        else:
-            overlapping_professional = Appointment.objects.filter(
-                professional=self.professional,
-                status__in=[Appointment.Status.PENDING, Appointment.Status.CONFIRMED],
-                start_time__lt=self.end_time,
-                end_time__gt=self.start_time,
-            )
-        
-        if overlapping_professional.exists():
+        if has_overlap(PROFESSIONAL, self.professional_id, self.start_time, self.end_time, exclude_pk=self.pk):
             raise ValidationError('Ya existe una cita en ese horario para este profesional.')
-        
+
         # Validar que no haya solapamiento con otras citas para la misma sala
-        if self.pk:
-            overlapping_room = Appointment.objects.filter(
-                room=self.room,
-                status__in=[Appointment.Status.PENDING, Appointment.Status.CONFIRMED],
-                start_time__lt=self.end_time,
-                end_time__gt=self.start_time,
-            ).exclude(pk=self.pk)
-        else:
-            overlapping_room = Appointment.objects.filter(
-                room=self.room,
-                status__in=[Appointment.Status.PENDING, Appointment.Status.CONFIRMED],
-                start_time__lt=self.end_time,
-                end_time__gt=self.start_time,
-            )
-        
-        if overlapping_room.exists():
+        if has_overlap(ROOM, self.room_id, self.start_time, self.end_time, exclude_pk=self.pk):
             raise ValidationError('La sala no está disponible en ese horario.')
 
     def save(self, *args, **kwargs):
-        self.full_clean()
+        # Las claves foráneas y el no solapamiento los garantiza la base de datos
+        # (migración 0006); aquí solo se validan los campos y el índice en memoria,
+        # de modo que una reserva cuesta un único INSERT.
+        self.clean_fields(exclude=['patient', 'professional', 'room', 'created_by'])
+        self.clean()
         if self.pk:
             self.version += 1
-        super().save(*args, **kwargs)
+        try:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+        except IntegrityError as exc:
+            if self.pk:
+                self.version -= 1
+            self._raise_overlap_error(exc)
+
+    def save_if_version(self, fields, expected_version=None):
+        """
+        Guarda ``fields`` con un UPDATE condicional sobre la versión
+        (``UPDATE ... WHERE id = %s AND version = %s``).
+
+        Si ninguna fila cambia, otro usuario ha modificado la cita desde que se
+        leyó y se lanza ``StaleVersionError``. Por defecto se compara con la
+        versión cargada en la instancia.
+        """
+        if expected_version is None:
+            expected_version = self.version
+        self.clean_fields(exclude=['patient', 'professional', 'room', 'created_by'])
+        self.clean()
+
+        values = {}
+        for name in fields:
+            attname = self._meta.get_field(name).attname
+            values[attname] = getattr(self, attname)
+        values['updated_at'] = timezone.now()
+        try:
+            with transaction.atomic():
+                updated = Appointment.objects.filter(pk=self.pk, version=expected_version).update(
+                    version=models.F('version') + 1,
+                    **values,
+                )
+        except IntegrityError as exc:
+            self._raise_overlap_error(exc)
+        if not updated:
+            raise StaleVersionError(self.pk)
+
+        self.version = expected_version + 1
+        self.updated_at = values['updated_at']
+        # update() no emite post_save: actualizar el índice de intervalos a mano
+        sync_after_commit([self])
+
+    @staticmethod
+    def _raise_overlap_error(exc):
+        for constraint, message in OVERLAP_CONSTRAINT_MESSAGES.items():
+            if constraint in str(exc):
+                raise ValidationError(message) from exc
+        raise exc
 
     def can_be_cancelled(self, user):
         """Verifica si la cita puede ser cancelada por el usuario"""
@@ -131,7 +177,7 @@ class Appointment(models.Model):
         return True, None
 
     @transaction.atomic
-    def cancel(self, user, reason=None):
+    def cancel(self, user, reason=None, expected_version=None):
         """Cancela la cita con validaciones"""
         can_cancel, error = self.can_be_cancelled(user)
         if not can_cancel:
@@ -140,7 +186,7 @@ class Appointment(models.Model):
         self.status = Appointment.Status.CANCELLED
         if reason:
             self.notes = f"{self.notes}\n\nCancelación: {reason}".strip()
-        self.save(update_fields=['status', 'notes'])
+        self.save_if_version(['status', 'notes'], expected_version)
 
 
 class Notification(models.Model):
@@ -159,6 +205,17 @@ class Notification(models.Model):
         PUSH = 'PUSH', 'Push Notification'
         IN_APP = 'IN_APP', 'En la aplicación'
 
+    class DeliveryStatus(models.TextChoices):
+        PENDING = 'PENDING', 'Pendiente'
+        SENDING = 'SENDING', 'Enviando'
+        RETRY = 'RETRY', 'Reintento programado'
+        SENT = 'SENT', 'Enviada'
+        DEAD = 'DEAD', 'Descartada'
+
+    class ReminderWindow(models.TextChoices):
+        DAY_BEFORE = '24H', '24 horas antes'
+        TWO_HOURS = '2H', '2 horas antes'
+
     appointment = models.ForeignKey(
         Appointment,
         on_delete=models.CASCADE,
@@ -180,14 +237,78 @@ class Notification(models.Model):
         choices=Channel.choices,
         default=Channel.IN_APP,
     )
+    reminder_window = models.CharField(
+        max_length=5,
+        choices=ReminderWindow.choices,
+        blank=True,
+        default='',
+    )
     title = models.CharField(max_length=255)
     message = models.TextField()
     sent_at = models.DateTimeField(null=True, blank=True)
     read_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Outbox: estado de entrega por el canal (appointments.outbox)
+    delivery_status = models.CharField(
+        max_length=10,
+        choices=DeliveryStatus.choices,
+        default=DeliveryStatus.PENDING,
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=64, blank=True)
+    last_error = models.TextField(blank=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['delivery_status', 'next_attempt_at']),
+            # Índice parcial: solo las no leídas (contador de la campana sin recorrer la tabla)
+            models.Index(
+                fields=['patient', 'created_at'],
+                condition=models.Q(read_at__isnull=True),
+                name='notification_unread_idx',
+            ),
+        ]
+        constraints = [
+            # Un único recordatorio por cita y ventana (idempotencia del programador)
+            models.UniqueConstraint(
+                fields=['appointment', 'reminder_window'],
+                condition=~models.Q(reminder_window=''),
+                name='notification_unique_reminder_window',
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"{self.notification_type} - {self.patient}"
+
+
+class NotificationArchive(models.Model):
+    """Copia compacta de notificaciones leídas antiguas (appointments.retention).
+
+    Sin claves foráneas ni campos de entrega: solo lo necesario para el
+    historial del paciente. En PostgreSQL la tabla está particionada por mes
+    de ``created_at`` (migración 0012) y la retención elimina particiones.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    patient_id = models.BigIntegerField()
+    appointment_id = models.BigIntegerField(null=True, blank=True)
+    notification_type = models.CharField(max_length=30, choices=Notification.NotificationType.choices)
+    channel = models.CharField(max_length=20, choices=Notification.Channel.choices)
+    title = models.CharField(max_length=255)
+    message = models.TextField()
+    created_at = models.DateTimeField()
+    sent_at = models.DateTimeField(null=True, blank=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['patient_id', 'created_at'], name='notification_archive_patient'),
+            models.Index(fields=['created_at'], name='notification_archive_created'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.notification_type} - {self.patient_id} (archivada)"
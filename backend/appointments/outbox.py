@@ -0,0 +1,180 @@
+"""
+Outbox de notificaciones.
+
+Las peticiones solo insertan filas en ``Notification`` (estado PENDING) y
+nunca esperan a la entrega. Un worker (``deliver_notifications``) reclama
+lotes de notificaciones vencidas, las entrega con el backend de su canal
+(``appointments.delivery``) y registra el resultado:
+
+- éxito: SENT y ``sent_at``;
+- fallo: RETRY con espera exponencial, o DEAD al agotar los intentos.
+
+Reclamar consiste en marcar el lote como SENDING con un token del worker y un
+plazo (``LEASE_SECONDS``); si el worker cae, las filas vuelven a la cola al
+vencer el plazo y cuentan un intento fallido (``release_expired``). Así un
+mensaje que tumba o bloquea al worker acaba en DEAD tras ``MAX_ATTEMPTS`` en
+lugar de reclamarse indefinidamente. En PostgreSQL la selección usa ``FOR UPDATE SKIP LOCKED``
+para que varios workers no se bloqueen entre sí; en SQLite, que serializa las
+escrituras, basta con el UPDATE condicional sobre el estado.
+"""
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .delivery import get_backend
+from .models import Notification
+
+Status = Notification.DeliveryStatus
+
+
+def get_delivery_settings():
+    return settings.NOTIFICATION_DELIVERY
+
+
+def backoff(attempts, config):
+    """Espera antes del siguiente intento tras ``attempts`` fallos."""
+    seconds = config['BACKOFF_SECONDS'] * 2 ** (attempts - 1)
+    return timedelta(seconds=min(seconds, config['MAX_BACKOFF_SECONDS']))
+
+
+LEASE_EXPIRED_ERROR = 'El worker no completó el envío dentro del plazo.'
+
+
+def claimable(now):
+    """Notificaciones listas para enviar."""
+    return Notification.objects.filter(
+        delivery_status__in=[Status.PENDING, Status.RETRY],
+        next_attempt_at__lte=now,
+    )
+
+
+def release_expired(now, config):
+    """
+    Devuelve a la cola las notificaciones con el plazo vencido (worker caído)
+    contando el intento; las que agotan ``MAX_ATTEMPTS`` pasan a DEAD.
+    """
+    expired = Notification.objects.filter(delivery_status=Status.SENDING, next_attempt_at__lte=now)
+    changes = {'attempts': F('attempts') + 1, 'claimed_by': '', 'last_error': LEASE_EXPIRED_ERROR}
+    # Condicionales sobre SENDING: si otro worker ya las liberó, no cuentan dos veces
+    dead = expired.filter(attempts__gte=config['MAX_ATTEMPTS'] - 1).update(delivery_status=Status.DEAD, **changes)
+    retried = expired.update(delivery_status=Status.RETRY, **changes)
+    return dead, retried
+
+
+def claim_batch(worker, batch_size, now=None):
+    """Reclama hasta ``batch_size`` notificaciones para ``worker`` y las devuelve."""
+    now = now or timezone.now()
+    config = get_delivery_settings()
+    with transaction.atomic():
+        release_expired(now, config)
+        candidates = claimable(now).order_by('next_attempt_at', 'pk')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return []
+        # Condicional: si otro worker se adelantó (SQLite), esas filas no cambian
+        claimable(now).filter(pk__in=ids).update(
+            delivery_status=Status.SENDING,
+            claimed_by=worker,
+            next_attempt_at=now + timedelta(seconds=config['LEASE_SECONDS']),
+        )
+    return list(
+        Notification.objects.filter(delivery_status=Status.SENDING, claimed_by=worker)
+        .select_related('patient__user')
+        .order_by('pk')
+    )
+
+
+def error_text(exc):
+    return str(exc) or exc.__class__.__name__
+
+
+def send_batch(backend, batch):
+    """
+    Errores de entrega de cada notificación del lote.
+
+    Si el backend lanza una excepción en vez de devolver los errores, el lote
+    se repite una a una para que la notificación culpable cuente su intento
+    (y acabe en DEAD) sin arrastrar a las demás.
+    """
+    try:
+        return backend.send_batch(batch)
+    except Exception as exc:
+        if len(batch) == 1:
+            return [error_text(exc)]
+    errors = []
+    for notification in batch:
+        try:
+            errors.extend(backend.send_batch([notification]))
+        except Exception as exc:
+            errors.append(error_text(exc))
+    return errors
+
+
+def deliver(notifications, now=None):
+    """Entrega un lote ya reclamado y guarda el resultado. Devuelve (enviadas, fallidas)."""
+    config = get_delivery_settings()
+    by_channel = {}
+    for notification in notifications:
+        by_channel.setdefault(notification.channel, []).append(notification)
+
+    sent, failed = [], []
+    for channel, batch in by_channel.items():
+        try:
+            backend = get_backend(channel)
+        except Exception as exc:
+            # Backend mal configurado: cuenta como intento fallido de todo el lote
+            errors = [error_text(exc)] * len(batch)
+        else:
+            if backend is None:
+                errors = [f'No hay backend configurado para el canal {channel}.'] * len(batch)
+            else:
+                errors = send_batch(backend, batch)
+        for notification, error in zip(batch, errors):
+            (failed if error else sent).append((notification, error))
+
+    now = now or timezone.now()
+    with transaction.atomic():
+        if sent:
+            Notification.objects.filter(pk__in=[notification.pk for notification, _ in sent]).update(
+                delivery_status=Status.SENT,
+                sent_at=now,
+                claimed_by='',
+                last_error='',
+            )
+        for notification, error in failed:
+            notification.attempts += 1
+            notification.last_error = error
+            notification.claimed_by = ''
+            if notification.attempts >= config['MAX_ATTEMPTS']:
+                notification.delivery_status = Status.DEAD
+            else:
+                notification.delivery_status = Status.RETRY
+                notification.next_attempt_at = now + backoff(notification.attempts, config)
+        if failed:
+            Notification.objects.bulk_update(
+                [notification for notification, _ in failed],
+                ['attempts', 'last_error', 'claimed_by', 'delivery_status', 'next_attempt_at'],
+            )
+    return len(sent), len(failed)
+
+
+def run_once(worker=None, batch_size=None, max_batches=None):
+    """Vacía la cola de notificaciones vencidas. Devuelve métricas de la ejecución."""
+    worker = worker or uuid.uuid4().hex
+    batch_size = batch_size or get_delivery_settings()['BATCH_SIZE']
+    totals = {'batches': 0, 'sent': 0, 'failed': 0}
+    while max_batches is None or totals['batches'] < max_batches:
+        notifications = claim_batch(worker, batch_size)
+        if not notifications:
+            break
+        sent, failed = deliver(notifications)
+        totals['batches'] += 1
+        totals['sent'] += sent
+        totals['failed'] += failed
+    return totals
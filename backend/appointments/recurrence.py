@@ -0,0 +1,111 @@
+"""
+Series de citas recurrentes.
+
+Genera las ocurrencias de una regla de recurrencia en hora local y detecta
+los conflictos de todas ellas con una única consulta a la base de datos.
+"""
+import calendar
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .intervals import ACTIVE_STATUSES
+
+DAILY = 'DAILY'
+WEEKLY = 'WEEKLY'
+MONTHLY = 'MONTHLY'
+FREQUENCIES = (DAILY, WEEKLY, MONTHLY)
+MAX_OCCURRENCES = 52
+
+
+def _add_months(value, months):
+    month_index = value.month - 1 + months
+    year = value.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(value.day, calendar.monthrange(year, month)[1])
+    return value.replace(year=year, month=month, day=day)
+
+
+def generate_occurrences(start_time, duration, frequency, interval=1, count=None, until=None):
+    """
+    Devuelve la lista de (inicio, fin) de la serie.
+
+    Las fechas se calculan sobre la hora local para conservar la hora de la
+    cita aunque cambie el horario de verano.
+    """
+    tz = timezone.get_current_timezone()
+    local_start = timezone.localtime(start_time, tz).replace(tzinfo=None)
+    limit = min(count or MAX_OCCURRENCES, MAX_OCCURRENCES)
+    occurrences = []
+    step = 0
+    while len(occurrences) < limit:
+        if frequency == MONTHLY:
+            naive = _add_months(local_start, step * interval)
+        elif frequency == WEEKLY:
+            naive = local_start + timedelta(weeks=step * interval)
+        else:
+            naive = local_start + timedelta(days=step * interval)
+        if until and naive.date() > until:
+            break
+        start = timezone.make_aware(naive, tz)
+        occurrences.append((start, start + duration))
+        step += 1
+    return occurrences
+
+
+def find_conflicts(occurrences, professional_id, room_id, exclude_pks=(), equipment_ids=()):
+    """
+    Devuelve {posición: motivo} para las ocurrencias que solapan con citas
+    activas del profesional, de la sala o de alguno de los equipos, usando
+    una sola consulta (más una si se piden equipos).
+    """
+    from .models import Appointment
+
+    if not occurrences:
+        return {}
+    first_start = min(start for start, _ in occurrences)
+    last_end = max(end for _, end in occurrences)
+    existing = Appointment.objects.filter(
+        Q(professional_id=professional_id) | Q(room_id=room_id),
+        status__in=ACTIVE_STATUSES,
+        start_time__lt=last_end,
+        end_time__gt=first_start,
+    ).exclude(pk__in=exclude_pks).values_list('professional_id', 'room_id', 'start_time', 'end_time')
+    existing = sorted(existing, key=lambda row: row[2])
+
+    conflicts = {}
+    for position, (start, end) in enumerate(occurrences):
+        for other_professional, other_room, other_start, other_end in existing:
+            if other_start >= end:
+                break
+            if other_end <= start:
+                continue
+            if other_professional == professional_id:
+                conflicts[position] = 'El profesional ya tiene una cita asignada en ese horario.'
+                break
+            if other_room == room_id:
+                conflicts[position] = 'La sala no está disponible en ese horario.'
+                break
+
+    equipment_ids = list(equipment_ids)
+    if equipment_ids:
+        booked = Appointment.equipment.through.objects.filter(
+            equipment_id__in=equipment_ids,
+            appointment__status__in=ACTIVE_STATUSES,
+            appointment__start_time__lt=last_end,
+            appointment__end_time__gt=first_start,
+        ).exclude(appointment_id__in=exclude_pks).values_list(
+            'equipment__name', 'appointment__start_time', 'appointment__end_time',
+        )
+        booked = sorted(booked, key=lambda row: row[1])
+        for position, (start, end) in enumerate(occurrences):
+            if position in conflicts:
+                continue
+            for name, other_start, other_end in booked:
+                if other_start >= end:
+                    break
+                if other_end > start:
+                    conflicts[position] = f'El equipo {name} ya está reservado en ese horario.'
+                    break
+    return conflicts
@@ -0,0 +1,100 @@
+"""
+Programación de recordatorios de citas.
+
+Recorre las citas confirmadas que empiezan dentro de cada ventana (24 h y
+2 h) y crea sus notificaciones de recordatorio con ``bulk_create``. El
+recorrido se hace por bloques con paginación por clave (start_time, id), de
+modo que la memoria no depende del número de citas, y es idempotente: la
+restricción única (cita, ventana) de ``Notification`` impide duplicados
+aunque dos ejecuciones se solapen. Como ``bulk_create(ignore_conflicts=True)``
+no informa de las filas descartadas, el recuento de creadas se obtiene
+contando las notificaciones del bloque antes y después de insertarlas, con
+las citas del bloque bloqueadas.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def reminder_windows(now):
+    """Ventanas (código, desde, hasta] de inicio de cita, de la más lejana a la más cercana."""
+    from .models import Notification
+
+    return [
+        (Notification.ReminderWindow.DAY_BEFORE, now + timedelta(hours=2), now + timedelta(hours=24)),
+        (Notification.ReminderWindow.TWO_HOURS, now, now + timedelta(hours=2)),
+    ]
+
+
+def build_reminder(appointment_id, patient_id, treatment_type, start_time, window, channel):
+    from .models import Notification
+
+    start = timezone.localtime(start_time)
+    return Notification(
+        appointment_id=appointment_id,
+        patient_id=patient_id,
+        notification_type=Notification.NotificationType.APPOINTMENT_REMINDER,
+        channel=channel,
+        reminder_window=window,
+        title='Recordatorio de cita',
+        message=(
+            f'Le recordamos su cita para {treatment_type} el '
+            f'{start.strftime("%d/%m/%Y")} a las {start.strftime("%H:%M")}.'
+        ),
+    )
+
+
+def _insert_reminders(rows, window, channel):
+    """Inserta los recordatorios del bloque y devuelve cuántos se crearon de verdad."""
+    from .models import Appointment, Notification
+
+    ids = [row[0] for row in rows]
+    reminders = [build_reminder(*row, window=window, channel=channel) for row in rows]
+    existing = Notification.objects.filter(appointment_id__in=ids, reminder_window=window)
+    with transaction.atomic():
+        # Bloquear las citas del bloque serializa las ejecuciones concurrentes,
+        # así ninguna inserción ajena cae entre los dos recuentos
+        list(Appointment.objects.select_for_update().filter(pk__in=ids).values_list('pk', flat=True))
+        before = existing.count()
+        Notification.objects.bulk_create(reminders, ignore_conflicts=True)
+        return existing.count() - before
+
+
+def schedule_reminders(now=None, chunk_size=DEFAULT_CHUNK_SIZE, channel=None, dry_run=False):
+    """
+    Crea los recordatorios pendientes de todas las ventanas.
+
+    Devuelve {ventana: número de recordatorios creados (o que se crearían)}.
+    """
+    from .models import Appointment, Notification
+
+    now = now or timezone.now()
+    channel = channel or Notification.Channel.IN_APP
+    created = {}
+    for window, window_start, window_end in reminder_windows(now):
+        already_sent = Notification.objects.filter(appointment=OuterRef('pk'), reminder_window=window)
+        pending = Appointment.objects.filter(
+            status=Appointment.Status.CONFIRMED,
+            start_time__gt=window_start,
+            start_time__lte=window_end,
+        ).filter(~Exists(already_sent)).order_by('start_time', 'pk')
+
+        created[window] = 0
+        last = None
+        while True:
+            chunk = pending
+            if last is not None:
+                chunk = chunk.filter(Q(start_time__gt=last[0]) | Q(start_time=last[0], pk__gt=last[1]))
+            rows = list(chunk.values_list('pk', 'patient_id', 'treatment_type', 'start_time')[:chunk_size])
+            if not rows:
+                break
+            if dry_run:
+                created[window] += len(rows)
+            else:
+                created[window] += _insert_reminders(rows, window, channel)
+            last = (rows[-1][3], rows[-1][0])
+    return created
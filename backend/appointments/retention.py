@@ -0,0 +1,168 @@
+"""
+Retención de notificaciones.
+
+Las notificaciones leídas y ya entregadas con más de ``READ_MAX_AGE_DAYS``
+días salen de la tabla viva por lotes acotados: se copian a
+``NotificationArchive`` y se eliminan (modo ``archive``) o simplemente se
+eliminan (modo ``delete``). Cada lote es una transacción corta, de modo que
+la limpieza puede ejecutarse con la clínica en marcha.
+
+El archivo también caduca (``ARCHIVE_MAX_AGE_DAYS``). En PostgreSQL está
+particionado por mes (UTC) de ``created_at``: las particiones se crean al
+archivar y la caducidad elimina particiones completas. En SQLite se borra
+por lotes.
+"""
+import re
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Notification, NotificationArchive
+
+ARCHIVE_TABLE = NotificationArchive._meta.db_table
+ARCHIVE_FIELDS = (
+    'id', 'patient_id', 'appointment_id', 'notification_type', 'channel',
+    'title', 'message', 'created_at', 'sent_at', 'read_at',
+)
+PARTITION_NAME = re.compile(rf'^{ARCHIVE_TABLE}_p(\d{{4}})(\d{{2}})$')
+
+
+def get_retention_settings():
+    return settings.NOTIFICATION_RETENTION
+
+
+def is_partitioned():
+    return connection.vendor == 'postgresql'
+
+
+def month_start(value):
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def next_month(value):
+    return (value + timedelta(days=32)).replace(day=1)
+
+
+def ensure_partitions(first, last):
+    """Crea las particiones mensuales del archivo que cubren [first, last]."""
+    month = month_start(first)
+    with connection.cursor() as cursor:
+        while month <= last:
+            following = next_month(month)
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE}_p{month:%Y%m} '
+                f'PARTITION OF {ARCHIVE_TABLE} FOR VALUES FROM (%s) TO (%s)',
+                [month, following],
+            )
+            month = following
+
+
+def archive_partitions():
+    """Particiones existentes como {nombre: inicio del mes siguiente (límite superior)}."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE parent.relname = %s',
+            [ARCHIVE_TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            start = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=dt_timezone.utc)
+            partitions[name] = next_month(start)
+    return partitions
+
+
+def compact_notifications(now=None, mode=None, max_age_days=None, batch_size=None, max_batches=None):
+    """
+    Archiva o elimina por lotes las notificaciones leídas antiguas.
+
+    Devuelve las métricas de la ejecución: lotes, filas archivadas y eliminadas.
+    """
+    config = get_retention_settings()
+    now = now or timezone.now()
+    mode = mode or config['MODE']
+    max_age_days = config['READ_MAX_AGE_DAYS'] if max_age_days is None else max_age_days
+    batch_size = batch_size or config['BATCH_SIZE']
+
+    eligible = Notification.objects.filter(
+        read_at__isnull=False,
+        created_at__lt=now - timedelta(days=max_age_days),
+        delivery_status__in=[Notification.DeliveryStatus.SENT, Notification.DeliveryStatus.DEAD],
+    ).order_by('pk')
+    if connection.features.has_select_for_update_skip_locked:
+        eligible = eligible.select_for_update(skip_locked=True)
+
+    metrics = {'batches': 0, 'archived': 0, 'deleted': 0}
+    while max_batches is None or metrics['batches'] < max_batches:
+        with transaction.atomic():
+            rows = list(eligible.values(*ARCHIVE_FIELDS)[:batch_size])
+            if not rows:
+                break
+            if mode == 'archive':
+                if is_partitioned():
+                    ensure_partitions(
+                        min(row['created_at'] for row in rows),
+                        max(row['created_at'] for row in rows),
+                    )
+                NotificationArchive.objects.bulk_create(
+                    [NotificationArchive(**row) for row in rows],
+                    ignore_conflicts=True,
+                )
+                metrics['archived'] += len(rows)
+            deleted, _ = Notification.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+            metrics['deleted'] += deleted
+            metrics['batches'] += 1
+    return metrics
+
+
+def purge_archive(now=None, max_age_days=None, batch_size=None):
+    """
+    Elimina del archivo lo anterior a ``ARCHIVE_MAX_AGE_DAYS``.
+
+    En PostgreSQL solo se eliminan particiones completas (un mes entero
+    caducado); en SQLite se borran filas por lotes.
+    """
+    config = get_retention_settings()
+    now = now or timezone.now()
+    max_age_days = config['ARCHIVE_MAX_AGE_DAYS'] if max_age_days is None else max_age_days
+    batch_size = batch_size or config['BATCH_SIZE']
+    metrics = {'partitions_dropped': 0, 'archive_deleted': 0}
+    if not max_age_days:
+        return metrics
+
+    cutoff = now - timedelta(days=max_age_days)
+    if is_partitioned():
+        with connection.cursor() as cursor:
+            for name, upper_bound in sorted(archive_partitions().items()):
+                if upper_bound <= cutoff:
+                    cursor.execute(f'DROP TABLE {name}')
+                    metrics['partitions_dropped'] += 1
+        return metrics
+
+    expired = NotificationArchive.objects.filter(created_at__lt=cutoff).order_by('pk')
+    while True:
+        ids = list(expired.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        deleted, _ = NotificationArchive.objects.filter(pk__in=ids).delete()
+        metrics['archive_deleted'] += deleted
+    return metrics
+
+
+def run_retention(mode=None, max_age_days=None, batch_size=None, max_batches=None):
+    """Ejecución completa (tabla viva y archivo) con métricas y duración."""
+    started = time.perf_counter()
+    metrics = compact_notifications(mode=mode, max_age_days=max_age_days, batch_size=batch_size, max_batches=max_batches)
+    if (mode or get_retention_settings()['MODE']) == 'archive':
+        metrics.update(purge_archive(batch_size=batch_size))
+    metrics['elapsed'] = time.perf_counter() - started
+    return metrics
@@ -1,6 +1,9 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
 
+from appointments.intervals import ACTIVE_STATUSES, PROFESSIONAL, ROOM, equipment_conflicts, has_overlap
 from appointments.models import Appointment, Notification
+from appointments.recurrence import FREQUENCIES, MAX_OCCURRENCES, WEEKLY
 from patients.models import PatientProfile
 from patients.serializers import PatientSerializer
 from resources.models import Room, Equipment
@@ -39,6 +42,8 @@ class AppointmentSerializer(serializers.ModelSerializer):
         required=False,
     )
     end_time = serializers.DateTimeField(required=False, allow_null=True)
+    # Versión leída por el cliente; la actualización solo se aplica si sigue vigente
+    version = serializers.IntegerField(required=False, min_value=1)
 
     class Meta:
         model = Appointment
@@ -61,7 +66,7 @@ class AppointmentSerializer(serializers.ModelSerializer):
             'created_at',
             'updated_at',
         ]
-        read_only_fields = ('version', 'created_at', 'updated_at')
+        read_only_fields = ('created_at', 'updated_at')
 
     def validate_start_time(self, value):
         """Validar que la fecha de inicio no sea en el pasado ni más de 3 meses en el futuro"""
@@ -84,14 +89,6 @@ class AppointmentSerializer(serializers.ModelSerializer):
         return value
 
     def validate(self, attrs):
-        # Validación de bloqueo optimista
-        if self.instance:
-            version = attrs.get('version')
-            if version and version != self.instance.version:
-                raise serializers.ValidationError({
-                    'version': 'La cita ha sido modificada por otro usuario. Por favor, recargue la información.'
-                })
-
         start = attrs.get('start_time')
         end = attrs.get('end_time')
         
@@ -139,32 +136,129 @@ class AppointmentSerializer(serializers.ModelSerializer):
         # Si falta professional, room, start o end, retornar attrs (se validará en perform_create o en el modelo)
         if not (professional and start and end):
             return attrs
+
+        # Las citas canceladas o completadas no ocupan franja (como Appointment.clean)
+        status = attrs.get('status') or getattr(self.instance, 'status', None)
+        if status and status not in ACTIVE_STATUSES:
+            return attrs
         
-        # Validación de solapamiento con bloqueo pesimista implícito (unique constraints)
-        overlapping = Appointment.objects.filter(
-            professional=professional,
-            status__in=[Appointment.Status.PENDING, Appointment.Status.CONFIRMED],
-            start_time__lt=end,
-            end_time__gt=start,
-        )
-        if self.instance:
-            overlapping = overlapping.exclude(pk=self.instance.pk)
-        if overlapping.exists():
+        # Validación de solapamiento contra el índice de intervalos en memoria
+        exclude_pk = self.instance.pk if self.instance else None
+        if has_overlap(PROFESSIONAL, professional.pk, start, end, exclude_pk=exclude_pk):
             raise serializers.ValidationError('El profesional ya tiene una cita asignada en ese horario.')
 
         # Solo validar solapamiento de sala si se proporciona room
-        if room:
-            overlapping_room = Appointment.objects.filter(
-                room=room,
-                status__in=[Appointment.Status.PENDING, Appointment.Status.CONFIRMED],
-                start_time__lt=end,
-                end_time__gt=start,
-            )
-            if self.instance:
-                overlapping_room = overlapping_room.exclude(pk=self.instance.pk)
-            if overlapping_room.exists():
-                raise serializers.ValidationError('La sala no está disponible en ese horario.')
+        if room and has_overlap(ROOM, room.pk, start, end, exclude_pk=exclude_pk):
+            raise serializers.ValidationError('La sala no está disponible en ese horario.')
+
+        # Equipos: los nuevos o, si cambia el horario, los ya asignados (una sola consulta)
+        equipment = attrs.get('equipment')
+        if equipment is None and self.instance and ('start_time' in attrs or 'end_time' in attrs):
+            equipment = self.instance.equipment.all()
+        if equipment:
+            conflicts = equipment_conflicts([item.pk for item in equipment], start, end, exclude_pk=exclude_pk)
+            if conflicts:
+                raise serializers.ValidationError({'equipment_ids': list(conflicts.values())})
+
+        return attrs
+
+    def create(self, validated_data):
+        validated_data.pop('version', None)
+        # Las violaciones de las restricciones de BD llegan como errores de Django
+        try:
+            return super().create(validated_data)
+        except DjangoValidationError as exc:
+            raise serializers.ValidationError(exc.messages)
+
+    def update(self, instance, validated_data):
+        """Actualización con bloqueo optimista (UPDATE condicional sobre version)."""
+        expected_version = validated_data.pop('version', None)
+        equipment = validated_data.pop('equipment', None)
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        try:
+            instance.save_if_version(list(validated_data), expected_version)
+        except DjangoValidationError as exc:
+            raise serializers.ValidationError(exc.messages)
+        if equipment is not None:
+            instance.equipment.set(equipment)
+        return instance
+
+
+class RecurrenceSerializer(serializers.Serializer):
+    frequency = serializers.ChoiceField(choices=FREQUENCIES, default=WEEKLY)
+    interval = serializers.IntegerField(min_value=1, max_value=12, default=1)
+    count = serializers.IntegerField(min_value=1, max_value=MAX_OCCURRENCES, required=False)
+    until = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        if not attrs.get('count') and not attrs.get('until'):
+            raise serializers.ValidationError('Indique el número de citas (count) o la fecha final (until).')
+        return attrs
+
+
+class AppointmentSeriesSerializer(serializers.Serializer):
+    """Datos para crear una serie de citas recurrentes"""
+    patient_id = serializers.PrimaryKeyRelatedField(queryset=PatientProfile.objects.all(), source='patient')
+    professional_id = serializers.PrimaryKeyRelatedField(
+        queryset=ProfessionalProfile.objects.all(),
+        source='professional',
+    )
+    room_id = serializers.PrimaryKeyRelatedField(queryset=Room.objects.all(), source='room')
+    equipment_ids = serializers.PrimaryKeyRelatedField(
+        queryset=Equipment.objects.all(),
+        many=True,
+        source='equipment',
+        required=False,
+    )
+    start_time = serializers.DateTimeField()
+    duration_minutes = serializers.IntegerField(min_value=5, max_value=8 * 60, default=60)
+    status = serializers.ChoiceField(
+        choices=[Appointment.Status.PENDING, Appointment.Status.CONFIRMED],
+        default=Appointment.Status.CONFIRMED,
+    )
+    treatment_type = serializers.CharField(max_length=120)
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
+    recurrence = RecurrenceSerializer()
+    skip_conflicts = serializers.BooleanField(default=False)
+
+    def validate_start_time(self, value):
+        from django.utils import timezone
+
+        if value < timezone.now():
+            raise serializers.ValidationError('La fecha seleccionada no es válida.')
+        return value
+
 
+class AppointmentBulkFilterSerializer(serializers.Serializer):
+    date_from = serializers.DateField()
+    date_to = serializers.DateField()
+    status = serializers.ChoiceField(choices=Appointment.Status.choices, required=False)
+    professional_id = serializers.IntegerField(required=False)
+    room_id = serializers.IntegerField(required=False)
+
+    def validate(self, attrs):
+        if attrs['date_to'] < attrs['date_from']:
+            raise serializers.ValidationError({'date_to': 'La fecha final debe ser igual o posterior a la inicial.'})
+        return attrs
+
+
+class AppointmentBulkActionSerializer(serializers.Serializer):
+    """Selección de citas para un cambio de estado masivo: lista de ids o filtro"""
+    MAX_APPOINTMENTS = 500
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        required=False,
+        allow_empty=False,
+        max_length=MAX_APPOINTMENTS,
+    )
+    filter = AppointmentBulkFilterSerializer(required=False)
+    reason = serializers.CharField(required=False, allow_blank=True, default='')
+
+    def validate(self, attrs):
+        if bool(attrs.get('ids')) == bool(attrs.get('filter')):
+            raise serializers.ValidationError('Indique una lista de citas (ids) o un filtro, pero no ambos.')
         return attrs
 
 
@@ -179,11 +273,12 @@ class NotificationSerializer(serializers.ModelSerializer):
             'patient',
             'notification_type',
             'channel',
+            'reminder_window',
             'title',
             'message',
             'sent_at',
             'read_at',
             'created_at',
         ]
-        read_only_fields = ('sent_at', 'read_at', 'created_at')
+        read_only_fields = ('reminder_window', 'sent_at', 'read_at', 'created_at')
 
@@ -0,0 +1,27 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .intervals import appointment_index
+from .models import Appointment
+
+
+@receiver(post_save, sender=Appointment)
+def sync_interval_index(sender, instance, **kwargs):
+    """Actualizar el índice de intervalos cuando la transacción se confirme"""
+    values = (
+        instance.pk,
+        instance.professional_id,
+        instance.room_id,
+        instance.start_time,
+        instance.end_time,
+        instance.status,
+    )
+    transaction.on_commit(lambda: appointment_index.sync(*values))
+
+
+@receiver(post_delete, sender=Appointment)
+def discard_from_interval_index(sender, instance, **kwargs):
+    """Retirar la cita del índice de intervalos (incluye borrados en cascada)"""
+    pk = instance.pk
+    transaction.on_commit(lambda: appointment_index.discard(pk))
@@ -1,3 +1,949 @@
+import io
+from datetime import date, time, timedelta
+from importlib import import_module
+from unittest import mock, skipUnless
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
 from django.test import TestCase
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.test import APIClient
+
+from billing import dashboard
+from core.dates import local_datetime, local_day_bounds
+from patients.models import PatientProfile
+from resources.models import Equipment, Room
+from staff.models import ProfessionalProfile
+from users.models import User
+
+from . import reminders
+from .availability import compute_free_slots
+from .delivery import BaseBackend
+from .intervals import PROFESSIONAL, appointment_index, has_overlap
+from .outbox import run_once
+from .recurrence import DAILY, MAX_OCCURRENCES, MONTHLY, WEEKLY, generate_occurrences
+from .models import Appointment, Notification, NotificationArchive
+from .reminders import schedule_reminders
+from .retention import compact_notifications, purge_archive
+from .serializers import AppointmentBulkActionSerializer
+
+
+class AppointmentIndexExplainTests(TestCase):
+    """Comprueba con EXPLAIN que los filtros por rango usan los índices compuestos."""
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # Con tablas vacías el planificador prefiere un seq scan
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        self.range_start, self.range_end = local_day_bounds(date(2026, 3, 1), date(2026, 3, 31))
+
+    def index_name(self, *fields):
+        for index in Appointment._meta.indexes:
+            if tuple(index.fields) == fields:
+                return index.name
+        self.fail(f'No existe índice sobre {fields}')
+
+    def assertUsesIndex(self, queryset, *fields):
+        plan = queryset.explain()
+        self.assertIn(self.index_name(*fields), plan)
+
+    def test_professional_range_uses_composite_index(self):
+        queryset = Appointment.objects.filter(
+            professional_id=1,
+            status__in=[Appointment.Status.PENDING, Appointment.Status.CONFIRMED],
+            start_time__gte=self.range_start,
+            start_time__lt=self.range_end,
+        )
+        self.assertUsesIndex(queryset, 'professional', 'status', 'start_time')
+
+    def test_room_range_uses_composite_index(self):
+        queryset = Appointment.objects.filter(
+            room_id=1,
+            status=Appointment.Status.CONFIRMED,
+            start_time__gte=self.range_start,
+            start_time__lt=self.range_end,
+        )
+        self.assertUsesIndex(queryset, 'room', 'status', 'start_time')
+
+    def test_patient_range_uses_composite_index(self):
+        queryset = Appointment.objects.filter(
+            patient_id=1,
+            start_time__gte=self.range_start,
+            start_time__lt=self.range_end,
+        ).order_by('start_time')
+        self.assertUsesIndex(queryset, 'patient', 'start_time')
+
+    def test_day_bounds_are_local_midnights(self):
+        # 29/03/2026 es el cambio al horario de verano en Europe/Madrid (día de 23 horas)
+        start, end = local_day_bounds(date(2026, 3, 29))
+        self.assertEqual(start.isoformat(), '2026-03-29T00:00:00+01:00')
+        self.assertEqual(end.isoformat(), '2026-03-30T00:00:00+02:00')
+        self.assertEqual(end.timestamp() - start.timestamp(), 23 * 3600)
+
+    def test_unread_count_uses_partial_index(self):
+        queryset = Notification.objects.filter(patient_id=1, read_at__isnull=True).order_by()
+        self.assertIn('notification_unread_idx', queryset.explain())
+
+
+class AppointmentFixtureMixin:
+    """Pacientes, profesionales y salas comunes a las pruebas de reservas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Un lunes dentro del plazo de reserva (entre una y dos semanas vista)
+        cls.DAY = timezone.localdate() + timedelta(days=7)
+        cls.DAY += timedelta(days=-cls.DAY.weekday() % 7)
+        cls.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        cls.patient_user = User.objects.create(username='paciente', role=User.Roles.PATIENT)
+        cls.patient = PatientProfile.objects.create(user=cls.patient_user)
+        cls.professionals = [
+            ProfessionalProfile.objects.create(
+                user=User.objects.create(username=f'doctor{i}', role=User.Roles.PROFESSIONAL),
+                specialty='General',
+                license_number=f'L-{i}',
+                working_days='LUN-VIE',
+                start_hour=time(9),
+                end_hour=time(13),
+            )
+            for i in range(3)
+        ]
+        cls.rooms = [Room.objects.create(name=f'Sala {i}') for i in range(2)]
+
+    def at(self, hour, minute=0):
+        return local_datetime(self.DAY, time(hour, minute))
+
+    def book(self, start, end, professional=None, room=None):
+        return Appointment.objects.create(
+            patient=self.patient,
+            professional=professional or self.professionals[1],
+            room=room or self.rooms[0],
+            start_time=start,
+            end_time=end,
+            treatment_type='Revisión',
+        )
+
+
+class FreeSlotTests(AppointmentFixtureMixin, TestCase):
+    """Franjas libres por profesional y sala (appointments.availability)."""
+
+    def slots(self, duration=60, step=30):
+        result = compute_free_slots(
+            self.DAY,
+            self.DAY,
+            timedelta(minutes=duration),
+            [self.professionals[0]],
+            self.rooms,
+            step=timedelta(minutes=step),
+            not_before=self.at(0),
+        )
+        return {slot['start']: slot['room_ids'] for slot in result[0]['slots']}
+
+    def test_slot_split_across_two_rooms_is_not_offered(self):
+        # Sala 0 libre hasta las 10:00 y sala 1 desde las 10:00
+        self.book(self.at(10), self.at(13), room=self.rooms[0])
+        self.book(self.at(9), self.at(10), room=self.rooms[1])
+        slots = self.slots()
+        self.assertEqual(slots[self.at(9).isoformat()], [self.rooms[0].pk])
+        self.assertNotIn(self.at(9, 30).isoformat(), slots)
+        self.assertEqual(slots[self.at(10).isoformat()], [self.rooms[1].pk])
+
+    def test_professional_appointments_remove_slots(self):
+        self.book(self.at(11), self.at(12), professional=self.professionals[0], room=self.rooms[1])
+        slots = self.slots()
+        self.assertIn(self.at(10).isoformat(), slots)
+        self.assertNotIn(self.at(10, 30).isoformat(), slots)
+        self.assertNotIn(self.at(11).isoformat(), slots)
+        self.assertEqual(slots[self.at(12).isoformat()], [room.pk for room in self.rooms])
+        self.assertNotIn(self.at(12, 30).isoformat(), slots)
+
+    def test_range_endpoints_share_parsing_and_scope(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        day = self.DAY.isoformat()
+        room, professional = self.rooms[0], self.professionals[0]
+        endpoints = [
+            '/api/appointments/availability/',
+            f'/api/rooms/{room.pk}/availability/',
+            f'/api/professionals/{professional.pk}/availability/',
+        ]
+        for url in endpoints:
+            response = client.get(url, {'date_from': day, 'date_to': (self.DAY - timedelta(days=1)).isoformat()})
+            self.assertEqual(response.status_code, 400, url)
+            self.assertIn('date_to', response.data)
+
+        for params in ({'date_from': '2026-02-30'}, {'date_from': day, 'date_to': '2026-13-01'}):
+            for url in endpoints:
+                response = client.get(url, params)
+                self.assertEqual(response.status_code, 400, url)
+
+        response = client.get(endpoints[1], {'date_from': day})
+        self.assertEqual(response.data['room_ids'], [room.pk])
+        self.assertEqual(len(response.data['professionals']), len(self.professionals))
+        response = client.get(endpoints[2], {'date_from': day, 'room_ids': str(room.pk)})
+        self.assertEqual([item['id'] for item in response.data['professionals']], [professional.pk])
+        self.assertEqual(response.data['room_ids'], [room.pk])
+
+    def test_day_mode_rejects_impossible_dates(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        equipment = Equipment.objects.create(name='Autoclave')
+        self.book(self.at(9), self.at(10), professional=self.professionals[0], room=self.rooms[0])
+        endpoints = [
+            '/api/appointments/availability/',
+            f'/api/rooms/{self.rooms[0].pk}/availability/',
+            f'/api/equipment/{equipment.pk}/availability/',
+            f'/api/professionals/{self.professionals[0].pk}/availability/',
+        ]
+        for url in endpoints:
+            self.assertEqual(client.get(url, {'date': '2026-02-30'}).status_code, 400, url)
+            response = client.get(url, {'date': self.DAY.isoformat()})
+            self.assertEqual(response.status_code, 200, url)
+
+
+class RoomAllocationTests(AppointmentFixtureMixin, TestCase):
+    """Asignación automática de sala al crear una cita sin room_id (appointments.allocation)."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create(self, start, end):
+        return self.client.post('/api/appointments/', {
+            'patient_id': self.patient.pk,
+            'professional_id': self.professionals[0].pk,
+            'start_time': start.isoformat(),
+            'end_time': end.isoformat(),
+            'treatment_type': 'Revisión',
+        }, format='json')
+
+    def test_best_fit_room_is_assigned(self):
+        # La sala 0 solo tiene libre el hueco de 10:00 a 11:00; la sala 1, todo el día
+        self.book(self.at(9), self.at(10), room=self.rooms[0])
+        self.book(self.at(11), self.at(13), room=self.rooms[0])
+        response = self.create(self.at(10), self.at(11))
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Appointment.objects.get(pk=response.data['id']).room, self.rooms[0])
+
+    def test_staff_booking_without_free_room_is_rejected(self):
+        self.book(self.at(10), self.at(11), professional=self.professionals[1], room=self.rooms[0])
+        self.book(self.at(10), self.at(11), professional=self.professionals[2], room=self.rooms[1])
+        response = self.create(self.at(10), self.at(11))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Appointment.objects.filter(professional=self.professionals[0]).exists())
+
+
+
+class AppointmentVersionTests(AppointmentFixtureMixin, TestCase):
+    """Bloqueo optimista: UPDATE condicional sobre ``version`` (Appointment.save_if_version)."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.appointment = self.book(self.at(10), self.at(11), professional=self.professionals[0])
+
+    def url(self, action=''):
+        return f'/api/appointments/{self.appointment.pk}/{action}'
+
+    def test_stale_version_is_rejected_without_changes(self):
+        response = self.client.patch(self.url(), {'notes': 'Cambio', 'version': 2}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.appointment.refresh_from_db()
+        self.assertEqual((self.appointment.notes, self.appointment.version), ('', 1))
+
+    def test_matching_version_is_bumped(self):
+        response = self.client.patch(self.url(), {'notes': 'Cambio', 'version': 1}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.appointment.refresh_from_db()
+        self.assertEqual((self.appointment.notes, self.appointment.version), ('Cambio', 2))
+
+    def test_status_actions_honour_version(self):
+        for action, status in [
+            ('approve/', Appointment.Status.CONFIRMED),
+            ('complete/', Appointment.Status.COMPLETED),
+        ]:
+            current = Appointment.objects.get(pk=self.appointment.pk).version
+            response = self.client.post(self.url(action), {'version': current + 1}, format='json')
+            self.assertEqual(response.status_code, 409, action)
+            response = self.client.post(self.url(action), {'version': current}, format='json')
+            self.assertEqual(response.status_code, 200, action)
+            self.appointment.refresh_from_db()
+            self.assertEqual((self.appointment.status, self.appointment.version), (status, current + 1))
+
+        cancellable = self.book(self.at(11), self.at(12), professional=self.professionals[0])
+        url = f'/api/appointments/{cancellable.pk}/cancel/'
+        self.assertEqual(self.client.post(url, {'version': 5}, format='json').status_code, 409)
+        self.assertEqual(self.client.post(url, {'version': 1}, format='json').status_code, 200)
+        cancellable.refresh_from_db()
+        self.assertEqual((cancellable.status, cancellable.version), (Appointment.Status.CANCELLED, 2))
+
+    def test_inactive_appointments_skip_overlap_check(self):
+        for status in (Appointment.Status.CANCELLED, Appointment.Status.COMPLETED):
+            # Solapa con la cita activa: solo se admite porque no ocupa franja
+            inactive = Appointment.objects.create(
+                patient=self.patient,
+                professional=self.professionals[0],
+                room=self.rooms[0],
+                start_time=self.at(10),
+                end_time=self.at(11),
+                status=status,
+                treatment_type='Revisión',
+            )
+            with mock.patch('appointments.models.has_overlap') as model_check, \
+                    mock.patch('appointments.serializers.has_overlap') as serializer_check:
+                response = self.client.patch(
+                    f'/api/appointments/{inactive.pk}/', {'notes': 'Nota', 'version': 1}, format='json',
+                )
+            self.assertEqual(response.status_code, 200, response.data)
+            model_check.assert_not_called()
+            serializer_check.assert_not_called()
+
+
+
+class BulkTransitionTests(AppointmentFixtureMixin, TestCase):
+    """Cambios de estado masivos (bulk-approve, bulk-complete, bulk-cancel)."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.pending = self.book(self.at(9), self.at(10), professional=self.professionals[0])
+        self.confirmed = self.book(self.at(10), self.at(11), professional=self.professionals[0])
+        Appointment.objects.filter(pk=self.confirmed.pk).update(status=Appointment.Status.CONFIRMED)
+
+    def post(self, action, payload):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/api/appointments/bulk-{action}/', payload, format='json')
+
+    def test_results_per_id(self):
+        missing = self.confirmed.pk + 100
+        response = self.post('approve', {'ids': [missing, self.confirmed.pk, self.pending.pk]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(
+            [(item['id'], item['result']) for item in response.data['results']],
+            [(missing, 'not_found'), (self.confirmed.pk, 'skipped'), (self.pending.pk, 'updated')],
+        )
+        self.pending.refresh_from_db()
+        self.assertEqual((self.pending.status, self.pending.version), (Appointment.Status.CONFIRMED, 2))
+        self.assertEqual(
+            Notification.objects.filter(
+                appointment=self.pending,
+                notification_type=Notification.NotificationType.APPOINTMENT_CONFIRMED,
+            ).count(),
+            1,
+        )
+
+    def test_invalid_source_states_are_skipped(self):
+        Appointment.objects.filter(pk=self.pending.pk).update(status=Appointment.Status.COMPLETED)
+        for action in ('approve', 'complete', 'cancel'):
+            response = self.post(action, {'ids': [self.pending.pk]})
+            self.assertEqual(response.data['updated'], 0, action)
+            self.assertEqual(response.data['results'][0]['result'], 'skipped', action)
+        self.pending.refresh_from_db()
+        self.assertEqual((self.pending.status, self.pending.version), (Appointment.Status.COMPLETED, 1))
+
+    def test_filter_selects_by_day_and_fields(self):
+        other = self.book(self.at(9), self.at(10), professional=self.professionals[1], room=self.rooms[1])
+        day = self.DAY.isoformat()
+        response = self.post('complete', {
+            'filter': {'date_from': day, 'date_to': day, 'professional_id': self.professionals[0].pk},
+        })
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(
+            {item['id'] for item in response.data['results']}, {self.pending.pk, self.confirmed.pk},
+        )
+        other.refresh_from_db()
+        self.assertEqual(other.status, Appointment.Status.PENDING)
+        # Completar no notifica al paciente
+        self.assertFalse(Notification.objects.exists())
+
+    def test_selection_is_capped(self):
+        day = self.DAY.isoformat()
+        with mock.patch.object(AppointmentBulkActionSerializer, 'MAX_APPOINTMENTS', 1):
+            response = self.post('cancel', {'filter': {'date_from': day, 'date_to': day}})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('filter', response.data)
+        self.assertEqual(Appointment.objects.filter(status=Appointment.Status.CANCELLED).count(), 0)
+        limit = AppointmentBulkActionSerializer.MAX_APPOINTMENTS
+        response = self.post('cancel', {'ids': list(range(1, limit + 2))})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cancel_reason_is_appended_to_notes(self):
+        Appointment.objects.filter(pk=self.pending.pk).update(notes='Traer radiografía')
+        response = self.post('cancel', {'ids': [self.pending.pk, self.confirmed.pk], 'reason': 'Baja médica'})
+        self.assertEqual(response.data['updated'], 2)
+        notes = dict(Appointment.objects.values_list('pk', 'notes'))
+        self.assertEqual(notes[self.pending.pk], 'Traer radiografía\n\nCancelación: Baja médica')
+        self.assertEqual(notes[self.confirmed.pk], 'Cancelación: Baja médica')
+        self.assertEqual(set(Appointment.objects.values_list('version', flat=True)), {2})
+
+    def test_index_and_dashboard_are_updated_after_commit(self):
+        appointment_index.rebuild()
+        self.addCleanup(appointment_index.clear)
+        cache = dashboard.get_dashboard_cache()
+        generation = cache.get(dashboard.GENERATION_KEY, 0)
+        self.assertIsNotNone(
+            appointment_index.find_overlap(PROFESSIONAL, self.professionals[0].pk, self.at(9), self.at(10)),
+        )
+        self.post('cancel', {'ids': [self.pending.pk]})
+        self.assertIsNone(
+            appointment_index.find_overlap(PROFESSIONAL, self.professionals[0].pk, self.at(9), self.at(10)),
+        )
+        self.assertGreater(cache.get(dashboard.GENERATION_KEY, 0), generation)
+
+
+class RecurrenceTests(TestCase):
+    """Ocurrencias de una serie en hora local (appointments.recurrence)."""
+
+    def starts(self, start, frequency, **kwargs):
+        occurrences = generate_occurrences(start, timedelta(minutes=30), frequency, **kwargs)
+        for occurrence_start, occurrence_end in occurrences:
+            self.assertEqual(occurrence_end - occurrence_start, timedelta(minutes=30))
+        return [timezone.localtime(occurrence_start).isoformat() for occurrence_start, _ in occurrences]
+
+    def test_daily_with_count(self):
+        self.assertEqual(self.starts(local_datetime(date(2026, 5, 4), time(9)), DAILY, interval=2, count=3), [
+            '2026-05-04T09:00:00+02:00',
+            '2026-05-06T09:00:00+02:00',
+            '2026-05-08T09:00:00+02:00',
+        ])
+
+    def test_weekly_keeps_local_time_across_dst(self):
+        # 29/03/2026: cambio al horario de verano en Europe/Madrid
+        self.assertEqual(self.starts(local_datetime(date(2026, 3, 23), time(10)), WEEKLY, until=date(2026, 4, 6)), [
+            '2026-03-23T10:00:00+01:00',
+            '2026-03-30T10:00:00+02:00',
+            '2026-04-06T10:00:00+02:00',
+        ])
+
+    def test_monthly_clamps_to_last_day(self):
+        self.assertEqual(self.starts(local_datetime(date(2026, 1, 31), time(12)), MONTHLY, until=date(2026, 4, 30)), [
+            '2026-01-31T12:00:00+01:00',
+            '2026-02-28T12:00:00+01:00',
+            '2026-03-31T12:00:00+02:00',
+            '2026-04-30T12:00:00+02:00',
+        ])
+
+    def test_count_is_capped(self):
+        occurrences = generate_occurrences(timezone.now(), timedelta(hours=1), DAILY, count=MAX_OCCURRENCES + 10)
+        self.assertEqual(len(occurrences), MAX_OCCURRENCES)
+
+
+class AppointmentSeriesTests(AppointmentFixtureMixin, TestCase):
+    """Creación de series de citas recurrentes (POST /api/appointments/series/)."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.equipment = Equipment.objects.create(name='Escáner intraoral')
+
+    def create_series(self, **extra):
+        return self.client.post('/api/appointments/series/', {
+            'patient_id': self.patient.pk,
+            'professional_id': self.professionals[0].pk,
+            'room_id': self.rooms[0].pk,
+            'equipment_ids': [self.equipment.pk],
+            'start_time': self.at(9).isoformat(),
+            'duration_minutes': 30,
+            'treatment_type': 'Ortodoncia',
+            'recurrence': {'frequency': DAILY, 'count': 3},
+            **extra,
+        }, format='json')
+
+    def test_series_is_created_with_equipment_and_one_notification(self):
+        response = self.create_series()
+        self.assertEqual(response.status_code, 201, response.data)
+        ids = [item['id'] for item in response.data['created']]
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(
+            Appointment.equipment.through.objects.filter(appointment_id__in=ids, equipment=self.equipment).count(),
+            3,
+        )
+        notification = Notification.objects.get()
+        self.assertEqual(notification.appointment_id, ids[0])
+        self.assertIn('3 citas', notification.message)
+
+    def test_conflict_returns_409(self):
+        taken = self.book(self.at(9) + timedelta(days=1), self.at(9, 30) + timedelta(days=1), room=self.rooms[0])
+        response = self.create_series()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([item['position'] for item in response.data['conflicts']], [1])
+        self.assertEqual(Appointment.objects.exclude(pk=taken.pk).count(), 0)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_skip_conflicts_creates_the_rest(self):
+        self.book(self.at(9) + timedelta(days=1), self.at(9, 30) + timedelta(days=1), room=self.rooms[0])
+        response = self.create_series(skip_conflicts=True)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(response.data['created']), 2)
+        self.assertEqual([item['position'] for item in response.data['conflicts']], [1])
+
+    def test_equipment_conflict_is_detected(self):
+        booked = self.book(self.at(9), self.at(9, 30), professional=self.professionals[1], room=self.rooms[1])
+        booked.equipment.add(self.equipment)
+        response = self.create_series()
+        self.assertEqual(response.status_code, 409)
+        self.assertIn(self.equipment.name, response.data['conflicts'][0]['error'])
+
+
+
+class CalendarTests(AppointmentFixtureMixin, TestCase):
+    """Feed compacto del calendario (GET /api/appointments/calendar/)."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_rows_and_referenced_tables(self):
+        appointment = self.book(self.at(9), self.at(10))
+        day = self.DAY.isoformat()
+        response = self.client.get('/api/appointments/calendar/', {'date_from': day, 'date_to': day})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.data['appointments']], [appointment.pk])
+        self.assertEqual([room['id'] for room in response.data['rooms']], [self.rooms[0].pk])
+
+    def test_invalid_dates_are_rejected(self):
+        day = self.DAY.isoformat()
+        for params in (
+            {'date_from': '2026-02-30', 'date_to': day},
+            {'date_from': day, 'date_to': '2026-04-31'},
+            {'date_from': day},
+        ):
+            response = self.client.get('/api/appointments/calendar/', params)
+            self.assertEqual(response.status_code, 400, params)
+
+
+class ReminderSchedulerTests(AppointmentFixtureMixin, TestCase):
+    """schedule_reminders: ventanas (desde, hasta], deduplicación y recuento."""
+
+    def setUp(self):
+        self.now = self.at(10)
+
+    def confirmed(self, *offsets):
+        # bulk_create evita las validaciones de horario: solo interesan las ventanas
+        return Appointment.objects.bulk_create([
+            Appointment(
+                patient=self.patient,
+                professional=self.professionals[0],
+                room=self.rooms[0],
+                start_time=self.now + offset,
+                end_time=self.now + offset + timedelta(minutes=1),
+                treatment_type='Revisión',
+                status=Appointment.Status.CONFIRMED,
+            )
+            for offset in offsets
+        ])
+
+    def reminders(self, window):
+        return set(
+            Notification.objects.filter(reminder_window=window).values_list('appointment__start_time', flat=True)
+        )
+
+    def test_window_edges(self):
+        self.confirmed(
+            timedelta(0),
+            timedelta(hours=2),
+            timedelta(hours=2, minutes=1),
+            timedelta(hours=24),
+            timedelta(hours=24, minutes=1),
+        )
+        created = schedule_reminders(now=self.now)
+
+        day_before, two_hours = Notification.ReminderWindow.DAY_BEFORE, Notification.ReminderWindow.TWO_HOURS
+        self.assertEqual(created, {day_before: 2, two_hours: 1})
+        self.assertEqual(self.reminders(two_hours), {self.now + timedelta(hours=2)})
+        self.assertEqual(
+            self.reminders(day_before),
+            {self.now + timedelta(hours=2, minutes=1), self.now + timedelta(hours=24)},
+        )
+
+    def test_second_run_creates_nothing(self):
+        self.confirmed(timedelta(hours=1), timedelta(hours=5), timedelta(hours=6))
+        first = schedule_reminders(now=self.now, chunk_size=1)
+        self.assertEqual(sum(first.values()), 3)
+
+        second = schedule_reminders(now=self.now, chunk_size=1)
+        self.assertEqual(sum(second.values()), 0)
+        self.assertEqual(Notification.objects.count(), 3)
+
+    def test_dry_run_counts_without_creating(self):
+        self.confirmed(timedelta(hours=1), timedelta(hours=5))
+        created = schedule_reminders(now=self.now, dry_run=True)
+        self.assertEqual(sum(created.values()), 2)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_rows_dropped_by_a_concurrent_run_are_not_counted(self):
+        first, second = self.confirmed(timedelta(hours=5), timedelta(hours=6))
+        window = Notification.ReminderWindow.DAY_BEFORE
+        original = reminders.build_reminder
+
+        def race(appointment_id, *args, **kwargs):
+            # Otra ejecución inserta el recordatorio después del filtro ~Exists
+            if appointment_id == first.pk:
+                Notification.objects.bulk_create([original(appointment_id, *args, **kwargs)])
+            return original(appointment_id, *args, **kwargs)
+
+        with mock.patch.object(reminders, 'build_reminder', side_effect=race):
+            created = schedule_reminders(now=self.now)
+
+        self.assertEqual(created[window], 1)
+        self.assertEqual(Notification.objects.filter(reminder_window=window).count(), 2)
+
+
+class EquipmentBookingTests(AppointmentFixtureMixin, TestCase):
+    """Equipos al reservar (equipment_conflicts) y disponibilidad por equipo."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.equipment = Equipment.objects.create(name='Escáner intraoral')
+
+    def create(self, start, end, equipment=None, professional=None, room=None):
+        return self.client.post('/api/appointments/', {
+            'patient_id': self.patient.pk,
+            'professional_id': (professional or self.professionals[0]).pk,
+            'room_id': (room or self.rooms[0]).pk,
+            'equipment_ids': [(equipment or self.equipment).pk],
+            'start_time': start.isoformat(),
+            'end_time': end.isoformat(),
+            'treatment_type': 'Ortodoncia',
+        }, format='json')
+
+    def book_with_equipment(self, start, end, status=Appointment.Status.PENDING):
+        appointment = Appointment.objects.create(
+            patient=self.patient,
+            professional=self.professionals[1],
+            room=self.rooms[1],
+            start_time=start,
+            end_time=end,
+            treatment_type='Revisión',
+            status=status,
+        )
+        appointment.equipment.add(self.equipment)
+        return appointment
+
+    def test_unavailable_equipment_is_rejected(self):
+        for changes in ({'status': Equipment.Status.OUT_OF_SERVICE}, {'status': Equipment.Status.MAINTENANCE},
+                        {'is_active': False}):
+            Equipment.objects.filter(pk=self.equipment.pk).update(
+                **{'status': Equipment.Status.AVAILABLE, 'is_active': True, **changes},
+            )
+            response = self.create(self.at(9), self.at(10))
+            self.assertEqual(response.status_code, 400, changes)
+            self.assertIn('no está disponible', response.data['equipment_ids'][0])
+        self.assertFalse(Appointment.objects.exists())
+
+    def test_double_booked_equipment_is_rejected(self):
+        self.book_with_equipment(self.at(9), self.at(10))
+        response = self.create(self.at(9, 30), self.at(10, 30))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ya está reservado', response.data['equipment_ids'][0])
+        # Contigua: [10:00, 11:00) no solapa con [09:00, 10:00)
+        self.assertEqual(self.create(self.at(10), self.at(11)).status_code, 201)
+
+    def test_inactive_bookings_do_not_hold_equipment(self):
+        self.book_with_equipment(self.at(9), self.at(10), status=Appointment.Status.CANCELLED)
+        self.assertEqual(self.create(self.at(9), self.at(10)).status_code, 201)
+
+    def test_rescheduling_rechecks_assigned_equipment(self):
+        self.book_with_equipment(self.at(11), self.at(12))
+        response = self.create(self.at(9), self.at(10))
+        self.assertEqual(response.status_code, 201)
+        response = self.client.patch(f"/api/appointments/{response.data['id']}/", {
+            'start_time': self.at(11, 30).isoformat(),
+            'end_time': self.at(12, 30).isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('equipment_ids', response.data)
+
+    def test_day_availability_lists_active_bookings(self):
+        booked = self.book_with_equipment(self.at(9), self.at(10))
+        self.book_with_equipment(self.at(11), self.at(12), status=Appointment.Status.CANCELLED)
+        self.book_with_equipment(self.at(9) + timedelta(days=1), self.at(10) + timedelta(days=1))
+        response = self.client.get(f'/api/equipment/{self.equipment.pk}/availability/', {'date': self.DAY.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], Equipment.Status.AVAILABLE)
+        self.assertEqual(
+            [(parse_datetime(slot['start']), parse_datetime(slot['end'])) for slot in response.data['occupied_slots']],
+            [(booked.start_time, booked.end_time)],
+        )
+        self.assertEqual(self.client.get(f'/api/equipment/{self.equipment.pk}/availability/').status_code, 400)
+
+    def test_range_availability_excludes_booked_equipment(self):
+        self.book_with_equipment(self.at(9), self.at(12))
+        url = f'/api/equipment/{self.equipment.pk}/availability/'
+        params = {'date_from': self.DAY.isoformat(), 'professional_ids': str(self.professionals[0].pk)}
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['equipment_ids'], [self.equipment.pk])
+        starts = [slot['start'] for slot in response.data['professionals'][0]['slots']]
+        self.assertEqual(starts, [self.at(12).isoformat()])
+
+        Equipment.objects.filter(pk=self.equipment.pk).update(status=Equipment.Status.OUT_OF_SERVICE)
+        response = self.client.get(url, params)
+        self.assertEqual(response.data['professionals'][0]['slots'], [])
+
+
+class IntervalIndexTests(AppointmentFixtureMixin, TestCase):
+    """El índice en memoria es un camino rápido; los conflictos se confirman en la BD."""
+
+    def setUp(self):
+        self.appointment = self.book(self.at(10), self.at(11), professional=self.professionals[0])
+        appointment_index.rebuild()
+        self.addCleanup(appointment_index.clear)
+
+    def overlaps(self):
+        return has_overlap(PROFESSIONAL, self.professionals[0].pk, self.at(10, 30), self.at(11, 30))
+
+    def test_index_answers_free_slots_without_queries(self):
+        with self.assertNumQueries(0):
+            self.assertFalse(has_overlap(PROFESSIONAL, self.professionals[0].pk, self.at(11), self.at(12)))
+
+    def test_conflict_is_confirmed_in_database(self):
+        self.assertTrue(self.overlaps())
+        # Cancelada desde otro worker: este índice no se entera hasta reconstruirse
+        Appointment.objects.filter(pk=self.appointment.pk).update(status=Appointment.Status.CANCELLED)
+        with self.assertNumQueries(1):
+            self.assertFalse(self.overlaps())
+
+    def test_stale_index_is_rebuilt_in_background(self):
+        # Pasado MAX_AGE no se reconstruye en la petición: se consulta la BD
+        later = appointment_index._built_at + 301
+        with mock.patch('appointments.intervals.time.monotonic', return_value=later), \
+                mock.patch.object(appointment_index, 'refresh_in_background') as refresh:
+            with self.assertNumQueries(1):
+                self.assertTrue(self.overlaps())
+        refresh.assert_called_once()
+
+
+class OverlapGuardTests(AppointmentFixtureMixin, TestCase):
+    """Restricciones de no solapamiento en la BD (migración 0006)."""
+
+    migration = import_module('appointments.migrations.0006_appointment_no_overlap_guards')
+
+    def overlapping(self, **kwargs):
+        values = {
+            'patient': self.patient,
+            'professional': self.professionals[0],
+            'room': self.rooms[0],
+            'start_time': self.at(10, 30),
+            'end_time': self.at(11, 30),
+            'treatment_type': 'Revisión',
+            **kwargs,
+        }
+        # bulk_create no pasa por clean(): solo queda la restricción de la BD
+        return Appointment.objects.bulk_create([Appointment(**values)])
+
+    def setUp(self):
+        self.book(self.at(10), self.at(11), professional=self.professionals[0], room=self.rooms[0])
+
+    def test_professional_overlap_is_rejected(self):
+        with self.assertRaisesMessage(IntegrityError, 'appointment_professional_no_overlap'), transaction.atomic():
+            self.overlapping(room=self.rooms[1])
+
+    def test_room_overlap_is_rejected(self):
+        with self.assertRaisesMessage(IntegrityError, 'appointment_room_no_overlap'), transaction.atomic():
+            self.overlapping(professional=self.professionals[1])
+
+    def test_cancelled_appointments_do_not_block(self):
+        self.overlapping(status=Appointment.Status.CANCELLED)
+        self.assertEqual(Appointment.objects.count(), 2)
+
+    @skipUnless(connection.vendor == 'sqlite', 'Los triggers solo existen en SQLite')
+    def test_sqlite_triggers_survive_later_migrations(self):
+        # Una migración que rehaga la tabla los eliminaría (ver migración 0006)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s",
+                [Appointment._meta.db_table],
+            )
+            triggers = {row[0] for row in cursor.fetchall()}
+        expected = {
+            f'{name}_{operation}' for _, name in self.migration.GUARDS for operation in ('insert', 'update')
+        }
+        self.assertEqual(expected - triggers, set())
+
+    @skipUnless(connection.vendor == 'sqlite', 'Desactiva los triggers de SQLite dentro de la transacción')
+    def test_migration_lists_existing_overlaps(self):
+        with connection.cursor() as cursor:
+            for _, name in self.migration.GUARDS:
+                cursor.execute(f'DROP TRIGGER {name}_insert')
+        first = Appointment.objects.get()
+        second, = self.overlapping(room=self.rooms[1])
+        self.assertEqual(self.migration.find_overlaps(connection), {'professional_id': [(first.pk, second.pk)]})
+        editor = mock.Mock(connection=connection)
+        with self.assertRaisesMessage(RuntimeError, f'professional_id: {first.pk}/{second.pk}'):
+            self.migration.check_existing_overlaps(None, editor)
+
+
+class FailingBackend(BaseBackend):
+    """Backend cuyo envío por lotes lanza una excepción con un mensaje concreto."""
+
+    def __init__(self, bad_title):
+        self.bad_title = bad_title
+        self.sent = []
+
+    def send_batch(self, notifications):
+        if any(notification.title == self.bad_title for notification in notifications):
+            raise ConnectionError('mensaje rechazado')
+        self.sent.extend(notification.pk for notification in notifications)
+        return [None] * len(notifications)
+
+
+class NotificationOutboxTests(AppointmentFixtureMixin, TestCase):
+    """Entrega de notificaciones por el outbox (appointments.outbox)."""
+
+    def notify(self, title, channel=Notification.Channel.EMAIL):
+        return Notification.objects.create(
+            patient=self.patient,
+            notification_type=Notification.NotificationType.APPOINTMENT_CONFIRMED,
+            channel=channel,
+            title=title,
+            message='...',
+        )
+
+    def test_pending_notifications_are_sent(self):
+        notification = self.notify('Cita confirmada', channel=Notification.Channel.IN_APP)
+        self.assertEqual(run_once(worker='test'), {'batches': 1, 'sent': 1, 'failed': 0})
+        notification.refresh_from_db()
+        self.assertEqual(notification.delivery_status, Notification.DeliveryStatus.SENT)
+        self.assertIsNotNone(notification.sent_at)
+
+    def test_raising_backend_only_fails_the_bad_message(self):
+        good = self.notify('Cita confirmada')
+        bad = self.notify('Roto')
+        backend = FailingBackend('Roto')
+        with mock.patch('appointments.outbox.get_backend', return_value=backend):
+            run_once(worker='test')
+        good.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertEqual(backend.sent, [good.pk])
+        self.assertEqual(good.delivery_status, Notification.DeliveryStatus.SENT)
+        self.assertEqual(bad.delivery_status, Notification.DeliveryStatus.RETRY)
+        self.assertEqual((bad.attempts, bad.last_error), (1, 'mensaje rechazado'))
+        self.assertGreater(bad.next_attempt_at, timezone.now())
+
+    def test_message_is_parked_after_max_attempts(self):
+        bad = self.notify('Roto')
+        backend = FailingBackend('Roto')
+        with mock.patch('appointments.outbox.get_backend', return_value=backend), \
+                self.settings(NOTIFICATION_DELIVERY={**settings.NOTIFICATION_DELIVERY, 'MAX_ATTEMPTS': 2}):
+            for _ in range(2):
+                Notification.objects.filter(pk=bad.pk).update(next_attempt_at=timezone.now())
+                run_once(worker='test')
+        bad.refresh_from_db()
+        self.assertEqual((bad.delivery_status, bad.attempts), (Notification.DeliveryStatus.DEAD, 2))
+
+    def test_expired_lease_counts_an_attempt(self):
+        crashed = self.notify('Cita confirmada', channel=Notification.Channel.IN_APP)
+        poison = self.notify('Bloquea al worker', channel=Notification.Channel.IN_APP)
+        expired = timezone.now() - timedelta(seconds=1)
+        Notification.objects.filter(pk=crashed.pk).update(
+            delivery_status=Notification.DeliveryStatus.SENDING, claimed_by='caido', next_attempt_at=expired,
+        )
+        Notification.objects.filter(pk=poison.pk).update(
+            delivery_status=Notification.DeliveryStatus.SENDING, claimed_by='caido', next_attempt_at=expired,
+            attempts=settings.NOTIFICATION_DELIVERY['MAX_ATTEMPTS'] - 1,
+        )
+        self.assertEqual(run_once(worker='test'), {'batches': 1, 'sent': 1, 'failed': 0})
+        crashed.refresh_from_db()
+        poison.refresh_from_db()
+        self.assertEqual((crashed.delivery_status, crashed.attempts), (Notification.DeliveryStatus.SENT, 1))
+        self.assertEqual(
+            (poison.delivery_status, poison.attempts),
+            (Notification.DeliveryStatus.DEAD, settings.NOTIFICATION_DELIVERY['MAX_ATTEMPTS']),
+        )
+        self.assertTrue(poison.last_error)
+
+    def test_migration_marks_existing_notifications_as_sent(self):
+        migration = import_module('appointments.migrations.0010_notification_outbox')
+        old = self.notify('Anterior al outbox')
+        migration.mark_sent(apps, None)
+        old.refresh_from_db()
+        self.assertEqual(old.delivery_status, Notification.DeliveryStatus.SENT)
+        self.assertEqual(old.sent_at, old.created_at)
+
+
+class NotificationRetentionTests(AppointmentFixtureMixin, TestCase):
+    """Archivo y borrado por lotes de notificaciones leídas (appointments.retention)."""
+
+    def setUp(self):
+        self.now = timezone.now()
+        old = self.now - timedelta(days=settings.NOTIFICATION_RETENTION['READ_MAX_AGE_DAYS'] + 1)
+        recent = self.now - timedelta(days=1)
+        delivery = Notification.DeliveryStatus
+        self.eligible = [
+            self.notify('Leída y enviada', old, read=True, status=delivery.SENT),
+            self.notify('Leída y descartada', old, read=True, status=delivery.DEAD),
+            self.notify('Leída y enviada (2)', old, read=True, status=delivery.SENT),
+        ]
+        self.kept = [
+            self.notify('Sin leer', old, read=False, status=delivery.SENT),
+            self.notify('Sin entregar', old, read=True, status=delivery.PENDING),
+            self.notify('En reintento', old, read=True, status=delivery.RETRY),
+            self.notify('Reciente', recent, read=True, status=delivery.SENT),
+        ]
+
+    def notify(self, title, created_at, read, status):
+        notification = Notification.objects.create(
+            patient=self.patient,
+            notification_type=Notification.NotificationType.APPOINTMENT_CONFIRMED,
+            channel=Notification.Channel.IN_APP,
+            title=title,
+            message='...',
+            read_at=self.now if read else None,
+            delivery_status=status,
+        )
+        Notification.objects.filter(pk=notification.pk).update(created_at=created_at)
+        return notification.pk
+
+    def assertOnlyKeptRemain(self):
+        self.assertEqual(sorted(Notification.objects.values_list('pk', flat=True)), sorted(self.kept))
+
+    def test_archive_mode_copies_then_deletes_in_batches(self):
+        metrics = compact_notifications(now=self.now, mode='archive', batch_size=2)
+        self.assertEqual(metrics, {'batches': 2, 'archived': 3, 'deleted': 3})
+        self.assertOnlyKeptRemain()
+        archived = NotificationArchive.objects.in_bulk(self.eligible)
+        self.assertEqual(len(archived), 3)
+        self.assertEqual(archived[self.eligible[1]].title, 'Leída y descartada')
+        self.assertEqual(archived[self.eligible[0]].patient_id, self.patient.pk)
+
+    def test_delete_mode_does_not_archive(self):
+        metrics = compact_notifications(now=self.now, mode='delete', batch_size=2)
+        self.assertEqual(metrics, {'batches': 2, 'archived': 0, 'deleted': 3})
+        self.assertOnlyKeptRemain()
+        self.assertFalse(NotificationArchive.objects.exists())
+
+    def test_max_batches_bounds_a_run(self):
+        metrics = compact_notifications(now=self.now, mode='delete', batch_size=1, max_batches=2)
+        self.assertEqual(metrics['deleted'], 2)
+        self.assertEqual(Notification.objects.filter(pk__in=self.eligible).count(), 1)
+
+    @skipUnless(connection.vendor == 'sqlite', 'En PostgreSQL el archivo caduca por particiones')
+    def test_archive_expiry_deletes_rows_in_batches(self):
+        compact_notifications(now=self.now, mode='archive')
+        max_age = settings.NOTIFICATION_RETENTION['ARCHIVE_MAX_AGE_DAYS']
+        expired = self.eligible[:2]
+        NotificationArchive.objects.filter(pk__in=expired).update(
+            created_at=self.now - timedelta(days=max_age + 1),
+        )
+        self.assertEqual(purge_archive(now=self.now, max_age_days=0), {'partitions_dropped': 0, 'archive_deleted': 0})
+        metrics = purge_archive(now=self.now, batch_size=1)
+        self.assertEqual(metrics['archive_deleted'], 2)
+        self.assertEqual(list(NotificationArchive.objects.values_list('pk', flat=True)), [self.eligible[2]])
+
+    def test_command_dry_run_only_counts(self):
+        out = io.StringIO()
+        call_command('purge_notifications', '--dry-run', stdout=out)
+        self.assertIn('Notificaciones que se procesarían: 3', out.getvalue())
+        self.assertEqual(Notification.objects.count(), 7)
 
-# Create your tests here.
+    def test_command_runs_retention(self):
+        out = io.StringIO()
+        call_command('purge_notifications', '--mode', 'delete', '--batch-size', '2', stdout=out)
+        self.assertIn('Lotes: 2, archivadas: 0, eliminadas: 3', out.getvalue())
+        self.assertOnlyKeptRemain()
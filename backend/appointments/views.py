@@ -1,16 +1,85 @@
-from django.db import transaction
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Max, TextField, Value, When
+from django.db.models.functions import Concat
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.http import parse_etags, quote_etag
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.exceptions import APIException, PermissionDenied, ValidationError
 from rest_framework.response import Response
 
-from .models import Appointment, Notification
-from .serializers import AppointmentSerializer, NotificationSerializer
+from core.dates import local_day_bounds
+from core.filters import parse_filter
+from patients.models import PatientProfile
+from resources.models import Room
+from staff.models import ProfessionalProfile
+
+from .allocation import allocate_room
+from .availability import MAX_RANGE_DAYS, free_slots_for, parse_id_list
+from .intervals import sync_after_commit
+from .models import Appointment, Notification, StaleVersionError
+from .recurrence import find_conflicts, generate_occurrences
+from .serializers import (
+    AppointmentBulkActionSerializer,
+    AppointmentSerializer,
+    AppointmentSeriesSerializer,
+    NotificationSerializer,
+)
+
+
+class VersionConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'La cita ha sido modificada por otro usuario. Por favor, recargue la información.'
+    default_code = 'version_conflict'
+
+
+def expected_version(request):
+    """Versión que el cliente dice haber leído (opcional en las acciones de estado)."""
+    version = request.data.get('version')
+    if version in (None, ''):
+        return None
+    try:
+        return int(version)
+    except (TypeError, ValueError):
+        raise ValidationError({'version': 'La versión debe ser un número entero.'})
+
+
+# Cambios de estado masivos: estados de origen permitidos y estado final
+BULK_TRANSITIONS = {
+    'approve': ([Appointment.Status.PENDING], Appointment.Status.CONFIRMED),
+    'complete': ([Appointment.Status.PENDING, Appointment.Status.CONFIRMED], Appointment.Status.COMPLETED),
+    'cancel': ([Appointment.Status.PENDING, Appointment.Status.CONFIRMED], Appointment.Status.CANCELLED),
+}
+
+
+def bulk_notification(appointment, target):
+    """Notificación al paciente tras un cambio de estado masivo."""
+    if target == Appointment.Status.CONFIRMED:
+        start = timezone.localtime(appointment.start_time).strftime('%d/%m/%Y %H:%M')
+        return Notification(
+            appointment=appointment,
+            patient_id=appointment.patient_id,
+            notification_type=Notification.NotificationType.APPOINTMENT_CONFIRMED,
+            title='Cita confirmada',
+            message=f'Su cita para {appointment.treatment_type} el {start} ha sido confirmada.',
+        )
+    return Notification(
+        appointment=appointment,
+        patient_id=appointment.patient_id,
+        notification_type=Notification.NotificationType.APPOINTMENT_CANCELLED,
+        title='Cita cancelada',
+        message=f'Su cita para {appointment.treatment_type} ha sido cancelada.',
+    )
 
 
 class AppointmentViewSet(viewsets.ModelViewSet):
     serializer_class = AppointmentSerializer
+    # Los empates en el primer campo se paginan por offset (ver core.pagination)
+    cursor_ordering = ('start_time', 'id')
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
@@ -57,21 +126,24 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                 raise PermissionDenied('El paciente no tiene perfil asociado.')
             extra['patient'] = patient_profile
             extra['status'] = Appointment.Status.PENDING
-            
-            # Si no se proporciona room_id, asignar una sala por defecto (primera sala activa)
-            if 'room' not in serializer.validated_data or serializer.validated_data.get('room') is None:
-                from resources.models import Room
-                default_room = Room.objects.filter(is_active=True).first()
-                if default_room:
-                    extra['room'] = default_room
-                else:
-                    raise ValidationError('No hay salas disponibles. Por favor, contacte con el administrador.')
         
         if user.role == user.Roles.PROFESSIONAL and 'professional' not in serializer.validated_data:
             professional_profile = getattr(user, 'professional_profile', None)
             if professional_profile:
                 extra['professional'] = professional_profile
         
+        # Si no se proporciona room_id, asignar la sala libre de mejor ajuste
+        data = serializer.validated_data
+        if data.get('room') is None and data.get('start_time') and data.get('end_time'):
+            room = allocate_room(
+                data['start_time'],
+                data['end_time'],
+                equipment_ids=[item.pk for item in data.get('equipment', [])],
+            )
+            if room is None:
+                raise ValidationError('No hay salas disponibles en ese horario.')
+            extra['room'] = room
+        
         appointment = serializer.save(**extra)
         
         # Crear notificación para paciente
@@ -87,14 +159,7 @@ class AppointmentViewSet(viewsets.ModelViewSet):
     @transaction.atomic
     def perform_update(self, serializer):
         user = self.request.user
-        appointment = self.get_object()
-        
-        # Validación de bloqueo optimista
-        if 'version' in serializer.validated_data:
-            if serializer.validated_data['version'] != appointment.version:
-                raise ValidationError({
-                    'version': 'La cita ha sido modificada por otro usuario. Por favor, recargue la información.'
-                })
+        appointment = serializer.instance
         
         # Restricciones para pacientes
         if user.role == user.Roles.PATIENT:
@@ -113,8 +178,11 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                     raise ValidationError({'status': error})
         
         old_status = appointment.status
-        serializer.save()
-        appointment.refresh_from_db()
+        # Bloqueo optimista: UPDATE ... WHERE id = %s AND version = %s
+        try:
+            serializer.save()
+        except StaleVersionError:
+            raise VersionConflict()
         
         # Crear notificación si cambió el estado
         if old_status != appointment.status:
@@ -135,6 +203,117 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                     message=f'Su cita para {appointment.treatment_type} ha sido cancelada.',
                 )
 
+    @action(detail=False, methods=['post'])
+    def series(self, request):
+        """Crear una serie de citas recurrentes (p. ej. revisiones de ortodoncia)
+
+        Todas las ocurrencias se validan con una sola consulta y se crean con
+        bulk_create. Si hay conflictos se devuelven por ocurrencia; con
+        ``skip_conflicts`` se crean solo las que no los tienen.
+        """
+        if request.user.role not in [request.user.Roles.ADMIN, request.user.Roles.PROFESSIONAL]:
+            raise PermissionDenied('No autorizado para crear series de citas.')
+
+        serializer = AppointmentSeriesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        recurrence = data['recurrence']
+
+        occurrences = generate_occurrences(
+            data['start_time'],
+            timedelta(minutes=data['duration_minutes']),
+            recurrence['frequency'],
+            interval=recurrence['interval'],
+            count=recurrence.get('count'),
+            until=recurrence.get('until'),
+        )
+        conflicts = find_conflicts(
+            occurrences,
+            data['professional'].pk,
+            data['room'].pk,
+            equipment_ids=[item.pk for item in data.get('equipment') or []],
+        )
+        conflict_list = [
+            {
+                'position': position,
+                'start': occurrences[position][0].isoformat(),
+                'end': occurrences[position][1].isoformat(),
+                'error': reason,
+            }
+            for position, reason in sorted(conflicts.items())
+        ]
+        if conflicts and (not data['skip_conflicts'] or len(conflicts) == len(occurrences)):
+            return Response(
+                {
+                    'detail': 'Algunas citas de la serie coinciden con otras reservas.',
+                    'conflicts': conflict_list,
+                },
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        appointments = [
+            Appointment(
+                patient=data['patient'],
+                professional=data['professional'],
+                room=data['room'],
+                start_time=start,
+                end_time=end,
+                status=data['status'],
+                treatment_type=data['treatment_type'],
+                notes=data['notes'],
+                created_by=request.user,
+            )
+            for position, (start, end) in enumerate(occurrences)
+            if position not in conflicts
+        ]
+        try:
+            with transaction.atomic():
+                appointments = Appointment.objects.bulk_create(appointments)
+                equipment = data.get('equipment') or []
+                Appointment.equipment.through.objects.bulk_create([
+                    Appointment.equipment.through(appointment_id=appointment.pk, equipment_id=item.pk)
+                    for appointment in appointments
+                    for item in equipment
+                ])
+                first = appointments[0]
+                confirmed = data['status'] == Appointment.Status.CONFIRMED
+                Notification.objects.create(
+                    appointment=first,
+                    patient=first.patient,
+                    notification_type=(
+                        Notification.NotificationType.APPOINTMENT_CONFIRMED
+                        if confirmed
+                        else Notification.NotificationType.APPOINTMENT_REMINDER
+                    ),
+                    title='Serie de citas programada' if confirmed else 'Serie de citas solicitada',
+                    message=(
+                        f'Se han programado {len(appointments)} citas para {first.treatment_type} '
+                        f'a partir del {timezone.localtime(first.start_time).strftime("%d/%m/%Y %H:%M")}.'
+                    ),
+                )
+                sync_after_commit(appointments)
+        except IntegrityError:
+            # Otra reserva ha ocupado alguna franja entre la validación y la inserción
+            return Response(
+                {'detail': 'La disponibilidad ha cambiado mientras se creaba la serie. Vuelva a intentarlo.'},
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        return Response(
+            {
+                'created': [
+                    {
+                        'id': appointment.pk,
+                        'start': appointment.start_time.isoformat(),
+                        'end': appointment.end_time.isoformat(),
+                    }
+                    for appointment in appointments
+                ],
+                'conflicts': conflict_list,
+            },
+            status=status.HTTP_201_CREATED,
+        )
+
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
         """Aprobar una cita pendiente"""
@@ -146,7 +325,10 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             raise ValidationError('Solo se pueden aprobar citas pendientes.')
         
         appointment.status = Appointment.Status.CONFIRMED
-        appointment.save(update_fields=['status'])
+        try:
+            appointment.save_if_version(['status'], expected_version(request))
+        except StaleVersionError:
+            raise VersionConflict()
         
         # Crear notificación
         Notification.objects.create(
@@ -172,7 +354,7 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         reason = request.data.get('reason', '')
         
         try:
-            appointment.cancel(user, reason)
+            appointment.cancel(user, reason, expected_version(request))
             
             # Crear notificación
             Notification.objects.create(
@@ -184,8 +366,10 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             )
             
             return Response({'status': 'cancelled'}, status=status.HTTP_200_OK)
-        except ValidationError as e:
-            raise ValidationError({'error': str(e)})
+        except DjangoValidationError as e:
+            raise ValidationError({'error': ' '.join(e.messages)})
+        except StaleVersionError:
+            raise VersionConflict()
 
     @action(detail=True, methods=['post'])
     def complete(self, request, pk=None):
@@ -195,10 +379,107 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             raise PermissionDenied('No autorizado para completar citas.')
         
         appointment.status = Appointment.Status.COMPLETED
-        appointment.save(update_fields=['status'])
+        try:
+            appointment.save_if_version(['status'], expected_version(request))
+        except StaleVersionError:
+            raise VersionConflict()
         
         return Response({'status': 'completed'}, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['post'], url_path='bulk-approve')
+    def bulk_approve(self, request):
+        """Aprobar varias citas pendientes (lista de ids o filtro)"""
+        return self._bulk_transition(request, 'approve')
+
+    @action(detail=False, methods=['post'], url_path='bulk-complete')
+    def bulk_complete(self, request):
+        """Marcar varias citas como completadas (lista de ids o filtro)"""
+        return self._bulk_transition(request, 'complete')
+
+    @action(detail=False, methods=['post'], url_path='bulk-cancel')
+    def bulk_cancel(self, request):
+        """Cancelar varias citas (lista de ids o filtro)"""
+        return self._bulk_transition(request, 'cancel')
+
+    def _bulk_transition(self, request, name):
+        """
+        Cambio de estado masivo: bloquea las citas seleccionadas, descarta las
+        que no están en un estado de origen válido y aplica un único UPDATE a
+        las restantes. Las notificaciones se crean con bulk_create y la
+        respuesta incluye el resultado de cada cita.
+        """
+        if request.user.role not in [request.user.Roles.ADMIN, request.user.Roles.PROFESSIONAL]:
+            raise PermissionDenied('No autorizado para modificar citas de forma masiva.')
+
+        serializer = AppointmentBulkActionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        sources, target = BULK_TRANSITIONS[name]
+        limit = AppointmentBulkActionSerializer.MAX_APPOINTMENTS
+
+        queryset = Appointment.objects.only(
+            'id', 'patient_id', 'professional_id', 'room_id',
+            'start_time', 'end_time', 'status', 'treatment_type',
+        )
+        if data.get('ids'):
+            queryset = queryset.filter(pk__in=data['ids'])
+        else:
+            filters = data['filter']
+            range_start, range_end = local_day_bounds(filters['date_from'], filters['date_to'])
+            queryset = queryset.filter(start_time__gte=range_start, start_time__lt=range_end)
+            for field in ('status', 'professional_id', 'room_id'):
+                if filters.get(field) is not None:
+                    queryset = queryset.filter(**{field: filters[field]})
+
+        results = {}
+        with transaction.atomic():
+            appointments = list(queryset.select_for_update().order_by('pk')[:limit + 1])
+            if len(appointments) > limit:
+                raise ValidationError({'filter': f'El filtro selecciona más de {limit} citas.'})
+
+            eligible = []
+            for appointment in appointments:
+                if appointment.status in sources:
+                    eligible.append(appointment)
+                    results[appointment.pk] = {'id': appointment.pk, 'result': 'updated'}
+                else:
+                    results[appointment.pk] = {
+                        'id': appointment.pk,
+                        'result': 'skipped',
+                        'error': f'La cita está en estado {appointment.get_status_display().lower()}.',
+                    }
+
+            if eligible:
+                changes = {'status': target, 'version': F('version') + 1, 'updated_at': timezone.now()}
+                if name == 'cancel' and data['reason']:
+                    note = f"Cancelación: {data['reason']}"
+                    changes['notes'] = Case(
+                        When(notes='', then=Value(note)),
+                        default=Concat('notes', Value(f'\n\n{note}'), output_field=TextField()),
+                        output_field=TextField(),
+                    )
+                # Las filas están bloqueadas: el UPDATE afecta exactamente a las validadas
+                Appointment.objects.filter(pk__in=[appointment.pk for appointment in eligible]).update(**changes)
+                for appointment in eligible:
+                    appointment.status = target
+                Notification.objects.bulk_create(
+                    bulk_notification(appointment, target) for appointment in eligible
+                    if target != Appointment.Status.COMPLETED
+                )
+                sync_after_commit(eligible)
+
+        if data.get('ids'):
+            ordered = [
+                results.get(pk, {'id': pk, 'result': 'not_found', 'error': 'La cita no existe.'})
+                for pk in dict.fromkeys(data['ids'])
+            ]
+        else:
+            ordered = list(results.values())
+        return Response(
+            {'updated': len(eligible), 'results': ordered},
+            status=status.HTTP_200_OK,
+        )
+
     def destroy(self, request, *args, **kwargs):
         """Eliminar una cita, pero no permitir eliminar citas pasadas"""
         appointment = self.get_object()
@@ -215,19 +496,111 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         # Si la cita es futura, proceder con la eliminación
         return super().destroy(request, *args, **kwargs)
 
+    @action(detail=False, methods=['get'])
+    def calendar(self, request):
+        """Feed compacto de citas para vistas de calendario
+
+        Devuelve filas planas (ids, horas, estado y tratamiento) obtenidas con
+        una proyección ``values_list`` y, aparte, tablas con los pacientes,
+        profesionales y salas referenciados, de modo que el tamaño de la
+        respuesta crece solo con el número de citas.
+        """
+        date_from = parse_filter(request.query_params, 'date_from', parse_date)
+        date_to = parse_filter(request.query_params, 'date_to', parse_date)
+        if not date_from or not date_to or date_to < date_from:
+            raise ValidationError({'date_from': 'Se requieren date_from y date_to válidos (AAAA-MM-DD).'})
+        if (date_to - date_from).days >= MAX_RANGE_DAYS:
+            raise ValidationError({'date_to': f'El rango no puede superar {MAX_RANGE_DAYS} días.'})
+
+        range_start, range_end = local_day_bounds(date_from, date_to)
+        queryset = Appointment.objects.filter(start_time__gte=range_start, start_time__lt=range_end)
+        user = request.user
+        if user.role == user.Roles.PATIENT:
+            queryset = queryset.filter(patient__user=user)
+
+        statuses = [value for value in request.query_params.get('status', '').split(',') if value]
+        if statuses:
+            queryset = queryset.filter(status__in=statuses)
+        professional_ids = parse_id_list(request.query_params, 'professional_ids')
+        if professional_ids:
+            queryset = queryset.filter(professional_id__in=professional_ids)
+        room_ids = parse_id_list(request.query_params, 'room_ids')
+        if room_ids:
+            queryset = queryset.filter(room_id__in=room_ids)
+
+        rows = queryset.order_by('start_time', 'id').values_list(
+            'id',
+            'start_time',
+            'end_time',
+            'status',
+            'treatment_type',
+            'patient_id',
+            'professional_id',
+            'room_id',
+        )
+        appointments = []
+        referenced = {'patients': set(), 'professionals': set(), 'rooms': set()}
+        for pk, start, end, appointment_status, treatment, patient_id, professional_id, room_id in rows:
+            appointments.append({
+                'id': pk,
+                'start': start.isoformat(),
+                'end': end.isoformat(),
+                'status': appointment_status,
+                'treatment': treatment,
+                'patient_id': patient_id,
+                'professional_id': professional_id,
+                'room_id': room_id,
+            })
+            referenced['patients'].add(patient_id)
+            referenced['professionals'].add(professional_id)
+            referenced['rooms'].add(room_id)
+
+        patients = PatientProfile.objects.filter(pk__in=referenced['patients']).values_list(
+            'id', 'user__first_name', 'user__last_name',
+        )
+        professionals = ProfessionalProfile.objects.filter(pk__in=referenced['professionals']).values_list(
+            'id', 'user__first_name', 'user__last_name', 'specialty',
+        )
+        rooms = Room.objects.filter(pk__in=referenced['rooms']).values_list('id', 'name')
+
+        return Response({
+            'appointments': appointments,
+            'patients': [
+                {'id': pk, 'name': f'{first_name} {last_name}'.strip()}
+                for pk, first_name, last_name in patients
+            ],
+            'professionals': [
+                {'id': pk, 'name': f'{first_name} {last_name}'.strip(), 'specialty': specialty}
+                for pk, first_name, last_name, specialty in professionals
+            ],
+            'rooms': [{'id': pk, 'name': name} for pk, name in rooms],
+        })
+
     @action(detail=False, methods=['get'])
     def availability(self, request):
-        """Consultar disponibilidad de profesionales y salas"""
+        """Consultar disponibilidad de profesionales y salas
+
+        Con ``date`` devuelve las franjas ocupadas de ese día (filtrables por
+        ``professional_id``, ``room_id`` y ``equipment_id``). Con ``date_from``
+        (y opcionalmente ``date_to``, ``duration``, ``step``, ``professional_ids``,
+        ``room_ids`` y ``equipment_ids``) devuelve las franjas libres reservables
+        de todos los profesionales y salas indicados en una sola respuesta.
+        """
+        if request.query_params.get('date_from'):
+            return Response(free_slots_for(request.query_params))
+
         professional_id = request.query_params.get('professional_id')
         room_id = request.query_params.get('room_id')
-        date = request.query_params.get('date')
+        date = parse_filter(request.query_params, 'date', parse_date)
         
         if not date:
             return Response({'error': 'Se requiere el parámetro date'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Obtener citas ocupadas
+        # Obtener citas ocupadas (rango de medianoche a medianoche local, usa índices)
+        day_start, day_end = local_day_bounds(date)
         occupied = Appointment.objects.filter(
-            start_time__date=date,
+            start_time__gte=day_start,
+            start_time__lt=day_end,
             status__in=[Appointment.Status.PENDING, Appointment.Status.CONFIRMED],
         )
         
@@ -237,6 +610,10 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         if room_id:
             occupied = occupied.filter(room_id=room_id)
         
+        equipment_id = request.query_params.get('equipment_id')
+        if equipment_id:
+            occupied = occupied.filter(equipment__id=equipment_id)
+        
         # Retornar horarios ocupados
         occupied_slots = [
             {
@@ -251,6 +628,7 @@ class AppointmentViewSet(viewsets.ModelViewSet):
 
 class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = NotificationSerializer
+    cursor_ordering = ('-created_at', '-id')
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
@@ -258,17 +636,41 @@ class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
         if user.role == user.Roles.PATIENT:
             patient_profile = getattr(user, 'patient_profile', None)
             if patient_profile:
-                return Notification.objects.filter(patient=patient_profile)
+                return Notification.objects.filter(patient=patient_profile).select_related('patient__user')
             return Notification.objects.none()
         # Profesionales y admins ven todas las notificaciones
-        return Notification.objects.all()
+        return Notification.objects.select_related('patient__user')
+
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        """Número de notificaciones no leídas (para el indicador de la campana)
+
+        Se resuelve sobre el índice parcial de no leídas. Devuelve un ETag con
+        el número y la última notificación no leída: si el cliente lo envía en
+        ``If-None-Match`` y nada ha cambiado, la respuesta es 304 sin cuerpo.
+        """
+        queryset = self.get_queryset().filter(read_at__isnull=True)
+        patient_id = request.query_params.get('patient_id')
+        if patient_id and request.user.role != request.user.Roles.PATIENT:
+            queryset = queryset.filter(patient_id=patient_id)
+        summary = queryset.order_by().aggregate(unread=Count('pk'), latest_id=Max('pk'))
+
+        etag = quote_etag(f"unread-{summary['unread']}-{summary['latest_id'] or 0}")
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(summary)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
 
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         """Marcar una notificación como leída"""
-        notification = self.get_object()
-        notification.read_at = timezone.now()
-        notification.save(update_fields=['read_at'])
+        updated = self.get_queryset().filter(pk=pk, read_at__isnull=True).update(read_at=timezone.now())
+        if not updated:
+            # Ya leída (idempotente) o inexistente para este usuario
+            self.get_object()
         return Response({'status': 'read'}, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['post'])
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Budget, Invoice, InvoiceItem, Service
+from .models import BillingDailyRollup, Budget, Invoice, InvoiceExportJob, InvoiceItem, Service
 
 
 class InvoiceItemInline(admin.TabularInline):
@@ -25,3 +25,16 @@ class InvoiceAdmin(admin.ModelAdmin):
 class BudgetAdmin(admin.ModelAdmin):
     list_display = ('id', 'patient', 'professional', 'status', 'estimated_cost')
     list_filter = ('status',)
+
+
+@admin.register(BillingDailyRollup)
+class BillingDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'status', 'invoice_count', 'total')
+    list_filter = ('status',)
+    date_hierarchy = 'day'
+
+
+@admin.register(InvoiceExportJob)
+class InvoiceExportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'date_from', 'date_to', 'status', 'processed', 'total', 'created_at')
+    list_filter = ('status',)
@@ -0,0 +1,173 @@
+"""
+Facturación por lotes de citas completadas.
+
+Las citas COMPLETED de un periodo que aún no tienen línea de factura se
+agrupan por paciente: una factura por paciente y una línea por cita, con el
+``Service`` cuyo nombre coincide (sin distinguir mayúsculas) con
+``Appointment.treatment_type``. Cada línea queda enlazada a su cita
+(``InvoiceItem.appointment``, uno a uno), así que una cita nunca se factura
+dos veces aunque se lancen dos ejecuciones a la vez.
+
+Facturas y líneas se insertan con ``bulk_create`` en transacciones de
+``chunk_size`` pacientes; como así no pasa por ``Invoice.save``, el agregado
+diario (``billing.rollup``) y el dashboard se actualizan aquí.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from appointments.models import Appointment
+from core.dates import local_day_bounds
+
+from .dashboard import invalidate_dashboard
+from .models import Invoice, InvoiceItem, Service
+from .revenue import invalidate_revenue_for
+from .rollup import apply_deltas
+
+
+def service_map():
+    """{nombre en minúsculas: servicio} de los servicios activos."""
+    return {
+        service.lower_name: service
+        for service in Service.objects.filter(is_active=True).annotate(lower_name=Lower('name'))
+    }
+
+
+def billable_appointments(date_from=None, date_to=None, appointments=None):
+    """Citas completadas sin facturar (opcionalmente de un periodo o de un queryset dado)."""
+    queryset = Appointment.objects.all() if appointments is None else appointments
+    queryset = queryset.filter(status=Appointment.Status.COMPLETED, invoice_item__isnull=True)
+    if date_from or date_to:
+        range_start, range_end = local_day_bounds(date_from or date_to, date_to or date_from)
+        queryset = queryset.filter(start_time__gte=range_start, start_time__lt=range_end)
+    return queryset
+
+
+def locked_billable(ids):
+    """
+    Citas de ``ids`` aún sin facturar, bloqueadas hasta el fin de la transacción.
+
+    El filtro de sin facturar es un LEFT JOIN con las líneas; PostgreSQL no
+    permite FOR UPDATE sobre el lado nulo de un outer join, así que solo se
+    bloquean las filas de citas (``of=('self',)``).
+    """
+    return billable_appointments(
+        appointments=Appointment.objects.select_for_update(of=('self',)).filter(pk__in=ids),
+    )
+
+
+def invoice_appointments(
+    date_from=None,
+    date_to=None,
+    appointments=None,
+    issued_by=None,
+    status=Invoice.Status.DRAFT,
+    chunk_size=200,
+    dry_run=False,
+):
+    """
+    Crea una factura por paciente con sus citas completadas sin facturar.
+
+    Devuelve ``{'invoices': [...], 'skipped': [...]}``: por paciente, la
+    factura creada, sus citas y el total; y las citas que no se facturaron
+    con el motivo (sin servicio para el tratamiento o ya facturadas).
+    """
+    services = service_map()
+    rows = (
+        billable_appointments(date_from, date_to, appointments)
+        .order_by('patient_id', 'start_time', 'pk')
+        .values_list('pk', 'patient_id', 'treatment_type')
+    )
+    by_patient = defaultdict(list)
+    skipped = []
+    for pk, patient_id, treatment_type in rows:
+        service = services.get(treatment_type.strip().lower())
+        if service is None:
+            skipped.append({'appointment': pk, 'reason': f'No hay servicio para el tratamiento "{treatment_type}".'})
+        else:
+            by_patient[patient_id].append((pk, service))
+
+    results = []
+    patients = list(by_patient)
+    for start in range(0, len(patients), chunk_size):
+        chunk = {patient_id: by_patient[patient_id] for patient_id in patients[start:start + chunk_size]}
+        if dry_run:
+            results.extend(
+                {
+                    'patient': patient_id,
+                    'invoice': None,
+                    'appointments': [pk for pk, _ in lines],
+                    'total': sum(service.base_price for _, service in lines),
+                }
+                for patient_id, lines in chunk.items()
+            )
+            continue
+        chunk_results, chunk_skipped = _invoice_chunk(chunk, issued_by, status)
+        results.extend(chunk_results)
+        skipped.extend(chunk_skipped)
+    return {'invoices': results, 'skipped': skipped}
+
+
+@transaction.atomic
+def _invoice_chunk(chunk, issued_by, status):
+    # Volver a comprobar dentro de la transacción: otra ejecución puede haberlas facturado
+    ids = [pk for lines in chunk.values() for pk, _ in lines]
+    still_billable = set(locked_billable(ids).values_list('pk', flat=True))
+    skipped = [
+        {'appointment': pk, 'reason': 'La cita ya está facturada.'}
+        for pk in ids
+        if pk not in still_billable
+    ]
+    chunk = {
+        patient_id: [(pk, service) for pk, service in lines if pk in still_billable]
+        for patient_id, lines in chunk.items()
+    }
+    chunk = {patient_id: lines for patient_id, lines in chunk.items() if lines}
+    if not chunk:
+        return [], skipped
+
+    due_date = timezone.localdate() + timedelta(days=30) if status == Invoice.Status.SENT else None
+    invoices = Invoice.objects.bulk_create([
+        Invoice(
+            patient_id=patient_id,
+            issued_by=issued_by,
+            status=status,
+            due_date=due_date,
+            total=sum(service.base_price for _, service in lines),
+        )
+        for patient_id, lines in chunk.items()
+    ])
+    InvoiceItem.objects.bulk_create([
+        InvoiceItem(
+            invoice=invoice,
+            service=service,
+            quantity=1,
+            unit_price=service.base_price,
+            appointment_id=pk,
+        )
+        for invoice, lines in zip(invoices, chunk.values())
+        for pk, service in lines
+    ])
+
+    # bulk_create no pasa por Invoice.save ni emite señales: agregado, dashboard e ingresos
+    deltas = defaultdict(lambda: (0, Decimal('0')))
+    for invoice in invoices:
+        count, amount = deltas[(invoice.issued_at, status)]
+        deltas[(invoice.issued_at, status)] = (count + 1, amount + invoice.total)
+    apply_deltas(deltas)
+    transaction.on_commit(invalidate_dashboard)
+    invalidate_revenue_for(invoice.issued_at for invoice in invoices)
+    results = [
+        {
+            'patient': invoice.patient_id,
+            'invoice': invoice.pk,
+            'appointments': [pk for pk, _ in lines],
+            'total': invoice.total,
+        }
+        for invoice, lines in zip(invoices, chunk.values())
+    ]
+    return results, skipped
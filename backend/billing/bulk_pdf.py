@@ -0,0 +1,166 @@
+"""
+Exportación masiva de PDF de facturas (cierre mensual).
+
+Un ``InvoiceExportJob`` recorre las facturas del periodo por tandas de
+``INVOICE_EXPORT['CHUNK_SIZE']``. Los PDF que no están en la caché de
+``billing.pdf`` se generan en paralelo en un ``ProcessPoolExecutor`` (el
+renderizado con reportlab es CPU puro), se guardan en la caché y se añaden al
+ZIP desde disco. Así en memoria solo está la tanda en curso y las descargas
+individuales posteriores ya encuentran el PDF generado.
+
+El progreso (``processed``/``total``) y ``heartbeat_at`` se actualizan tras
+cada tanda. Las peticiones solo crean el trabajo (PENDING); lo ejecuta el
+worker ``run_invoice_exports``, fuera de los procesos web, igual que el outbox
+de notificaciones. El comando ``export_invoice_pdfs`` crea y ejecuta uno en
+primer plano.
+
+Si el worker cae a mitad de un trabajo, este queda RUNNING sin latido: pasados
+``INVOICE_EXPORT['STALE_SECONDS']`` el worker lo marca FAILED para que no
+aparezca en curso para siempre y pueda pedirse de nuevo.
+"""
+import logging
+import multiprocessing
+import shutil
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Invoice, InvoiceExportJob
+from .pdf import cached_pdf_path, context_hash, invoice_context, render_invoice_pdf, store_pdf
+
+logger = logging.getLogger(__name__)
+
+Status = InvoiceExportJob.Status
+
+
+def export_queryset(job):
+    invoices = Invoice.objects.filter(issued_at__gte=job.date_from, issued_at__lte=job.date_to)
+    if job.invoice_status:
+        invoices = invoices.filter(status=job.invoice_status)
+    return invoices.select_related('patient__user').prefetch_related('items__service').order_by('pk')
+
+
+def archive_name(job):
+    return f'invoice_exports/facturas_{job.date_from:%Y%m%d}_{job.date_to:%Y%m%d}_{job.pk}.zip'
+
+
+def entry_name(invoice):
+    return f'factura_{invoice.id:04d}.pdf'
+
+
+def write_chunk(archive, executor, invoices):
+    """Añade al ZIP los PDF de una tanda, generando los que no estén en caché."""
+    missing = []
+    for invoice in invoices:
+        context = invoice_context(invoice)
+        digest = context_hash(context)
+        # Un solo acceso al fichero: otra petición puede sustituir la versión
+        # cacheada (store_pdf borra las anteriores) entre comprobar y leer
+        try:
+            with cached_pdf_path(invoice.pk, digest).open('rb') as cached:
+                with archive.open(entry_name(invoice), 'w') as entry:
+                    shutil.copyfileobj(cached, entry)
+        except FileNotFoundError:
+            missing.append((invoice, digest, context))
+
+    rendered = executor.map(render_invoice_pdf, [context for _, _, context in missing])
+    for (invoice, digest, _), content in zip(missing, rendered):
+        store_pdf(invoice.pk, digest, content)
+        archive.writestr(entry_name(invoice), content)
+
+
+def run_export_job(job_id):
+    """Ejecuta un trabajo de exportación y deja el ZIP en MEDIA_ROOT."""
+    config = settings.INVOICE_EXPORT
+    job = InvoiceExportJob.objects.get(pk=job_id)
+    invoices = export_queryset(job)
+    jobs = InvoiceExportJob.objects.filter(pk=job.pk)
+    jobs.update(
+        status=Status.RUNNING,
+        total=invoices.count(),
+        processed=0,
+        error='',
+        heartbeat_at=timezone.now(),
+    )
+
+    name = archive_name(job)
+    path = Path(settings.MEDIA_ROOT) / name
+    partial = path.with_name(path.name + '.part')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        # 'spawn': los procesos hijos no heredan conexiones ni hilos del proceso web
+        with ProcessPoolExecutor(
+            max_workers=config['WORKERS'],
+            mp_context=multiprocessing.get_context('spawn'),
+        ) as executor, zipfile.ZipFile(partial, 'w', zipfile.ZIP_STORED) as archive:
+            # ZIP_STORED: los PDF ya van comprimidos
+            processed = 0
+            last_pk = 0
+            while True:
+                chunk = list(invoices.filter(pk__gt=last_pk)[:config['CHUNK_SIZE']])
+                if not chunk:
+                    break
+                write_chunk(archive, executor, chunk)
+                processed += len(chunk)
+                last_pk = chunk[-1].pk
+                jobs.update(processed=processed, heartbeat_at=timezone.now())
+        partial.replace(path)
+    except Exception as exc:
+        partial.unlink(missing_ok=True)
+        jobs.update(status=Status.FAILED, error=str(exc) or exc.__class__.__name__, finished_at=timezone.now())
+        raise
+    jobs.update(status=Status.DONE, archive=name, finished_at=timezone.now())
+
+
+def fail_stale_jobs(now=None):
+    """Marca FAILED los trabajos RUNNING sin latido reciente (worker caído)."""
+    now = now or timezone.now()
+    limit = now - timedelta(seconds=settings.INVOICE_EXPORT['STALE_SECONDS'])
+    return InvoiceExportJob.objects.filter(status=Status.RUNNING, heartbeat_at__lt=limit).update(
+        status=Status.FAILED,
+        error='La exportación se interrumpió; vuelva a solicitarla.',
+        finished_at=now,
+    )
+
+
+def claim_next_job():
+    """Reclama el trabajo PENDING más antiguo y devuelve su id (o None)."""
+    while True:
+        job_id = (
+            InvoiceExportJob.objects.filter(status=Status.PENDING)
+            .order_by('created_at', 'pk')
+            .values_list('pk', flat=True)
+            .first()
+        )
+        if job_id is None:
+            return None
+        # Condicional: si otro worker se adelantó, se prueba con el siguiente
+        claimed = InvoiceExportJob.objects.filter(pk=job_id, status=Status.PENDING).update(
+            status=Status.RUNNING,
+            heartbeat_at=timezone.now(),
+        )
+        if claimed:
+            return job_id
+
+
+def run_pending_jobs(max_jobs=None):
+    """Ejecuta los trabajos pendientes. Devuelve (terminados, fallidos)."""
+    fail_stale_jobs()
+    done = failed = 0
+    while max_jobs is None or done + failed < max_jobs:
+        job_id = claim_next_job()
+        if job_id is None:
+            break
+        try:
+            run_export_job(job_id)
+        except Exception:
+            # El error también queda registrado en el trabajo
+            logger.exception('Falló la exportación de facturas %s', job_id)
+            failed += 1
+        else:
+            done += 1
+    return done, failed
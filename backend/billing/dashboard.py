@@ -0,0 +1,101 @@
+"""
+Estadísticas del dashboard con una consulta de agregación condicional por
+tabla y una instantánea cacheada.
+
+La instantánea se guarda en la caché ``DASHBOARD_CACHE['ALIAS']`` durante
+``TIMEOUT`` segundos. Su clave incluye un contador de generación que se
+incrementa cuando cambian citas o facturas (señales en ``billing.signals``),
+de modo que cualquier escritura invalida la instantánea en todos los
+procesos que compartan la caché.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from core.dates import local_day_bounds
+
+GENERATION_KEY = 'billing:dashboard:generation'
+
+
+def get_dashboard_cache():
+    return caches[settings.DASHBOARD_CACHE['ALIAS']]
+
+
+def invalidate_dashboard(**kwargs):
+    """Invalida la instantánea actual (receptor de señales)."""
+    cache = get_dashboard_cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+
+
+def appointment_stats(today):
+    from appointments.models import Appointment
+
+    month_start = today.replace(day=1)
+    month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    range_start, range_end = local_day_bounds(month_start, month_end)
+    week_start, week_end = local_day_bounds(today, today + timedelta(days=7))
+
+    in_month = Q(start_time__gte=range_start, start_time__lt=range_end)
+    upcoming = Q(
+        start_time__gte=week_start,
+        start_time__lt=week_end,
+        status__in=[Appointment.Status.PENDING, Appointment.Status.CONFIRMED],
+    )
+    return Appointment.objects.filter(in_month | upcoming).aggregate(
+        total_month=Count('pk', filter=in_month),
+        confirmed=Count('pk', filter=in_month & Q(status=Appointment.Status.CONFIRMED)),
+        completed=Count('pk', filter=in_month & Q(status=Appointment.Status.COMPLETED)),
+        cancelled=Count('pk', filter=in_month & Q(status=Appointment.Status.CANCELLED)),
+        upcoming_week=Count('pk', filter=upcoming),
+        active_patients=Count('patient', filter=in_month, distinct=True),
+    )
+
+
+def billing_stats(today):
+    from .models import Invoice
+    from .rollup import status_totals
+
+    month_start = today.replace(day=1)
+    month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    totals = status_totals(month_start, month_end, today)
+    return {
+        'total_month': float(sum(value['total'] for value in totals.values())),
+        'paid_month': float(totals.get(Invoice.Status.PAID, {}).get('total', 0)),
+        'pending_month': float(totals.get(Invoice.Status.SENT, {}).get('total', 0)),
+        'overdue_month': float(totals.get(Invoice.Status.OVERDUE, {}).get('total', 0)),
+    }
+
+
+def compute_dashboard(today):
+    from patients.models import PatientProfile
+
+    appointments = appointment_stats(today)
+    active_patients = appointments.pop('active_patients')
+    return {
+        'appointments': appointments,
+        'patients': {
+            'active_month': active_patients,
+            'total': PatientProfile.objects.count(),
+        },
+        'billing': billing_stats(today),
+        'generated_at': timezone.now().isoformat(),
+    }
+
+
+def dashboard_snapshot():
+    """Estadísticas del dashboard desde la caché, calculándolas si no hay instantánea vigente."""
+    cache = get_dashboard_cache()
+    today = timezone.localdate()
+    generation = cache.get(GENERATION_KEY, 0)
+    key = f'billing:dashboard:{generation}:{today.isoformat()}'
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = compute_dashboard(today)
+        cache.set(key, snapshot, settings.DASHBOARD_CACHE['TIMEOUT'])
+    return snapshot
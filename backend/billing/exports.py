@@ -0,0 +1,305 @@
+"""
+Exportaciones en streaming (CSV y XLSX) de facturas, citas y desgloses de informes.
+
+Cada conjunto de ``DATASETS`` define su queryset, sus columnas (cabecera y
+expresión) y el campo de fecha por el que se filtra. La selección de columnas,
+el rango de fechas y el estado se aplican en SQL (``values_list`` de solo las
+columnas pedidas) y las filas se recorren con ``.iterator(chunk_size=...)``,
+de modo que la memoria no crece con el número de filas.
+
+Las celdas de texto que empiezan por ``=``, ``+``, ``-``, ``@`` (o tabulador y
+retorno de carro) se prefijan con ``'`` para que Excel o LibreOffice no las
+interpreten como fórmulas: nombres y otros campos los escriben los usuarios.
+
+Los desgloses por estado no tienen ``status_field``: ya separan las filas por
+estado, y la vista rechaza el parámetro ``status`` con ellos.
+
+El XLSX se genera sin dependencias: un ZIP escrito sobre un buffer que se
+vacía en cada trozo de la respuesta, con la hoja en cadenas en línea
+(``inlineStr``) para no tener que acumular una tabla de cadenas compartidas.
+"""
+import csv
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.db.models import CharField, Count, DecimalField, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Concat, TruncDate
+from django.utils import timezone
+
+from appointments.models import Appointment
+from core.dates import local_day_bounds
+
+from .models import Invoice, InvoiceItem
+
+CHUNK_SIZE = 2000
+
+# Inicios de celda que las hojas de cálculo evalúan como fórmula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def full_name(prefix):
+    return Concat(f'{prefix}__first_name', Value(' '), f'{prefix}__last_name', output_field=CharField())
+
+
+DATASETS = {
+    'invoices': {
+        'queryset': lambda: Invoice.objects.all(),
+        'date_field': 'issued_at',
+        'status_field': 'status',
+        'order_by': ('issued_at', 'id'),
+        'columns': {
+            'id': ('Factura', F('id')),
+            'issued_at': ('Fecha', F('issued_at')),
+            'due_date': ('Vencimiento', F('due_date')),
+            'status': ('Estado', F('status')),
+            'patient': ('Paciente', full_name('patient__user')),
+            'document_id': ('DNI/NIE', F('patient__user__document_id')),
+            'issued_by': ('Emitida por', F('issued_by__username')),
+            'total': ('Total', F('total')),
+        },
+    },
+    'invoice-lines': {
+        'queryset': lambda: InvoiceItem.objects.all(),
+        'date_field': 'invoice__issued_at',
+        'status_field': 'invoice__status',
+        'order_by': ('invoice_id', 'id'),
+        'columns': {
+            'invoice': ('Factura', F('invoice_id')),
+            'issued_at': ('Fecha', F('invoice__issued_at')),
+            'status': ('Estado', F('invoice__status')),
+            'patient': ('Paciente', full_name('invoice__patient__user')),
+            'service': ('Servicio', F('service__name')),
+            'quantity': ('Cantidad', F('quantity')),
+            'unit_price': ('Precio unitario', F('unit_price')),
+            'line_total': ('Importe', ExpressionWrapper(
+                F('quantity') * F('unit_price'),
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            )),
+            'appointment': ('Cita', F('appointment_id')),
+        },
+    },
+    'appointments': {
+        'queryset': lambda: Appointment.objects.all(),
+        'date_field': 'start_time',
+        'status_field': 'status',
+        'order_by': ('start_time', 'id'),
+        'columns': {
+            'id': ('Cita', F('id')),
+            'start_time': ('Inicio', F('start_time')),
+            'end_time': ('Fin', F('end_time')),
+            'status': ('Estado', F('status')),
+            'patient': ('Paciente', full_name('patient__user')),
+            'professional': ('Profesional', full_name('professional__user')),
+            'room': ('Sala', F('room__name')),
+            'treatment_type': ('Tratamiento', F('treatment_type')),
+        },
+    },
+    # Desgloses de billing_report y activity_report (una consulta agregada cada uno)
+    'billing-by-status': {
+        'queryset': lambda: Invoice.objects.all(),
+        'date_field': 'issued_at',
+        'columns': {
+            'status': ('Estado', F('status')),
+            'count': ('Facturas', Count('id')),
+            'total': ('Total', Sum('total')),
+        },
+    },
+    'activity-by-status': {
+        'queryset': lambda: Appointment.objects.all(),
+        'date_field': 'start_time',
+        'columns': {
+            'status': ('Estado', F('status')),
+            'count': ('Citas', Count('id')),
+        },
+    },
+    'activity-by-professional': {
+        'queryset': lambda: Appointment.objects.all(),
+        'date_field': 'start_time',
+        'status_field': 'status',
+        'columns': {
+            'professional': ('Profesional', full_name('professional__user')),
+            'count': ('Citas', Count('id')),
+        },
+    },
+    'activity-by-day': {
+        'queryset': lambda: Appointment.objects.all(),
+        'date_field': 'start_time',
+        'status_field': 'status',
+        'columns': {
+            'day': ('Día', TruncDate('start_time', tzinfo=timezone.get_default_timezone())),
+            'count': ('Citas', Count('id')),
+        },
+    },
+}
+
+
+def export_queryset(name, columns=None, date_from=None, date_to=None, status=None):
+    """
+    Devuelve (cabeceras, filas) de un conjunto; las filas son un iterador de tuplas.
+
+    Lanza KeyError si el conjunto o alguna columna no existen.
+    """
+    dataset = DATASETS[name]
+    keys = list(columns or dataset['columns'])
+    selected = {key: dataset['columns'][key] for key in keys}
+    queryset = dataset['queryset']()
+
+    date_field = dataset['date_field']
+    if queryset.model is Appointment:
+        # start_time es un datetime: días completos en hora local
+        if date_from:
+            queryset = queryset.filter(**{f'{date_field}__gte': local_day_bounds(date_from)[0]})
+        if date_to:
+            queryset = queryset.filter(**{f'{date_field}__lt': local_day_bounds(date_to)[1]})
+    else:
+        if date_from:
+            queryset = queryset.filter(**{f'{date_field}__gte': date_from})
+        if date_to:
+            queryset = queryset.filter(**{f'{date_field}__lte': date_to})
+    if status and dataset.get('status_field'):
+        queryset = queryset.filter(**{dataset['status_field']: status})
+
+    # Prefijo para que los alias no choquen con los nombres de los campos
+    aliases = {key: f'export_{key}' for key in dataset['columns']}
+    # F() no es una expresión resuelta y no tiene contains_aggregate
+    aggregates = {
+        aliases[key]: expression for key, (_, expression) in selected.items()
+        if getattr(expression, 'contains_aggregate', False)
+    }
+    if aggregates:
+        # Se agrupa siempre por todas las columnas de grupo del desglose,
+        # aunque no se pidan, para que las filas no cambien de significado
+        groups = {
+            aliases[key]: expression for key, (_, expression) in dataset['columns'].items()
+            if not getattr(expression, 'contains_aggregate', False)
+        }
+        queryset = queryset.annotate(**groups).values(*groups).annotate(**aggregates).order_by(*groups)
+    else:
+        queryset = queryset.annotate(**{aliases[key]: expression for key, (_, expression) in selected.items()})
+        queryset = queryset.order_by(*dataset['order_by'])
+    rows = queryset.values_list(*[aliases[key] for key in keys]).iterator(chunk_size=CHUNK_SIZE)
+    return [header for header, _ in selected.values()], rows
+
+
+def display_value(value):
+    if isinstance(value, datetime):
+        return timezone.localtime(value).strftime('%Y-%m-%d %H:%M')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class Echo:
+    """Objeto con write() que devuelve lo escrito (para csv.writer en streaming)"""
+
+    def write(self, value):
+        return value
+
+
+def csv_stream(headers, rows):
+    writer = csv.writer(Echo())
+    # BOM para que Excel detecte UTF-8
+    yield '\ufeff' + writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow([display_value(value) for value in row])
+
+
+class StreamBuffer:
+    """Destino no posicionable de zipfile: acumula lo escrito hasta que se recoge"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def xlsx_cell(value):
+    value = display_value(value)
+    if value is None:
+        return '<c/>'
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    text = escape(INVALID_XML_CHARS.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def xlsx_row(values):
+    return '<row>' + ''.join(xlsx_cell(value) for value in values) + '</row>'
+
+
+def xlsx_stream(headers, rows, sheet_name='Datos', flush_every=500):
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', XLSX_CONTENT_TYPES)
+        archive.writestr('_rels/.rels', XLSX_ROOT_RELS)
+        archive.writestr('xl/workbook.xml', XLSX_WORKBOOK.format(name=escape(sheet_name[:31])))
+        archive.writestr('xl/_rels/workbook.xml.rels', XLSX_WORKBOOK_RELS)
+        yield buffer.pop()
+        # force_zip64: el tamaño de la hoja no se conoce de antemano
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(xlsx_row(headers).encode('utf-8'))
+            for position, row in enumerate(rows, start=1):
+                sheet.write(xlsx_row(row).encode('utf-8'))
+                if position % flush_every == 0:
+                    chunk = buffer.pop()
+                    if chunk:
+                        yield chunk
+            sheet.write(b'</sheetData></worksheet>')
+        yield buffer.pop()
+    yield buffer.pop()
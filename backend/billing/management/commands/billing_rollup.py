@@ -0,0 +1,44 @@
+"""
+Management command del agregado diario de facturación.
+Uso: python manage.py billing_rollup rebuild|check [--from AAAA-MM-DD] [--to AAAA-MM-DD]
+
+rebuild recalcula el agregado desde las facturas; check lo compara con las
+facturas y termina con error si hay diferencias.
+"""
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.rollup import check_rollup, rebuild_rollup
+
+
+def parse_day(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f'Fecha no válida: {value} (formato AAAA-MM-DD)')
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye o verifica el agregado diario de facturación'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['rebuild', 'check'])
+        parser.add_argument('--from', dest='date_from', type=parse_day, default=None)
+        parser.add_argument('--to', dest='date_to', type=parse_day, default=None)
+
+    def handle(self, *args, **options):
+        date_from, date_to = options['date_from'], options['date_to']
+        if options['action'] == 'rebuild':
+            rows = rebuild_rollup(date_from, date_to)
+            self.stdout.write(self.style.SUCCESS(f'Agregado reconstruido: {rows} filas'))
+            return
+
+        mismatches = check_rollup(date_from, date_to)
+        for day, status, stored, expected in mismatches:
+            self.stdout.write(
+                f'{day} {status}: agregado {stored[0]} / {stored[1]}, facturas {expected[0]} / {expected[1]}'
+            )
+        if mismatches:
+            raise CommandError(f'{len(mismatches)} diferencias entre el agregado y las facturas')
+        self.stdout.write(self.style.SUCCESS('El agregado coincide con las facturas'))
@@ -0,0 +1,33 @@
+"""
+Management command que exporta en un ZIP los PDF de las facturas de un periodo.
+Uso: python manage.py export_invoice_pdfs --from AAAA-MM-DD --to AAAA-MM-DD [--status SENT]
+
+Crea un InvoiceExportJob y lo ejecuta en primer plano (billing.bulk_pdf).
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from billing.bulk_pdf import run_export_job
+from billing.management.commands.billing_rollup import parse_day
+from billing.models import Invoice, InvoiceExportJob
+
+
+class Command(BaseCommand):
+    help = 'Exporta en un ZIP los PDF de las facturas emitidas en un periodo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=parse_day, required=True)
+        parser.add_argument('--to', dest='date_to', type=parse_day, required=True)
+        parser.add_argument('--status', choices=Invoice.Status.values, default='')
+
+    def handle(self, *args, **options):
+        job = InvoiceExportJob.objects.create(
+            date_from=options['date_from'],
+            date_to=options['date_to'],
+            invoice_status=options['status'],
+        )
+        run_export_job(job.pk)
+        job.refresh_from_db()
+        self.stdout.write(self.style.SUCCESS(
+            f'{job.total} facturas exportadas en {settings.MEDIA_ROOT / job.archive.name}'
+        ))
@@ -0,0 +1,54 @@
+"""
+Management command de facturación por lotes de citas completadas.
+Uso: python manage.py invoice_appointments --from AAAA-MM-DD --to AAAA-MM-DD [--status DRAFT|SENT] [--dry-run]
+
+Crea una factura por paciente con sus citas completadas sin facturar del
+periodo (billing.batch_invoicing) e informa del resultado por paciente.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from billing.batch_invoicing import invoice_appointments
+from billing.management.commands.billing_rollup import parse_day
+from billing.models import Invoice
+
+
+class Command(BaseCommand):
+    help = 'Factura por lotes las citas completadas sin facturar de un periodo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=parse_day, required=True)
+        parser.add_argument('--to', dest='date_to', type=parse_day, required=True)
+        parser.add_argument(
+            '--status',
+            choices=[Invoice.Status.DRAFT, Invoice.Status.SENT],
+            default=Invoice.Status.DRAFT,
+        )
+        parser.add_argument('--chunk-size', type=int, default=200, help='Pacientes por transacción')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = invoice_appointments(
+            date_from=options['date_from'],
+            date_to=options['date_to'],
+            status=options['status'],
+            chunk_size=options['chunk_size'],
+            dry_run=options['dry_run'],
+        )
+        elapsed = time.perf_counter() - started
+        if options['verbosity'] > 1:
+            for row in result['invoices']:
+                self.stdout.write(
+                    f"Paciente {row['patient']}: factura {row['invoice']}, "
+                    f"{len(row['appointments'])} citas, {row['total']} €"
+                )
+        for row in result['skipped']:
+            self.stdout.write(self.style.WARNING(f"Cita {row['appointment']}: {row['reason']}"))
+        appointments = sum(len(row['appointments']) for row in result['invoices'])
+        prefix = 'Se facturarían' if options['dry_run'] else 'Facturadas'
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} {appointments} citas en {len(result['invoices'])} facturas "
+            f"({len(result['skipped'])} omitidas, {elapsed:.2f}s)"
+        ))
@@ -0,0 +1,34 @@
+"""
+Management command que pasa a OVERDUE las facturas enviadas y vencidas (y
+devuelve a SENT las vencidas cuyo vencimiento se ha ampliado).
+Uso: python manage.py mark_overdue_invoices [--catch-up] [--date AAAA-MM-DD]
+
+Pensado para ejecutarse cada noche (cron). Con --catch-up, tras ejecuciones
+perdidas, se procesa el atrasado por día de vencimiento en transacciones
+separadas. --date fija el día de referencia (por defecto, hoy).
+"""
+from django.core.management.base import BaseCommand
+
+from billing.management.commands.billing_rollup import parse_day
+from billing.overdue import catch_up_overdue, mark_overdue, reopen_extended
+
+
+class Command(BaseCommand):
+    help = 'Pasa a OVERDUE las facturas SENT con la fecha de vencimiento pasada'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--catch-up', action='store_true', help='Procesar el atrasado día a día')
+        parser.add_argument('--date', type=parse_day, default=None, help='Día de referencia (AAAA-MM-DD)')
+
+    def handle(self, *args, **options):
+        reopened = reopen_extended(options['date'])
+        if reopened:
+            self.stdout.write(f'Facturas que vuelven a enviadas: {reopened}')
+        if options['catch_up']:
+            results = catch_up_overdue(options['date'])
+            for due_date, updated in results:
+                self.stdout.write(f'{due_date}: {updated} facturas')
+            updated = sum(count for _, count in results)
+        else:
+            updated = mark_overdue(options['date'])
+        self.stdout.write(self.style.SUCCESS(f'Facturas marcadas como vencidas: {updated}'))
@@ -0,0 +1,32 @@
+"""
+Management command que ejecuta los trabajos de exportación de PDF de facturas
+encolados desde la API.
+Uso: python manage.py run_invoice_exports [--max-jobs 1] [--loop --interval 10]
+
+Antes de cada pasada marca FAILED los trabajos que un worker caído dejó en
+curso (billing.bulk_pdf.fail_stale_jobs).
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from billing.bulk_pdf import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = 'Ejecuta las exportaciones de PDF de facturas pendientes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-jobs', type=int, default=None, help='Trabajos como máximo por ejecución')
+        parser.add_argument('--loop', action='store_true', help='Repetir indefinidamente')
+        parser.add_argument('--interval', type=float, default=10, help='Segundos de espera con la cola vacía')
+
+    def handle(self, *args, **options):
+        while True:
+            done, failed = run_pending_jobs(options['max_jobs'])
+            if done or failed or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Exportaciones terminadas: {done}, fallidas: {failed}'))
+            if not options['loop']:
+                break
+            if not (done or failed):
+                time.sleep(options['interval'])
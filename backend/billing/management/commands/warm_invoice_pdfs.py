@@ -0,0 +1,46 @@
+"""
+Management command que genera por adelantado los PDF de las facturas enviadas.
+Uso: python manage.py warm_invoice_pdfs [--days 7] [--batch-size 200]
+
+Solo se generan los PDF cuyo contenido no esté ya en la caché (billing.pdf),
+así que puede ejecutarse periódicamente tras el envío de facturas.
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from billing.models import Invoice
+from billing.pdf import cached_pdf_path, context_hash, get_invoice_pdf, invoice_context
+
+
+class Command(BaseCommand):
+    help = 'Genera los PDF de las facturas enviadas recientemente que no estén en caché'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Facturas emitidas en los últimos N días')
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        since = timezone.localdate() - timedelta(days=options['days'])
+        invoices = (
+            Invoice.objects.filter(status=Invoice.Status.SENT, issued_at__gte=since)
+            .select_related('patient__user')
+            .prefetch_related('items__service')
+            .order_by('pk')
+        )
+        rendered = cached = 0
+        last_pk = 0
+        while True:
+            batch = list(invoices.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            for invoice in batch:
+                context = invoice_context(invoice)
+                if cached_pdf_path(invoice.pk, context_hash(context)).exists():
+                    cached += 1
+                    continue
+                get_invoice_pdf(invoice, context)
+                rendered += 1
+            last_pk = batch[-1].pk
+        self.stdout.write(self.style.SUCCESS(f'PDF generados: {rendered}, ya en caché: {cached}'))
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.14 on 2026-10-18 14:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0005_alter_invoice_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='budget',
+            index=models.Index(fields=['created_at', 'id'], name='billing_bud_created_9609bc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['issued_at', 'id'], name='billing_inv_issued__0acbe7_idx'),
+        ),
+    ]
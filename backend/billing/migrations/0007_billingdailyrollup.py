@@ -0,0 +1,51 @@
+# Generated by Django 5.0.14 on 2026-10-18 14:38
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_rollup(apps, schema_editor):
+    Invoice = apps.get_model('billing', 'Invoice')
+    BillingDailyRollup = apps.get_model('billing', 'BillingDailyRollup')
+    rows = Invoice.objects.order_by().values('issued_at', 'status').annotate(count=Count('pk'), amount=Sum('total'))
+    BillingDailyRollup.objects.bulk_create(
+        [
+            BillingDailyRollup(
+                day=row['issued_at'],
+                status=row['status'],
+                invoice_count=row['count'],
+                total=row['amount'] or Decimal('0'),
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0006_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('DRAFT', 'Borrador'), ('SENT', 'Enviada'), ('PAID', 'Pagada'), ('CANCELLED', 'Cancelada'), ('OVERDUE', 'Vencida')], max_length=20)),
+                ('invoice_count', models.IntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+            ],
+            options={
+                'ordering': ['day', 'status'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='billingdailyrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'status'), name='billing_rollup_day_status'),
+        ),
+        migrations.RunPython(populate_rollup, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.14 on 2026-10-18 15:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0007_billingdailyrollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_from', models.DateField()),
+                ('date_to', models.DateField()),
+                ('invoice_status', models.CharField(blank=True, choices=[('DRAFT', 'Borrador'), ('SENT', 'Enviada'), ('PAID', 'Pagada'), ('CANCELLED', 'Cancelada'), ('OVERDUE', 'Vencida')], max_length=20)),
+                ('status', models.CharField(choices=[('PENDING', 'Pendiente'), ('RUNNING', 'En curso'), ('DONE', 'Terminada'), ('FAILED', 'Fallida')], default='PENDING', max_length=20)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('processed', models.PositiveIntegerField(default=0)),
+                ('archive', models.FileField(blank=True, upload_to='invoice_exports/')),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('requested_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invoice_export_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at', 'id'], name='billing_inv_created_b602d0_idx')],
+            },
+        ),
+    ]
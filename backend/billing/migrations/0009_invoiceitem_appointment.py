@@ -0,0 +1,20 @@
+# Generated by Django 5.0.14 on 2026-10-18 15:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0012_notificationarchive'),
+        ('billing', '0008_invoiceexportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceitem',
+            name='appointment',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invoice_item', to='appointments.appointment'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.14 on 2026-10-18 15:41
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+
+def mark_existing_overdue(apps, schema_editor):
+    """Materializar OVERDUE en las facturas ya vencidas y recalcular el agregado diario."""
+    Invoice = apps.get_model('billing', 'Invoice')
+    BillingDailyRollup = apps.get_model('billing', 'BillingDailyRollup')
+    updated = Invoice.objects.filter(status='SENT', due_date__lt=timezone.localdate()).update(status='OVERDUE')
+    if not updated:
+        return
+    BillingDailyRollup.objects.all().delete()
+    rows = Invoice.objects.order_by().values('issued_at', 'status').annotate(count=Count('pk'), amount=Sum('total'))
+    BillingDailyRollup.objects.bulk_create(
+        [
+            BillingDailyRollup(day=row['issued_at'], status=row['status'], invoice_count=row['count'], total=row['amount'] or 0)
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0009_invoiceitem_appointment'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', 'due_date'], name='billing_inv_status_996e80_idx'),
+        ),
+        migrations.RunPython(mark_existing_overdue, migrations.RunPython.noop),
+    ]
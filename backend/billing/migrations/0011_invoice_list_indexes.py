@@ -0,0 +1,25 @@
+# Generated by Django 5.0.14 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0010_invoice_status_due_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['patient', 'issued_at', 'id'], name='billing_inv_patient_00da85_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['issued_by', 'issued_at', 'id'], name='billing_inv_issued__507e6d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['total'], name='billing_inv_total_75c9a7_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0011_invoice_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceexportjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,7 +1,7 @@
 from decimal import Decimal
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 
 
 class Service(models.Model):
@@ -43,25 +43,47 @@ class Invoice(models.Model):
     notes = models.TextField(blank=True)
     total = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['issued_at', 'id']),
+            models.Index(fields=['status', 'due_date']),
+            # Filtros del listado (ordenado por -issued_at, -id)
+            models.Index(fields=['patient', 'issued_at', 'id']),
+            models.Index(fields=['issued_by', 'issued_at', 'id']),
+            models.Index(fields=['total']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Estado con el que se cargó, para aplicar al agregado diario solo la diferencia
+        if all(name in field_names for name in ('issued_at', 'status', 'total')):
+            instance._rollup_state = instance.rollup_state()
+        return instance
+
+    def rollup_state(self):
+        """Clave y contribución de la factura en BillingDailyRollup."""
+        return (self.issued_at, self.status, self.total)
+
     def recalculate_total(self):
-        total = sum(item.total for item in self.items.all())
-        self.total = total
-        self.save(update_fields=['total'])
+        """Suma las líneas en la base de datos y guarda el total solo si ha cambiado."""
+        total = self.items.aggregate(
+            total=models.Sum(
+                models.F('quantity') * models.F('unit_price'),
+                output_field=models.DecimalField(max_digits=10, decimal_places=2),
+            ),
+        )['total'] or Decimal('0.00')
+        total = Decimal(total).quantize(Decimal('0.01'))
+        if total != self.total:
+            self.total = total
+            self.save(update_fields=['total'])
 
     def get_effective_status(self):
         """
-        Calcula el estado efectivo de la factura.
-        Si está SENT y la fecha de vencimiento ha pasado, devuelve OVERDUE.
-        Si el estado es explícitamente OVERDUE, CANCELLED o PAID, devuelve ese estado.
+        Estado efectivo de la factura.
+        OVERDUE se guarda en la columna: el comando nocturno mark_overdue_invoices
+        pasa a OVERDUE las facturas SENT con la fecha de vencimiento pasada.
         """
-        from django.utils import timezone
-        # Si el estado es explícitamente OVERDUE, CANCELLED o PAID, devolverlo directamente
-        if self.status in [self.Status.OVERDUE, self.Status.CANCELLED, self.Status.PAID]:
-            return self.status
-        # Si está SENT y la fecha de vencimiento ha pasado, devolver OVERDUE
-        if self.status == self.Status.SENT and self.due_date:
-            if timezone.now().date() > self.due_date:
-                return self.Status.OVERDUE
         return self.status
 
     def save(self, *args, **kwargs):
@@ -70,8 +92,8 @@ class Invoice(models.Model):
         
         # Si no se especifica fecha de vencimiento y se envía, establecer 30 días por defecto
         if not self.due_date and self.status == self.Status.SENT:
-            if not self.pk:  # Nueva factura
-                self.due_date = self.issued_at + timedelta(days=30)
+            if not self.pk:  # Nueva factura (issued_at aún no está asignada)
+                self.due_date = (self.issued_at or timezone.localdate()) + timedelta(days=30)
             else:
                 # Factura existente que se está enviando
                 # Obtener la fecha de emisión actual de la BD si existe
@@ -84,20 +106,51 @@ class Invoice(models.Model):
                 except Invoice.DoesNotExist:
                     self.due_date = timezone.now().date() + timedelta(days=30)
         
-        # No actualizar automáticamente el estado a OVERDUE en save
-        # Se calcula dinámicamente con get_effective_status()
-        # Solo actualizar si se está cambiando explícitamente a SENT y está vencida
-        if self.status == self.Status.SENT and self.due_date:
-            if timezone.now().date() > self.due_date:
-                # No cambiar el status aquí, se calcula dinámicamente
-                pass
+        # No actualizar el estado a OVERDUE en save: lo hace por lotes
+        # el comando mark_overdue_invoices (billing.overdue)
         
-        super().save(*args, **kwargs)
+        from .rollup import apply_invoice_change
+
+        old_state = getattr(self, '_rollup_state', None)
+        if self.pk and old_state is None:
+            old_state = Invoice.objects.filter(pk=self.pk).values_list('issued_at', 'status', 'total').first()
+        new_state = self.rollup_state()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and old_state is not None:
+            # Los campos que no se guardan conservan su valor en la BD
+            new_state = tuple(
+                new if name in update_fields else old
+                for name, new, old in zip(('issued_at', 'status', 'total'), new_state, old_state)
+            )
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # Mantener el agregado diario en la misma transacción
+            if new_state[0] is None:
+                new_state = (self.issued_at,) + new_state[1:]
+            apply_invoice_change(old_state, new_state)
+        self._rollup_state = new_state
 
     def __str__(self) -> str:
         return f"Factura #{self.pk} - {self.patient}"
 
 
+class BillingDailyRollup(models.Model):
+    """Número e importe de facturas por día de emisión y estado (billing.rollup)"""
+    day = models.DateField()
+    status = models.CharField(max_length=20, choices=Invoice.Status.choices)
+    invoice_count = models.IntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        ordering = ['day', 'status']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status'], name='billing_rollup_day_status'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.day} {self.status}: {self.invoice_count} ({self.total})"
+
+
 class InvoiceItem(models.Model):
     invoice = models.ForeignKey(
         Invoice,
@@ -107,6 +160,14 @@ class InvoiceItem(models.Model):
     service = models.ForeignKey(Service, on_delete=models.PROTECT)
     quantity = models.PositiveIntegerField(default=1)
     unit_price = models.DecimalField(max_digits=8, decimal_places=2)
+    # Cita facturada en esta línea (facturación por lotes): una cita solo se factura una vez
+    appointment = models.OneToOneField(
+        'appointments.Appointment',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='invoice_item',
+    )
 
     @property
     def total(self) -> Decimal:
@@ -138,5 +199,47 @@ class Budget(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+        ]
+
     def __str__(self) -> str:
         return f"Presupuesto {self.pk} - {self.patient}"
+
+
+class InvoiceExportJob(models.Model):
+    """Exportación en ZIP de los PDF de las facturas de un periodo (billing.bulk_pdf)"""
+
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Pendiente'
+        RUNNING = 'RUNNING', 'En curso'
+        DONE = 'DONE', 'Terminada'
+        FAILED = 'FAILED', 'Fallida'
+
+    requested_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='invoice_export_jobs',
+    )
+    date_from = models.DateField()
+    date_to = models.DateField()
+    invoice_status = models.CharField(max_length=20, choices=Invoice.Status.choices, blank=True)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    archive = models.FileField(upload_to='invoice_exports/', blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Última señal de vida del worker que lo ejecuta (tras cada tanda)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+        ]
+
+    def __str__(self) -> str:
+        return f"Exportación {self.pk} ({self.date_from} - {self.date_to})"
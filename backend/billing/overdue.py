@@ -0,0 +1,99 @@
+"""
+Paso a OVERDUE de las facturas vencidas.
+
+El estado OVERDUE se guarda en la columna ``status``: cada noche
+``mark_overdue_invoices`` pasa a OVERDUE, con un solo UPDATE sobre el índice
+(status, due_date), las facturas SENT cuya fecha de vencimiento ya ha pasado,
+y devuelve a SENT las OVERDUE cuyo vencimiento se ha ampliado. Listados,
+informes y dashboard filtran después solo por estado. Al editar una factura
+por la API el estado se ajusta en el momento (``status_for_due_date``).
+
+Las filas afectadas se bloquean y se leen (día de emisión e importe) antes del
+UPDATE para trasladar el cambio al agregado diario (``billing.rollup``) en la
+misma transacción. En modo recuperación (tras ejecuciones perdidas) se procesa
+un día de vencimiento por transacción para no bloquear de golpe todo el
+atrasado.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .dashboard import invalidate_dashboard
+from .models import Invoice
+from .revenue import invalidate_revenue
+from .rollup import apply_deltas
+
+
+def overdue_candidates(today):
+    return Invoice.objects.filter(status=Invoice.Status.SENT, due_date__lt=today)
+
+
+def extended_candidates(today):
+    """Facturas OVERDUE que ya no están vencidas (vencimiento ampliado o quitado)."""
+    return Invoice.objects.filter(
+        Q(due_date__gte=today) | Q(due_date__isnull=True),
+        status=Invoice.Status.OVERDUE,
+    )
+
+
+def status_for_due_date(invoice, today=None):
+    """Estado SENT/OVERDUE que corresponde a la fecha de vencimiento de la factura."""
+    if invoice.status not in (Invoice.Status.SENT, Invoice.Status.OVERDUE):
+        return invoice.status
+    today = today or timezone.localdate()
+    if invoice.due_date and invoice.due_date < today:
+        return Invoice.Status.OVERDUE
+    return Invoice.Status.SENT
+
+
+@transaction.atomic
+def transition(queryset, source=Invoice.Status.SENT, target=Invoice.Status.OVERDUE):
+    """Pasa las facturas del queryset de ``source`` a ``target`` y actualiza el agregado. Devuelve cuántas."""
+    deltas = defaultdict(lambda: (0, Decimal('0')))
+    for issued_at, total in queryset.select_for_update().values_list('issued_at', 'total'):
+        for status, sign in ((source, -1), (target, 1)):
+            count, amount = deltas[(issued_at, status)]
+            deltas[(issued_at, status)] = (count + sign, amount + sign * total)
+    if not deltas:
+        return 0
+    updated = queryset.update(status=target)
+    apply_deltas(deltas)
+    transaction.on_commit(invalidate_dashboard)
+    # Las facturas que vencen son de días cerrados
+    transaction.on_commit(invalidate_revenue)
+    return updated
+
+
+def mark_overdue(today=None):
+    """Pasa a OVERDUE todas las facturas SENT vencidas antes de ``today``."""
+    return transition(overdue_candidates(today or timezone.localdate()))
+
+
+def reopen_extended(today=None):
+    """Devuelve a SENT las facturas OVERDUE cuyo vencimiento ya no ha pasado."""
+    return transition(
+        extended_candidates(today or timezone.localdate()),
+        source=Invoice.Status.OVERDUE,
+        target=Invoice.Status.SENT,
+    )
+
+
+def catch_up_overdue(today=None):
+    """
+    Modo recuperación: procesa las facturas vencidas día a día de vencimiento,
+    del más antiguo al más reciente. Devuelve [(día de vencimiento, facturas)].
+    """
+    today = today or timezone.localdate()
+    due_dates = (
+        overdue_candidates(today)
+        .order_by('due_date')
+        .values_list('due_date', flat=True)
+        .distinct()
+    )
+    return [
+        (due_date, transition(overdue_candidates(today).filter(due_date=due_date)))
+        for due_date in list(due_dates)
+    ]
@@ -0,0 +1,210 @@
+"""
+PDF de facturas con caché en disco.
+
+El contenido impreso de una factura (datos de la factura, del paciente y
+líneas) se reduce a un diccionario de datos planos; su hash SHA-256 identifica
+el PDF. El fichero se guarda como ``<factura>-<hash>.pdf`` en
+``INVOICE_PDF['CACHE_DIR']`` y sirve también de ETag, de modo que una descarga
+repetida es una lectura de fichero (o un 304) sin pasar por reportlab.
+
+No hace falta invalidar explícitamente: cualquier cambio que altere lo impreso
+(``recalculate_total``, sincronización de líneas, cambio de estado, datos del
+paciente) cambia el hash y produce un fichero nuevo. Al generarlo se eliminan
+las versiones anteriores de la misma factura.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+from django.conf import settings
+
+# Incrementar al cambiar el diseño para descartar los PDF ya generados
+LAYOUT_VERSION = 1
+
+STATUS_LABELS = {
+    'DRAFT': 'Borrador',
+    'SENT': 'Enviada',
+    'PAID': 'Pagada',
+    'CANCELLED': 'Cancelada',
+    'OVERDUE': 'Vencida',
+}
+
+
+def invoice_context(invoice):
+    """Datos planos que se imprimen en el PDF (conviene precargar ``items__service``)."""
+    user = invoice.patient.user
+    return {
+        'layout': LAYOUT_VERSION,
+        'number': f'FAC-{invoice.id:04d}',
+        'issued_at': invoice.issued_at.strftime('%d/%m/%Y'),
+        'status': STATUS_LABELS.get(invoice.status, invoice.status),
+        'due_date': invoice.due_date.strftime('%d/%m/%Y') if invoice.due_date else '',
+        'patient': {
+            'name': f'{user.first_name} {user.last_name}',
+            'email': user.email or '',
+            'phone': user.phone or '',
+            'document_id': user.document_id or '',
+        },
+        'items': [
+            [item.service.name, str(item.quantity), f'{item.unit_price:.2f} €', f'{item.total:.2f} €']
+            for item in sorted(invoice.items.all(), key=lambda item: item.pk)
+        ],
+        'total': f'{invoice.total:.2f} €',
+        'notes': invoice.notes,
+    }
+
+
+def context_hash(context):
+    return hashlib.sha256(json.dumps(context, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def render_invoice_pdf(context):
+    """Genera el PDF a partir de invoice_context() y devuelve sus bytes."""
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.lib.units import cm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=2*cm, leftMargin=2*cm, topMargin=2*cm, bottomMargin=2*cm)
+    elements = []
+    styles = getSampleStyleSheet()
+
+    # Estilos personalizados
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=20,
+        textColor=colors.HexColor('#667eea'),
+        spaceAfter=30,
+        alignment=TA_CENTER
+    )
+    label_style = TableStyle([
+        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f0f4ff')),
+        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#667eea')),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+        ('TOPPADDING', (0, 0), (-1, -1), 8),
+    ])
+
+    # Título
+    elements.append(Paragraph('FACTURA', title_style))
+    elements.append(Spacer(1, 0.5*cm))
+
+    # Información de la factura
+    invoice_data = [
+        ['Nº Factura:', context['number']],
+        ['Fecha:', context['issued_at']],
+        ['Estado:', context['status']],
+    ]
+    if context['due_date']:
+        invoice_data.append(['Vencimiento:', context['due_date']])
+    invoice_table = Table(invoice_data, colWidths=[4*cm, 10*cm])
+    invoice_table.setStyle(label_style)
+    elements.append(invoice_table)
+    elements.append(Spacer(1, 0.5*cm))
+
+    # Información del paciente
+    patient = context['patient']
+    patient_data = [
+        ['Paciente:', patient['name']],
+        ['Email:', patient['email']],
+        ['Teléfono:', patient['phone']],
+    ]
+    if patient['document_id']:
+        patient_data.append(['DNI/NIE:', patient['document_id']])
+    patient_table = Table(patient_data, colWidths=[4*cm, 10*cm])
+    patient_table.setStyle(label_style)
+    elements.append(patient_table)
+    elements.append(Spacer(1, 1*cm))
+
+    # Items de la factura
+    items_data = [['Servicio', 'Cantidad', 'Precio Unit.', 'Total']] + context['items']
+    items_table = Table(items_data, colWidths=[8*cm, 2*cm, 2*cm, 2*cm])
+    items_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#667eea')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('TOPPADDING', (0, 0), (-1, 0), 12),
+        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f9f9f9')]),
+        ('FONTSIZE', (0, 1), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 1), (-1, -1), 8),
+        ('TOPPADDING', (0, 1), (-1, -1), 8),
+    ]))
+    elements.append(items_table)
+    elements.append(Spacer(1, 0.5*cm))
+
+    # Total
+    total_table = Table([['', '', 'TOTAL:', context['total']]], colWidths=[8*cm, 2*cm, 2*cm, 2*cm])
+    total_table.setStyle(TableStyle([
+        ('ALIGN', (2, 0), (-1, -1), 'RIGHT'),
+        ('FONTNAME', (2, 0), (-1, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (2, 0), (-1, -1), 14),
+        ('TEXTCOLOR', (2, 0), (-1, -1), colors.HexColor('#667eea')),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+        ('TOPPADDING', (0, 0), (-1, -1), 12),
+    ]))
+    elements.append(total_table)
+
+    # Notas
+    if context['notes']:
+        elements.append(Spacer(1, 1*cm))
+        elements.append(Paragraph('<b>Notas:</b>', styles['Heading3']))
+        elements.append(Paragraph(context['notes'], styles['Normal']))
+
+    doc.build(elements)
+    return buffer.getvalue()
+
+
+def cache_dir():
+    return Path(settings.INVOICE_PDF['CACHE_DIR'])
+
+
+def cached_pdf_path(invoice_id, digest):
+    return cache_dir() / f'{invoice_id}-{digest}.pdf'
+
+
+def remove_cached_pdfs(invoice_id, keep=None):
+    """Elimina los PDF cacheados de una factura (salvo ``keep``)."""
+    for path in cache_dir().glob(f'{invoice_id}-*.pdf'):
+        if path.name != keep:
+            path.unlink(missing_ok=True)
+
+
+def get_invoice_pdf(invoice, context=None):
+    """
+    Ruta del PDF de la factura y su hash, generándolo si el contenido cambió.
+
+    La escritura es atómica (fichero temporal y ``os.replace``), así que dos
+    peticiones simultáneas como mucho generan el mismo PDF dos veces.
+    """
+    context = context or invoice_context(invoice)
+    digest = context_hash(context)
+    path = cached_pdf_path(invoice.pk, digest)
+    if not path.exists():
+        store_pdf(invoice.pk, digest, render_invoice_pdf(context))
+    return path, digest
+
+
+def store_pdf(invoice_id, digest, content):
+    """Guarda en la caché un PDF ya generado y elimina las versiones anteriores."""
+    path = cached_pdf_path(invoice_id, digest)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as output:
+        output.write(content)
+    os.replace(tmp_name, path)
+    remove_cached_pdfs(invoice_id, keep=path.name)
+    return path
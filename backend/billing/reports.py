@@ -1,94 +1,36 @@
 """Vistas para informes y reportes del sistema"""
 from datetime import datetime, timedelta
 
-from django.db.models import Sum, Count, Q, Avg
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.http import StreamingHttpResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from rest_framework import permissions, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 
 from appointments.models import Appointment
-from billing.models import Invoice, Service
-from patients.models import PatientProfile
-from staff.models import ProfessionalProfile
+from core.dates import local_day_bounds
+from core.filters import parse_filter
+from billing import revenue
+from billing.dashboard import dashboard_snapshot
+from billing.exports import DATASETS, csv_stream, export_queryset, xlsx_stream
+from billing.models import Invoice
+from billing.rollup import status_totals
 
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def dashboard_stats(request):
-    """Estadísticas generales para el dashboard"""
+    """Estadísticas generales para el dashboard (instantánea cacheada, ver billing.dashboard)"""
     user = request.user
     
     # Solo admins y profesionales ven estadísticas globales
     if user.role not in [user.Roles.ADMIN, user.Roles.PROFESSIONAL]:
         return Response({'error': 'No autorizado'}, status=status.HTTP_403_FORBIDDEN)
     
-    today = timezone.now().date()
-    month_start = today.replace(day=1)
-    month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-    
-    # Citas del mes
-    appointments_month = Appointment.objects.filter(
-        start_time__date__gte=month_start,
-        start_time__date__lte=month_end,
-    )
-    
-    # Estadísticas de citas
-    total_appointments = appointments_month.count()
-    confirmed_appointments = appointments_month.filter(status=Appointment.Status.CONFIRMED).count()
-    completed_appointments = appointments_month.filter(status=Appointment.Status.COMPLETED).count()
-    cancelled_appointments = appointments_month.filter(status=Appointment.Status.CANCELLED).count()
-    
-    # Próximas citas (próximos 7 días)
-    next_week = today + timedelta(days=7)
-    upcoming_appointments = Appointment.objects.filter(
-        start_time__date__gte=today,
-        start_time__date__lte=next_week,
-        status__in=[Appointment.Status.PENDING, Appointment.Status.CONFIRMED],
-    ).count()
-    
-    # Pacientes activos (con citas en el último mes)
-    active_patients = PatientProfile.objects.filter(
-        appointments__start_time__date__gte=month_start,
-        appointments__start_time__date__lte=month_end,
-    ).distinct().count()
-    
-    # Facturación del mes
-    invoices_month = Invoice.objects.filter(
-        issued_at__gte=month_start,
-        issued_at__lte=month_end,
-    )
-    
-    total_billing = invoices_month.aggregate(total=Sum('total'))['total'] or 0
-    paid_billing = invoices_month.filter(status=Invoice.Status.PAID).aggregate(total=Sum('total'))['total'] or 0
-    pending_billing = invoices_month.filter(
-        status=Invoice.Status.SENT,
-        due_date__gte=today
-    ).aggregate(total=Sum('total'))['total'] or 0
-    overdue_billing = invoices_month.filter(
-        status=Invoice.Status.SENT,
-        due_date__lt=today
-    ).aggregate(total=Sum('total'))['total'] or 0
-    
-    return Response({
-        'appointments': {
-            'total_month': total_appointments,
-            'confirmed': confirmed_appointments,
-            'completed': completed_appointments,
-            'cancelled': cancelled_appointments,
-            'upcoming_week': upcoming_appointments,
-        },
-        'patients': {
-            'active_month': active_patients,
-            'total': PatientProfile.objects.count(),
-        },
-        'billing': {
-            'total_month': float(total_billing),
-            'paid_month': float(paid_billing),
-            'pending_month': float(pending_billing),
-            'overdue_month': float(overdue_billing),
-        },
-    })
+    return Response(dashboard_snapshot())
 
 
 @api_view(['GET'])
@@ -112,28 +54,18 @@ def billing_report(request):
     else:
         date_to = datetime.strptime(date_to, '%Y-%m-%d').date()
     
-    invoices = Invoice.objects.filter(
-        issued_at__gte=date_from,
-        issued_at__lte=date_to,
-    )
-    
-    total = invoices.aggregate(total=Sum('total'))['total'] or 0
-    paid = invoices.filter(status=Invoice.Status.PAID).aggregate(total=Sum('total'))['total'] or 0
-    pending = invoices.filter(
-        status=Invoice.Status.SENT,
-        due_date__gte=timezone.now().date()
-    ).aggregate(total=Sum('total'))['total'] or 0
-    overdue = invoices.filter(
-        status=Invoice.Status.SENT,
-        due_date__lt=timezone.now().date()
-    ).aggregate(total=Sum('total'))['total'] or 0
-    cancelled = invoices.filter(status=Invoice.Status.CANCELLED).aggregate(total=Sum('total'))['total'] or 0
-    
-    # Facturas por estado
-    by_status = invoices.values('status').annotate(
-        count=Count('id'),
-        total=Sum('total'),
-    )
+    # Días cerrados desde el agregado diario; solo hoy se lee de las facturas
+    totals = status_totals(date_from, date_to)
+    by_status = [
+        {'status': key, 'count': value['count'], 'total': value['total']}
+        for key, value in sorted(totals.items())
+    ]
+    total = sum(value['total'] for value in totals.values())
+    paid = totals.get(Invoice.Status.PAID, {}).get('total', 0)
+    cancelled = totals.get(Invoice.Status.CANCELLED, {}).get('total', 0)
+    # OVERDUE es un estado guardado (billing.overdue): pendientes son las enviadas sin vencer
+    pending = totals.get(Invoice.Status.SENT, {}).get('total', 0)
+    overdue = totals.get(Invoice.Status.OVERDUE, {}).get('total', 0)
     
     return Response({
         'period': {
@@ -148,7 +80,7 @@ def billing_report(request):
             'cancelled': float(cancelled),
         },
         'by_status': list(by_status),
-        'total_invoices': invoices.count(),
+        'total_invoices': sum(value['count'] for value in totals.values()),
     })
 
 
@@ -173,9 +105,10 @@ def activity_report(request):
     else:
         date_to = datetime.strptime(date_to, '%Y-%m-%d').date()
     
+    range_start, range_end = local_day_bounds(date_from, date_to)
     appointments = Appointment.objects.filter(
-        start_time__date__gte=date_from,
-        start_time__date__lte=date_to,
+        start_time__gte=range_start,
+        start_time__lt=range_end,
     )
     
     # Citas por estado
@@ -187,9 +120,9 @@ def activity_report(request):
         'professional__user__last_name',
     ).annotate(count=Count('id'))
     
-    # Citas por día
-    by_day = appointments.extra(
-        select={'day': 'DATE(start_time)'}
+    # Citas por día (día local, no el de UTC)
+    by_day = appointments.annotate(
+        day=TruncDate('start_time', tzinfo=timezone.get_default_timezone())
     ).values('day').annotate(count=Count('id')).order_by('day')
     
     return Response({
@@ -203,3 +136,104 @@ def activity_report(request):
         'by_day': list(by_day),
     })
 
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def revenue_report(request):
+    """
+    Informe de ingresos por periodo, servicio y/o profesional.
+
+    Parámetros: ``group_by`` (lista separada por comas de period, service y
+    professional; por defecto period), ``bucket`` (day, week, month o quarter;
+    por defecto month), ``date_from``, ``date_to`` y ``status`` (lista separada
+    por comas; por defecto SENT, PAID y OVERDUE). Ver billing.revenue.
+    """
+    user = request.user
+    if user.role not in [user.Roles.ADMIN, user.Roles.PROFESSIONAL]:
+        return Response({'error': 'No autorizado'}, status=status.HTTP_403_FORBIDDEN)
+    
+    params = request.query_params
+    group_by = [value for value in params.get('group_by', 'period').split(',') if value]
+    invalid = [value for value in group_by if value not in revenue.DIMENSIONS]
+    if invalid or not group_by:
+        return Response(
+            {'group_by': f"Agrupación no válida: {', '.join(invalid)}", 'available': revenue.DIMENSIONS},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    bucket = params.get('bucket', 'month')
+    if bucket not in revenue.BUCKETS:
+        return Response(
+            {'bucket': f'Periodo no válido: {bucket}', 'available': list(revenue.BUCKETS)},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    statuses = [value for value in params.get('status', '').split(',') if value]
+    invalid = [value for value in statuses if value not in Invoice.Status.values]
+    if invalid:
+        return Response({'status': f"Estado no válido: {', '.join(invalid)}"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    date_from = parse_filter(params, 'date_from', parse_date) or (timezone.now() - timedelta(days=30)).date()
+    date_to = parse_filter(params, 'date_to', parse_date) or timezone.now().date()
+    rows = revenue.revenue_report(date_from, date_to, group_by, bucket, statuses)
+    
+    return Response({
+        'period': {
+            'from': date_from.isoformat(),
+            'to': date_to.isoformat(),
+        },
+        'group_by': group_by,
+        'bucket': bucket,
+        'total': sum(row['revenue'] for row in rows),
+        'rows': rows,
+    })
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def export_data(request, dataset, file_format):
+    """
+    Exportación en streaming (CSV o XLSX) de facturas, líneas, citas o desgloses de informes.
+
+    Parámetros: ``date_from``, ``date_to`` (AAAA-MM-DD), ``status`` y
+    ``columns`` (lista separada por comas; por defecto todas). ``status`` no se
+    admite en los desgloses por estado. Ver billing.exports.
+    """
+    user = request.user
+    if user.role not in [user.Roles.ADMIN, user.Roles.PROFESSIONAL]:
+        return Response({'error': 'No autorizado'}, status=status.HTTP_403_FORBIDDEN)
+    if dataset not in DATASETS:
+        return Response({'error': f'Exportación desconocida: {dataset}', 'available': list(DATASETS)}, status=status.HTTP_404_NOT_FOUND)
+    if file_format not in ['csv', 'xlsx']:
+        return Response({'error': 'Formato no soportado (csv o xlsx)'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    columns = [column for column in request.query_params.get('columns', '').split(',') if column]
+    unknown = [column for column in columns if column not in DATASETS[dataset]['columns']]
+    if unknown:
+        return Response(
+            {'columns': f"Columnas desconocidas: {', '.join(unknown)}", 'available': list(DATASETS[dataset]['columns'])},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    
+    status_filter = request.query_params.get('status')
+    if status_filter and not DATASETS[dataset].get('status_field'):
+        return Response(
+            {'status': f'La exportación {dataset} no admite filtrar por estado.'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    
+    headers, rows = export_queryset(
+        dataset,
+        columns=columns,
+        date_from=parse_filter(request.query_params, 'date_from', parse_date),
+        date_to=parse_filter(request.query_params, 'date_to', parse_date),
+        status=status_filter,
+    )
+    filename = f'{dataset}_{timezone.localdate():%Y%m%d}.{file_format}'
+    if file_format == 'csv':
+        response = StreamingHttpResponse(csv_stream(headers, rows), content_type='text/csv; charset=utf-8')
+    else:
+        response = StreamingHttpResponse(
+            xlsx_stream(headers, rows, sheet_name=dataset),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,159 @@
+"""
+Analítica de ingresos: importe de las líneas de factura (cantidad × precio)
+por servicio, por profesional y por periodo (día, semana, mes o trimestre).
+
+Cada informe es una sola consulta agregada (``values(...).annotate(...)``)
+sobre InvoiceItem, agrupada por las dimensiones pedidas, más una consulta de
+nombres por dimensión (servicio o profesional).
+
+El profesional de una línea es el de la cita facturada; si la línea no viene
+de una cita, el profesional que emitió la factura. Los presupuestos no están
+enlazados con facturas ni líneas, así que no intervienen.
+
+Los informes de periodos cerrados (``date_to`` anterior a hoy) se guardan en
+la caché del dashboard sin caducidad. La clave lleva un contador de generación
+que solo se incrementa cuando cambia una factura o línea de un día ya cerrado:
+señales en ``billing.signals`` y, para las escrituras en bloque que no las
+disparan, llamadas explícitas a ``invalidate_revenue_for`` (sincronización de
+líneas, facturación por lotes) o ``invalidate_revenue`` (``billing.overdue``).
+Lo escrito hoy no afecta a periodos cerrados. La caché solo guarda los ids de
+servicio y profesional: los nombres se añaden al servir cada informe, de modo
+que renombrar un servicio o un profesional no deja nombres antiguos.
+"""
+import hashlib
+import json
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import Coalesce, TruncDay, TruncMonth, TruncQuarter, TruncWeek
+from django.utils import timezone
+
+from .dashboard import get_dashboard_cache
+from .models import Invoice, InvoiceItem
+
+GENERATION_KEY = 'billing:revenue:generation'
+
+# issued_at es un DateField (fecha local de emisión): Trunc* no necesita zona
+# horaria; con tzinfo, PostgreSQL convertiría la fecha como si fuera UTC
+BUCKETS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+    'quarter': TruncQuarter,
+}
+DIMENSIONS = ['period', 'service', 'professional']
+
+# Por defecto cuentan como ingreso las facturas emitidas (ni borradores ni canceladas)
+REVENUE_STATUSES = [Invoice.Status.SENT, Invoice.Status.PAID, Invoice.Status.OVERDUE]
+
+
+def invalidate_revenue(**kwargs):
+    """Invalida los informes cacheados de periodos cerrados."""
+    cache = get_dashboard_cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+
+
+def invalidate_revenue_for(days):
+    """Invalida tras el commit si alguno de los días de emisión ya está cerrado."""
+    today = timezone.localdate()
+    if any(day and day < today for day in days):
+        transaction.on_commit(invalidate_revenue)
+
+
+def group_columns(group_by, bucket):
+    """Columnas de agrupación: expresión, o None si es un campo de InvoiceItem"""
+    columns = {}
+    if 'period' in group_by:
+        columns['period'] = BUCKETS[bucket]('invoice__issued_at')
+    if 'service' in group_by:
+        columns['service_id'] = None
+    if 'professional' in group_by:
+        columns['professional_id'] = Coalesce(
+            'appointment__professional_id',
+            'invoice__issued_by__professional_profile__id',
+        )
+    return columns
+
+
+def with_names(report):
+    """Copia del informe con los nombres actuales de servicios y profesionales (una consulta por dimensión)."""
+    from staff.models import ProfessionalProfile
+
+    from .models import Service
+
+    services, professionals = {}, {}
+    service_ids = {row['service_id'] for row in report if row.get('service_id') is not None}
+    if service_ids:
+        services = dict(Service.objects.filter(pk__in=service_ids).values_list('pk', 'name'))
+    professional_ids = {row['professional_id'] for row in report if row.get('professional_id') is not None}
+    if professional_ids:
+        rows = ProfessionalProfile.objects.filter(pk__in=professional_ids).values_list(
+            'pk', 'user__first_name', 'user__last_name',
+        )
+        professionals = {pk: (first_name, last_name) for pk, first_name, last_name in rows}
+
+    named = []
+    for row in report:
+        item = {}
+        for name, value in row.items():
+            item[name] = value
+            if name == 'service_id':
+                item['service_name'] = services.get(value)
+            elif name == 'professional_id':
+                item['professional_first_name'], item['professional_last_name'] = professionals.get(value, (None, None))
+        named.append(item)
+    return named
+
+
+def compute_revenue(date_from, date_to, group_by, bucket='month', statuses=None):
+    """Filas del informe: dimensiones pedidas más líneas, facturas, unidades e importe."""
+    columns = group_columns(group_by, bucket)
+    rows = (
+        InvoiceItem.objects
+        .filter(
+            invoice__issued_at__gte=date_from,
+            invoice__issued_at__lte=date_to,
+            invoice__status__in=statuses or REVENUE_STATUSES,
+        )
+        .values(
+            *[name for name, expression in columns.items() if expression is None],
+            **{name: expression for name, expression in columns.items() if expression is not None},
+        )
+        .annotate(
+            lines=Count('id'),
+            invoices=Count('invoice', distinct=True),
+            units=Sum('quantity'),
+            revenue=Sum(ExpressionWrapper(
+                F('quantity') * F('unit_price'),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            )),
+        )
+        .order_by(*columns)
+    )
+    report = []
+    for row in rows:
+        if 'period' in row:
+            row['period'] = row['period'].isoformat()
+        row['revenue'] = float(row['revenue'] or 0)
+        report.append(row)
+    return report
+
+
+def revenue_report(date_from, date_to, group_by, bucket='month', statuses=None, today=None):
+    """Informe de ingresos; los de periodos cerrados se sirven desde la caché."""
+    today = today or timezone.localdate()
+    if date_to >= today:
+        return with_names(compute_revenue(date_from, date_to, group_by, bucket, statuses))
+
+    cache = get_dashboard_cache()
+    params = json.dumps([date_from.isoformat(), date_to.isoformat(), sorted(group_by), bucket, sorted(statuses or [])])
+    generation = cache.get(GENERATION_KEY, 0)
+    key = f'billing:revenue:{generation}:{hashlib.sha1(params.encode()).hexdigest()}'
+    report = cache.get(key)
+    if report is None:
+        report = compute_revenue(date_from, date_to, group_by, bucket, statuses)
+        cache.set(key, report, None)
+    return with_names(report)
@@ -0,0 +1,136 @@
+"""
+Agregado diario de facturación (``BillingDailyRollup``).
+
+Cada fila guarda el número de facturas y la suma de ``total`` por día de
+emisión y estado. Se mantiene de forma incremental desde ``Invoice.save`` y
+del borrado de facturas (restando la contribución anterior y sumando la
+nueva, en la misma transacción) y puede reconstruirse y verificarse con el
+comando ``billing_rollup``.
+
+Los informes leen el agregado para los días anteriores a hoy y las facturas
+directamente solo para hoy, de modo que su coste no depende de los años de
+histórico.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from .models import BillingDailyRollup, Invoice
+
+
+def apply_deltas(deltas):
+    """Aplica {(día, estado): (Δ número, Δ importe)} al agregado."""
+    for (day, status), (count, amount) in deltas.items():
+        if not count and not amount:
+            continue
+        updated = BillingDailyRollup.objects.filter(day=day, status=status).update(
+            invoice_count=F('invoice_count') + count,
+            total=F('total') + amount,
+        )
+        if updated:
+            continue
+        try:
+            with transaction.atomic():
+                BillingDailyRollup.objects.create(day=day, status=status, invoice_count=count, total=amount)
+        except IntegrityError:
+            # Otra transacción ha creado la fila entre el UPDATE y el INSERT
+            BillingDailyRollup.objects.filter(day=day, status=status).update(
+                invoice_count=F('invoice_count') + count,
+                total=F('total') + amount,
+            )
+
+
+def apply_invoice_change(old_state, new_state):
+    """Traslada al agregado el cambio de una factura de old_state a new_state ((día, estado, total) o None)."""
+    deltas = defaultdict(lambda: (0, Decimal('0')))
+    if old_state is not None:
+        day, status, total = old_state
+        count, amount = deltas[(day, status)]
+        deltas[(day, status)] = (count - 1, amount - Decimal(total or 0))
+    if new_state is not None:
+        day, status, total = new_state
+        count, amount = deltas[(day, status)]
+        deltas[(day, status)] = (count + 1, amount + Decimal(total or 0))
+    apply_deltas(deltas)
+
+
+def raw_totals(queryset):
+    """{(día, estado): (número, importe)} calculado sobre las facturas."""
+    rows = queryset.order_by().values('issued_at', 'status').annotate(count=Count('pk'), amount=Sum('total'))
+    return {(row['issued_at'], row['status']): (row['count'], row['amount'] or Decimal('0')) for row in rows}
+
+
+def status_totals(date_from, date_to, today=None):
+    """
+    {estado: {'count': n, 'total': importe}} de las facturas emitidas entre
+    date_from y date_to (incluidos): agregado para los días anteriores a hoy y
+    facturas para hoy en adelante.
+    """
+    today = today or timezone.localdate()
+    totals = defaultdict(lambda: {'count': 0, 'total': Decimal('0')})
+    if date_from < today:
+        rows = BillingDailyRollup.objects.filter(
+            day__gte=date_from,
+            day__lte=min(date_to, today - timedelta(days=1)),
+            invoice_count__gt=0,
+        ).values('status').annotate(count=Sum('invoice_count'), amount=Sum('total'))
+        for row in rows:
+            totals[row['status']]['count'] += row['count'] or 0
+            totals[row['status']]['total'] += row['amount'] or Decimal('0')
+    if date_to >= today:
+        rows = Invoice.objects.filter(
+            issued_at__gte=max(date_from, today),
+            issued_at__lte=date_to,
+        ).order_by().values('status').annotate(count=Count('pk'), amount=Sum('total'))
+        for row in rows:
+            totals[row['status']]['count'] += row['count']
+            totals[row['status']]['total'] += row['amount'] or Decimal('0')
+    return dict(totals)
+
+
+@transaction.atomic
+def rebuild_rollup(date_from=None, date_to=None):
+    """Recalcula el agregado desde las facturas (todo o un rango de días). Devuelve las filas escritas."""
+    invoices = Invoice.objects.all()
+    rollup = BillingDailyRollup.objects.all()
+    if date_from:
+        invoices = invoices.filter(issued_at__gte=date_from)
+        rollup = rollup.filter(day__gte=date_from)
+    if date_to:
+        invoices = invoices.filter(issued_at__lte=date_to)
+        rollup = rollup.filter(day__lte=date_to)
+    rollup.delete()
+    rows = [
+        BillingDailyRollup(day=day, status=status, invoice_count=count, total=amount)
+        for (day, status), (count, amount) in raw_totals(invoices).items()
+    ]
+    BillingDailyRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def check_rollup(date_from=None, date_to=None):
+    """Compara el agregado con las facturas. Devuelve las diferencias [(día, estado, agregado, real)]."""
+    invoices = Invoice.objects.all()
+    rollup = BillingDailyRollup.objects.all()
+    if date_from:
+        invoices = invoices.filter(issued_at__gte=date_from)
+        rollup = rollup.filter(day__gte=date_from)
+    if date_to:
+        invoices = invoices.filter(issued_at__lte=date_to)
+        rollup = rollup.filter(day__lte=date_to)
+    expected = raw_totals(invoices)
+    stored = {
+        (row.day, row.status): (row.invoice_count, row.total)
+        for row in rollup
+        if row.invoice_count or row.total
+    }
+    empty = (0, Decimal('0'))
+    return [
+        (day, status, stored.get((day, status), empty), expected.get((day, status), empty))
+        for day, status in sorted(set(expected) | set(stored))
+        if stored.get((day, status), empty) != expected.get((day, status), empty)
+    ]
@@ -1,8 +1,10 @@
 from decimal import Decimal
 
+from django.db import models, transaction
 from rest_framework import serializers
 
-from .models import Budget, Invoice, InvoiceItem, Service
+from .models import Budget, Invoice, InvoiceExportJob, InvoiceItem, Service
+from .revenue import invalidate_revenue_for
 from patients.serializers import PatientSerializer
 from staff.serializers import ProfessionalSerializer
 
@@ -13,12 +15,38 @@ class ServiceSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'description', 'base_price', 'is_active']
 
 
+class ServiceField(serializers.PrimaryKeyRelatedField):
+    """
+    Solo valida el identificador del servicio; InvoiceSerializer.validate_items
+    resuelve los servicios de todas las líneas con una sola consulta.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class InvoiceItemListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Servicio de cada línea en la misma consulta (service_detail)
+        if isinstance(data, models.Manager):
+            data = data.all().select_related('service')
+        return super().to_representation(data)
+
+
 class InvoiceItemSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(required=False)
+    service = ServiceField(queryset=Service.objects.all())
     service_detail = ServiceSerializer(source='service', read_only=True)
 
     class Meta:
         model = InvoiceItem
         fields = ['id', 'service', 'service_detail', 'quantity', 'unit_price']
+        list_serializer_class = InvoiceItemListSerializer
 
 
 class InvoiceSerializer(serializers.ModelSerializer):
@@ -52,32 +80,105 @@ class InvoiceSerializer(serializers.ModelSerializer):
         """Devuelve el estado efectivo (incluyendo OVERDUE si corresponde)"""
         return obj.get_effective_status()
 
+    def validate_items(self, value):
+        services = Service.objects.in_bulk({item['service'] for item in value})
+        message = self.fields['items'].child.fields['service'].error_messages['does_not_exist']
+        errors = [
+            {} if item['service'] in services else {'service': [message.format(pk_value=item['service'])]}
+            for item in value
+        ]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return [{**item, 'service': services[item['service']]} for item in value]
+
+    @transaction.atomic
     def create(self, validated_data):
         items_data = validated_data.pop('items')
         invoice = Invoice.objects.create(**validated_data)
-        self._sync_items(invoice, items_data)
+        self._sync_items(invoice, items_data, new=True)
         invoice.recalculate_total()
         return invoice
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         items_data = validated_data.pop('items', None)
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
         instance.save()
         if items_data is not None:
-            instance.items.all().delete()
             self._sync_items(instance, items_data)
-        instance.recalculate_total()
+            instance.recalculate_total()
         return instance
 
-    def _sync_items(self, invoice, items_data):
-        for item in items_data:
-            InvoiceItem.objects.create(
-                invoice=invoice,
-                service=item['service'],
-                quantity=item.get('quantity', 1),
-                unit_price=item.get('unit_price') or item['service'].base_price,
-            )
+    def _sync_items(self, invoice, items_data, new=False):
+        """
+        Deja en la factura exactamente las líneas de items_data con el mínimo de escrituras.
+
+        Las líneas con ``id`` de esta factura se actualizan en su sitio; las que
+        llegan sin ``id`` reutilizan primero una línea idéntica y después
+        cualquier línea sobrante que no sea de una cita. Lo que quede se
+        inserta o elimina en bloque.
+        """
+        def line(data):
+            service = data['service']
+            return (service.pk, data.get('quantity', 1), data.get('unit_price') or service.base_price)
+
+        def assign(item, data):
+            item.service = data['service']
+            _, item.quantity, item.unit_price = line(data)
+
+        existing = {} if new else {item.pk: item for item in invoice.items.all()}
+        final = [None] * len(items_data)
+        changed, pending = [], []
+        for position, data in enumerate(items_data):
+            item = existing.pop(data.get('id'), None)
+            if item is None:
+                pending.append(position)
+                continue
+            final[position] = item
+            if (item.service_id, item.quantity, item.unit_price) != line(data):
+                changed.append(position)
+
+        identical = {}
+        for item in existing.values():
+            identical.setdefault((item.service_id, item.quantity, item.unit_price), []).append(item)
+        unmatched = []
+        for position in pending:
+            same = identical.get(line(items_data[position]))
+            if same:
+                item = same.pop()
+                del existing[item.pk]
+                final[position] = item
+            else:
+                unmatched.append(position)
+
+        # Las líneas de una cita facturada no se reutilizan para otra cosa: se
+        # eliminan, y la cita vuelve a estar pendiente de facturar
+        leftovers = [item for item in existing.values() if item.appointment_id is None]
+        unlinked = [item for item in existing.values() if item.appointment_id is not None]
+        to_create = []
+        for position in unmatched:
+            if leftovers:
+                final[position] = leftovers.pop(0)
+                changed.append(position)
+            else:
+                final[position] = InvoiceItem(invoice=invoice)
+                assign(final[position], items_data[position])
+                to_create.append(final[position])
+
+        to_update = [final[position] for position in changed]
+        for position in changed:
+            assign(final[position], items_data[position])
+
+        if leftovers or unlinked:
+            InvoiceItem.objects.filter(pk__in=[item.pk for item in leftovers + unlinked]).delete()
+        if to_update:
+            InvoiceItem.objects.bulk_update(to_update, ['service', 'quantity', 'unit_price'])
+        if to_create:
+            InvoiceItem.objects.bulk_create(to_create)
+        if leftovers or unlinked or to_update or to_create:
+            # bulk_update y bulk_create no emiten las señales de InvoiceItem
+            invalidate_revenue_for([invoice.issued_at])
 
 
 class BudgetSerializer(serializers.ModelSerializer):
@@ -109,3 +210,97 @@ class BudgetSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ('created_at',)
 
+
+class InvoicePatientUserSerializer(serializers.Serializer):
+    first_name = serializers.CharField(read_only=True)
+    last_name = serializers.CharField(read_only=True)
+
+
+class InvoicePatientSummarySerializer(serializers.Serializer):
+    id = serializers.IntegerField(read_only=True)
+    user = InvoicePatientUserSerializer(read_only=True)
+
+
+class InvoiceListSerializer(serializers.ModelSerializer):
+    """Representación compacta para listados: totales y número de líneas, sin las líneas"""
+    patient = InvoicePatientSummarySerializer(read_only=True)
+    item_count = serializers.IntegerField(read_only=True)
+    effective_status = serializers.CharField(source='get_effective_status', read_only=True)
+
+    class Meta:
+        model = Invoice
+        fields = [
+            'id',
+            'patient',
+            'issued_by',
+            'status',
+            'effective_status',
+            'issued_at',
+            'due_date',
+            'total',
+            'item_count',
+        ]
+        read_only_fields = fields
+
+
+class InvoiceExportRequestSerializer(serializers.Serializer):
+    date_from = serializers.DateField()
+    date_to = serializers.DateField()
+    status = serializers.ChoiceField(choices=Invoice.Status.choices, required=False, allow_blank=True)
+
+    def validate(self, attrs):
+        if attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError({'date_to': 'La fecha final debe ser posterior a la inicial.'})
+        return attrs
+
+
+class InvoiceFromAppointmentsSerializer(serializers.Serializer):
+    date_from = serializers.DateField()
+    date_to = serializers.DateField()
+    status = serializers.ChoiceField(
+        choices=[Invoice.Status.DRAFT, Invoice.Status.SENT],
+        default=Invoice.Status.DRAFT,
+    )
+    dry_run = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError({'date_to': 'La fecha final debe ser posterior a la inicial.'})
+        return attrs
+
+
+class InvoiceExportJobSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = InvoiceExportJob
+        fields = [
+            'id',
+            'date_from',
+            'date_to',
+            'invoice_status',
+            'status',
+            'total',
+            'processed',
+            'progress',
+            'error',
+            'created_at',
+            'finished_at',
+            'download_url',
+        ]
+        read_only_fields = fields
+
+    def get_progress(self, obj):
+        """Porcentaje de facturas procesadas"""
+        if obj.status == InvoiceExportJob.Status.DONE:
+            return 100
+        return int(obj.processed * 100 / obj.total) if obj.total else 0
+
+    def get_download_url(self, obj):
+        if obj.status != InvoiceExportJob.Status.DONE:
+            return None
+        from django.urls import reverse
+        url = reverse('invoice-export-download', args=[obj.pk])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
@@ -0,0 +1,61 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from appointments.intervals import appointments_bulk_changed
+from appointments.models import Appointment
+from patients.models import PatientProfile
+
+from .dashboard import invalidate_dashboard
+from .models import Invoice, InvoiceItem
+from .revenue import invalidate_revenue, invalidate_revenue_for
+from .rollup import apply_invoice_change
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_save, sender=PatientProfile)
+@receiver(post_delete, sender=PatientProfile)
+def invalidate_dashboard_on_change(sender, **kwargs):
+    """Invalidar la instantánea del dashboard cuando la transacción se confirme"""
+    transaction.on_commit(invalidate_dashboard)
+
+
+@receiver(post_delete, sender=Invoice)
+def remove_invoice_from_rollup(sender, instance, **kwargs):
+    """Restar del agregado diario la contribución de la factura eliminada"""
+    state = getattr(instance, '_rollup_state', None) or instance.rollup_state()
+    apply_invoice_change(state, None)
+
+
+@receiver(post_delete, sender=Invoice)
+def remove_invoice_pdfs(sender, instance, **kwargs):
+    """Eliminar los PDF cacheados de la factura cuando la transacción se confirme"""
+    from .pdf import remove_cached_pdfs
+
+    invoice_id = instance.pk
+    transaction.on_commit(lambda: remove_cached_pdfs(invoice_id))
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+def invalidate_revenue_on_invoice_change(sender, instance, **kwargs):
+    """Invalidar los informes de ingresos cerrados si la factura es (o era) de un día cerrado"""
+    # En post_save _rollup_state aún es el estado anterior al guardado
+    old_state = getattr(instance, '_rollup_state', None)
+    invalidate_revenue_for([instance.issued_at, old_state[0] if old_state else None])
+
+
+@receiver(post_save, sender=InvoiceItem)
+@receiver(post_delete, sender=InvoiceItem)
+def invalidate_revenue_on_item_change(sender, instance, **kwargs):
+    """Invalidar los informes de ingresos cerrados al cambiar una línea de un día cerrado"""
+    if Invoice.objects.filter(pk=instance.invoice_id, issued_at__lt=timezone.localdate()).exists():
+        transaction.on_commit(invalidate_revenue)
+
+
+# Escrituras masivas de citas (ya se emite tras el commit)
+appointments_bulk_changed.connect(invalidate_dashboard, dispatch_uid='billing_dashboard_bulk')
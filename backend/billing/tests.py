@@ -1,3 +1,803 @@
-from django.test import TestCase
+import csv
+import io
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from appointments.models import Appointment
+from patients.models import PatientProfile
+from resources.models import Room
+from staff.models import ProfessionalProfile
+from users.models import User
+
+from . import dashboard
+from .batch_invoicing import invoice_appointments, locked_billable
+from .bulk_pdf import fail_stale_jobs, run_pending_jobs, write_chunk
+from .models import BillingDailyRollup, Invoice, InvoiceExportJob, InvoiceItem, Service
+from .overdue import mark_overdue, reopen_extended
+from .pdf import cached_pdf_path, context_hash, invoice_context, store_pdf
+from .revenue import revenue_report
+from .serializers import InvoiceSerializer
+from .rollup import check_rollup, rebuild_rollup
+
+
+class InvoiceItemSyncTests(TestCase):
+    """Sincronización de líneas por diferencias y total calculado en la base de datos."""
+
+    ITEMS = 30
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        patient_user = User.objects.create(username='paciente', role=User.Roles.PATIENT)
+        cls.patient = PatientProfile.objects.create(user=patient_user)
+        cls.services = [
+            Service.objects.create(name=f'Servicio {i}', base_price=Decimal('10.00') + i)
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.invoice = Invoice.objects.create(patient=self.patient, issued_by=self.admin)
+        InvoiceItem.objects.bulk_create([
+            InvoiceItem(
+                invoice=self.invoice,
+                service=self.services[i % 3],
+                quantity=1,
+                unit_price=self.services[i % 3].base_price,
+            )
+            for i in range(self.ITEMS)
+        ])
+        self.invoice.recalculate_total()
+
+    def payload(self):
+        return [
+            {'id': item.pk, 'service': item.service_id, 'quantity': item.quantity, 'unit_price': str(item.unit_price)}
+            for item in self.invoice.items.order_by('pk')
+        ]
+
+    def put_items(self, items):
+        return self.client.patch(f'/api/invoices/{self.invoice.pk}/', {'items': items}, format='json')
+
+    def test_edit_one_line_updates_only_that_row(self):
+        items = self.payload()
+        ids = [item['id'] for item in items]
+        items[5]['quantity'] = 3
+        # Consultas fijas: la cantidad no depende del número de líneas
+        with self.assertNumQueries(15):
+            response = self.put_items(items)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(self.invoice.items.values_list('pk', flat=True)), ids)
+        self.invoice.refresh_from_db()
+        expected = sum(Decimal(item['unit_price']) * item['quantity'] for item in items)
+        self.assertEqual(self.invoice.total, expected)
+        self.assertEqual(Decimal(response.data['total']), expected)
+
+    def test_unchanged_items_without_ids_are_kept(self):
+        items = self.payload()
+        ids = [item.pop('id') for item in items]
+        with self.assertNumQueries(10):
+            response = self.put_items(items)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(self.invoice.items.values_list('pk', flat=True)), ids)
+
+    def test_added_and_removed_lines(self):
+        items = self.payload()[:-2]
+        items.append({'service': self.services[0].pk, 'quantity': 2, 'unit_price': '15.00'})
+        removed = self.invoice.items.order_by('pk').values_list('pk', flat=True)[self.ITEMS - 2:]
+        removed = list(removed)
+        response = self.put_items(items)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.invoice.items.count(), self.ITEMS - 1)
+        # La línea nueva reutiliza una de las eliminadas
+        self.assertEqual(self.invoice.items.filter(pk__in=removed).count(), 1)
+        self.invoice.refresh_from_db()
+        self.assertEqual(
+            self.invoice.total,
+            sum(item.quantity * item.unit_price for item in self.invoice.items.all()),
+        )
+
+    def test_unknown_service_is_rejected_per_line(self):
+        for value in [9999, 'x']:
+            items = self.payload()
+            items[1]['service'] = value
+            response = self.put_items(items)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data['items'][0], {})
+            self.assertEqual(list(response.data['items'][1]), ['service'])
+        self.assertEqual(self.invoice.items.count(), self.ITEMS)
+
+    def test_line_sync_on_a_closed_day_refreshes_revenue(self):
+        # La sincronización escribe en bloque (sin señales de InvoiceItem) y
+        # aquí el total no cambia, así que tampoco se guarda la factura
+        yesterday = timezone.localdate() - timedelta(days=1)
+        Invoice.objects.filter(pk=self.invoice.pk).update(status=Invoice.Status.SENT, issued_at=yesterday)
+        self.invoice.refresh_from_db()
+        twin = Service.objects.create(name='Servicio gemelo', base_price=self.services[0].base_price)
+
+        def revenue_by_service():
+            return {row['service_id']: row['revenue'] for row in revenue_report(yesterday, yesterday, ['service'])}
+
+        self.assertNotIn(twin.pk, revenue_by_service())
+        items = [
+            {**item, 'service': twin if item['service'] == self.services[0].pk else Service.objects.get(pk=item['service'])}
+            for item in self.payload()
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            InvoiceSerializer()._sync_items(self.invoice, items)
+            self.invoice.recalculate_total()
+        self.assertIn(twin.pk, revenue_by_service())
+
+    def test_create_uses_bulk_insert(self):
+        items = [
+            {'service': self.services[i % 3].pk, 'quantity': 1, 'unit_price': str(self.services[i % 3].base_price)}
+            for i in range(self.ITEMS)
+        ]
+        # La respuesta vuelve a leer las líneas con su servicio en una consulta
+        with self.assertNumQueries(16):
+            response = self.client.post(
+                '/api/invoices/',
+                {'patient_id': self.patient.pk, 'items': items},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 201)
+        invoice = Invoice.objects.get(pk=response.data['id'])
+        self.assertEqual(invoice.items.count(), self.ITEMS)
+        self.assertEqual(invoice.total, sum(service.base_price for service in self.services) * 10)
+
+
+class BatchInvoicingTests(TestCase):
+    """Facturación por lotes de citas completadas (billing.batch_invoicing)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        professional_user = User.objects.create(username='doctora', role=User.Roles.PROFESSIONAL)
+        cls.professional = ProfessionalProfile.objects.create(
+            user=professional_user, specialty='General', license_number='L-1',
+        )
+        cls.room = Room.objects.create(name='Sala 1')
+        cls.patients = [
+            PatientProfile.objects.create(user=User.objects.create(username=f'paciente{i}', role=User.Roles.PATIENT))
+            for i in range(2)
+        ]
+        cls.service = Service.objects.create(name='Limpieza', base_price=Decimal('40.00'))
+
+    def appointment(self, patient, hours, treatment_type='limpieza', status=Appointment.Status.COMPLETED):
+        start = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=1, hours=hours)
+        return Appointment.objects.create(
+            patient=patient,
+            professional=self.professional,
+            room=self.room,
+            start_time=start,
+            end_time=start + timedelta(minutes=30),
+            status=status,
+            treatment_type=treatment_type,
+        )
+
+    def test_one_invoice_per_patient_and_line_per_appointment(self):
+        first = [self.appointment(self.patients[0], hours) for hours in (1, 2)]
+        second = self.appointment(self.patients[1], 3)
+        unknown = self.appointment(self.patients[1], 4, treatment_type='Implante')
+        self.appointment(self.patients[0], 5, status=Appointment.Status.CANCELLED)
+
+        result = invoice_appointments(issued_by=self.admin)
+
+        self.assertEqual(len(result['invoices']), 2)
+        self.assertEqual([row['appointment'] for row in result['skipped']], [unknown.pk])
+        invoice = Invoice.objects.get(patient=self.patients[0])
+        self.assertEqual(invoice.total, Decimal('80.00'))
+        self.assertEqual(
+            sorted(invoice.items.values_list('appointment_id', flat=True)),
+            sorted(appointment.pk for appointment in first),
+        )
+        self.assertEqual(InvoiceItem.objects.get(appointment=second).invoice.patient, self.patients[1])
+
+    def test_second_run_does_not_bill_again(self):
+        self.appointment(self.patients[0], 1)
+        invoice_appointments(issued_by=self.admin)
+        result = invoice_appointments(issued_by=self.admin)
+        self.assertEqual(result['invoices'], [])
+        self.assertEqual(Invoice.objects.count(), 1)
+
+    def test_replaced_appointment_line_frees_the_appointment(self):
+        first, second = [self.appointment(self.patients[0], hours) for hours in (1, 2)]
+        invoice_appointments(issued_by=self.admin)
+        invoice = Invoice.objects.get()
+        kept = invoice.items.get(appointment=first)
+        other = Service.objects.create(name='Blanqueamiento', base_price=Decimal('90.00'))
+
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        response = client.patch(f'/api/invoices/{invoice.pk}/', {'items': [
+            {'id': kept.pk, 'service': self.service.pk, 'quantity': 1, 'unit_price': '40.00'},
+            {'service': other.pk, 'quantity': 1, 'unit_price': '90.00'},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(invoice.items.exclude(appointment=None).values_list('appointment', flat=True)), [first.pk])
+        result = invoice_appointments(issued_by=self.admin)
+        self.assertEqual(result['invoices'][0]['appointments'], [second.pk])
+
+    def test_lock_only_applies_to_appointment_rows(self):
+        # PostgreSQL rechaza FOR UPDATE sobre el lado nulo del LEFT JOIN con las líneas
+        features = {'has_select_for_update': True, 'has_select_for_update_of': True}
+        with transaction.atomic(), mock.patch.multiple(connection.features, **features):
+            queryset = locked_billable([1, 2]).values_list('pk', flat=True)
+            sql, _ = queryset.query.get_compiler(connection=connection).as_sql()
+        table = connection.ops.quote_name(Appointment._meta.db_table)
+        self.assertIn('LEFT OUTER JOIN', sql)
+        self.assertTrue(sql.endswith(f'FOR UPDATE OF {table}'))
+
+
+class InvoiceExportTests(TestCase):
+    """Exportación masiva de PDF: cola del worker, trabajos interrumpidos y caché."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        patient_user = User.objects.create(username='paciente', role=User.Roles.PATIENT)
+        cls.patient = PatientProfile.objects.create(user=patient_user)
+        service = Service.objects.create(name='Limpieza', base_price=Decimal('40.00'))
+        cls.invoices = []
+        for _ in range(2):
+            invoice = Invoice.objects.create(patient=cls.patient, issued_by=cls.admin, status=Invoice.Status.SENT)
+            InvoiceItem.objects.create(invoice=invoice, service=service, quantity=1, unit_price=Decimal('40.00'))
+            cls.invoices.append(invoice)
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(
+            MEDIA_ROOT=media.name,
+            INVOICE_PDF={'CACHE_DIR': str(Path(media.name) / 'invoices')},
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def loaded_invoices(self):
+        return list(
+            Invoice.objects.filter(pk__in=[invoice.pk for invoice in self.invoices])
+            .select_related('patient__user').prefetch_related('items__service').order_by('pk')
+        )
+
+    def test_request_only_queues_the_job(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        today = timezone.localdate()
+        with mock.patch('threading.Thread') as thread, self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/invoices/export-pdf/', {'date_from': today, 'date_to': today})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(InvoiceExportJob.objects.get().status, InvoiceExportJob.Status.PENDING)
+        thread.assert_not_called()
+
+    def test_worker_runs_pending_jobs(self):
+        today = timezone.localdate()
+        job = InvoiceExportJob.objects.create(date_from=today, date_to=today)
+        with mock.patch(
+            'billing.bulk_pdf.ProcessPoolExecutor',
+            lambda max_workers, mp_context: ThreadPoolExecutor(max_workers),
+        ):
+            self.assertEqual(run_pending_jobs(), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual(job.status, InvoiceExportJob.Status.DONE)
+        self.assertEqual((job.processed, job.total), (2, 2))
+        with zipfile.ZipFile(Path(settings.MEDIA_ROOT) / job.archive.name) as archive:
+            self.assertEqual(len(archive.namelist()), 2)
+
+    def test_stale_running_jobs_are_marked_failed(self):
+        today = timezone.localdate()
+        now = timezone.now()
+        stale = InvoiceExportJob.objects.create(
+            date_from=today, date_to=today, status=InvoiceExportJob.Status.RUNNING,
+            heartbeat_at=now - timedelta(seconds=settings.INVOICE_EXPORT['STALE_SECONDS'] + 1),
+        )
+        alive = InvoiceExportJob.objects.create(
+            date_from=today, date_to=today, status=InvoiceExportJob.Status.RUNNING, heartbeat_at=now,
+        )
+        self.assertEqual(fail_stale_jobs(now), 1)
+        stale.refresh_from_db()
+        alive.refresh_from_db()
+        self.assertEqual(stale.status, InvoiceExportJob.Status.FAILED)
+        self.assertTrue(stale.error)
+        self.assertEqual(alive.status, InvoiceExportJob.Status.RUNNING)
+
+    def test_chunk_regenerates_pdfs_missing_from_the_cache(self):
+        cached, missing = self.loaded_invoices()
+        context = invoice_context(cached)
+        store_pdf(cached.pk, context_hash(context), b'%PDF-cached')
+        executor = mock.Mock(map=lambda function, items: [b'%PDF-rendered' for _ in items])
+        output = tempfile.TemporaryFile()
+        self.addCleanup(output.close)
+        with zipfile.ZipFile(output, 'w') as archive:
+            write_chunk(archive, executor, [cached, missing])
+        with zipfile.ZipFile(output) as archive:
+            self.assertEqual(archive.read(f'factura_{cached.pk:04d}.pdf'), b'%PDF-cached')
+            self.assertEqual(archive.read(f'factura_{missing.pk:04d}.pdf'), b'%PDF-rendered')
+        digest = context_hash(invoice_context(missing))
+        self.assertEqual(cached_pdf_path(missing.pk, digest).read_bytes(), b'%PDF-rendered')
+
+
+class InvoicePdfCacheTests(TestCase):
+    """Caché en disco de los PDF: reutilización, ETag y limpieza de versiones."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        patient_user = User.objects.create(username='paciente', role=User.Roles.PATIENT)
+        cls.patient = PatientProfile.objects.create(user=patient_user)
+        cls.service = Service.objects.create(name='Limpieza', base_price=Decimal('40.00'))
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(INVOICE_PDF={'CACHE_DIR': str(Path(media.name) / 'invoices')})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.invoice = Invoice.objects.create(patient=self.patient, issued_by=self.admin, status=Invoice.Status.SENT)
+        self.item = InvoiceItem.objects.create(
+            invoice=self.invoice, service=self.service, quantity=1, unit_price=Decimal('40.00'),
+        )
+        self.invoice.recalculate_total()
+        render = mock.patch('billing.pdf.render_invoice_pdf', return_value=b'%PDF-test')
+        self.render = render.start()
+        self.addCleanup(render.stop)
+
+    def download(self, **headers):
+        response = self.client.get(f'/api/invoices/{self.invoice.pk}/pdf/', **headers)
+        if response.status_code == 200:
+            self.assertEqual(b''.join(response.streaming_content), b'%PDF-test')
+        return response
+
+    def cached_files(self, invoice_id=None):
+        pattern = f'{invoice_id or self.invoice.pk}-*.pdf'
+        return sorted(path.name for path in Path(settings.INVOICE_PDF['CACHE_DIR']).glob(pattern))
+
+    def test_repeat_download_reuses_the_file(self):
+        first = self.download()
+        second = self.download()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(self.render.call_count, 1)
+        digest = first['ETag'].strip('"')
+        self.assertEqual(self.cached_files(), [f'{self.invoice.pk}-{digest}.pdf'])
+
+    def test_if_none_match_returns_304(self):
+        etag = self.download()['ETag']
+        response = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.render.call_count, 1)
+
+    def assertNewVersionReplacesOld(self, change):
+        old = self.download()['ETag']
+        old_files = self.cached_files()
+        change()
+        self.invoice.refresh_from_db()
+        response = self.download(HTTP_IF_NONE_MATCH=old)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], old)
+        self.assertEqual(self.render.call_count, 2)
+        self.assertEqual(len(self.cached_files()), 1)
+        self.assertNotEqual(self.cached_files(), old_files)
+
+    def test_item_change_produces_a_new_file(self):
+        def change():
+            InvoiceItem.objects.filter(pk=self.item.pk).update(quantity=2)
+            self.invoice.recalculate_total()
+
+        self.assertNewVersionReplacesOld(change)
+
+    def test_status_change_produces_a_new_file(self):
+        def change():
+            self.invoice.status = Invoice.Status.PAID
+            self.invoice.save()
+
+        self.assertNewVersionReplacesOld(change)
+
+    def test_deleting_the_invoice_clears_its_cache(self):
+        invoice_id = self.invoice.pk
+        self.download()
+        self.assertEqual(len(self.cached_files()), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice.delete()
+        self.assertEqual(self.cached_files(invoice_id), [])
+
+
+class InvoiceFilterTests(TestCase):
+    """Filtros del listado de facturas (billing.views.filter_invoices)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        cls.other_admin = User.objects.create(username='admin2', role=User.Roles.ADMIN)
+        cls.patients = [
+            PatientProfile.objects.create(user=User.objects.create(username=f'paciente{i}', role=User.Roles.PATIENT))
+            for i in range(2)
+        ]
+        today = timezone.localdate()
+        cls.days = [today - timedelta(days=10), today - timedelta(days=5), today]
+        cls.invoices = {}
+        for name, patient, issued_by, day, total in [
+            ('old', cls.patients[0], cls.admin, cls.days[0], '10.00'),
+            ('mid', cls.patients[0], cls.other_admin, cls.days[1], '50.00'),
+            ('new', cls.patients[1], cls.admin, cls.days[2], '120.00'),
+        ]:
+            invoice = Invoice.objects.create(patient=patient, issued_by=issued_by)
+            Invoice.objects.filter(pk=invoice.pk).update(issued_at=day, total=Decimal(total))
+            cls.invoices[name] = invoice.pk
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def listed(self, **params):
+        response = self.client.get('/api/invoices/', {'page_size': 50, **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        ids = {row['id'] for row in response.data['results']}
+        return {name for name, pk in self.invoices.items() if pk in ids}
+
+    def test_patient_and_issuer_filters(self):
+        self.assertEqual(self.listed(patient_id=self.patients[0].pk), {'old', 'mid'})
+        self.assertEqual(self.listed(issued_by=self.other_admin.pk), {'mid'})
+        self.assertEqual(self.listed(patient_id=self.patients[0].pk, issued_by=self.admin.pk), {'old'})
+
+    def test_date_filters(self):
+        self.assertEqual(self.listed(date_from=self.days[1].isoformat()), {'mid', 'new'})
+        self.assertEqual(self.listed(date_to=self.days[1].isoformat()), {'old', 'mid'})
+        self.assertEqual(
+            self.listed(date_from=self.days[1].isoformat(), date_to=self.days[1].isoformat()), {'mid'},
+        )
+
+    def test_total_filters(self):
+        self.assertEqual(self.listed(min_total='50'), {'mid', 'new'})
+        self.assertEqual(self.listed(max_total='50.00'), {'old', 'mid'})
+        self.assertEqual(self.listed(min_total='20', max_total='100'), {'mid'})
+
+    def test_invalid_values_are_rejected(self):
+        for name, value in [
+            ('patient_id', 'x'),
+            ('issued_by', '1.5'),
+            ('date_from', '2026-02-30'),
+            ('date_to', 'ayer'),
+            ('min_total', 'diez'),
+            ('max_total', 'NaN'),
+            ('min_total', 'Infinity'),
+        ]:
+            response = self.client.get('/api/invoices/', {name: value})
+            self.assertEqual(response.status_code, 400, (name, value))
+            self.assertIn(name, response.data)
+
+    def test_patients_cannot_filter_by_patient_or_issuer(self):
+        self.client.force_authenticate(self.patients[0].user)
+        self.assertEqual(self.listed(), {'old', 'mid'})
+        # Los filtros de personal se ignoran: no dan acceso a facturas ajenas
+        self.assertEqual(self.listed(patient_id=self.patients[1].pk), {'old', 'mid'})
+        self.assertEqual(self.listed(issued_by=self.other_admin.pk), {'old', 'mid'})
+        self.assertEqual(self.listed(min_total='20'), {'mid'})
+
+    def test_list_query_count_does_not_depend_on_rows(self):
+        # Página de facturas con paciente, emisor y número de líneas en una sola consulta
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/invoices/', {'page_size': 50, 'min_total': '0'})
+        self.assertEqual(len(response.data['results']), 3)
+
+
+class RevenueReportTests(TestCase):
+    """Informes de ingresos de periodos cerrados servidos desde la caché."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        cls.professional = ProfessionalProfile.objects.create(
+            user=User.objects.create(
+                username='doctora', role=User.Roles.PROFESSIONAL, first_name='Ana', last_name='Gil',
+            ),
+            specialty='General',
+            license_number='L-1',
+        )
+        patient = PatientProfile.objects.create(
+            user=User.objects.create(username='paciente', role=User.Roles.PATIENT),
+        )
+        cls.service = Service.objects.create(name='Limpieza', base_price=Decimal('40.00'))
+        cls.yesterday = timezone.localdate() - timedelta(days=1)
+        invoice = Invoice.objects.create(patient=patient, issued_by=cls.professional.user)
+        InvoiceItem.objects.create(invoice=invoice, service=cls.service, quantity=2, unit_price=Decimal('40.00'))
+        Invoice.objects.filter(pk=invoice.pk).update(status=Invoice.Status.PAID, issued_at=cls.yesterday)
+
+    def setUp(self):
+        dashboard.get_dashboard_cache().clear()
+
+    def report(self):
+        return revenue_report(self.yesterday, self.yesterday, ['service', 'professional'])
+
+    def test_cached_report_uses_current_names(self):
+        [row] = self.report()
+        self.assertEqual(row['service_name'], 'Limpieza')
+        self.assertEqual((row['professional_first_name'], row['professional_last_name']), ('Ana', 'Gil'))
+        self.assertEqual(row['revenue'], 80.0)
+
+        Service.objects.filter(pk=self.service.pk).update(name='Higiene dental')
+        User.objects.filter(pk=self.professional.user_id).update(last_name='Gil Ruiz')
+        # Informe desde la caché: solo las consultas de nombres
+        with self.assertNumQueries(2):
+            [row] = self.report()
+        self.assertEqual(row['service_name'], 'Higiene dental')
+        self.assertEqual(row['professional_last_name'], 'Gil Ruiz')
+        self.assertEqual(row['revenue'], 80.0)
+
+    def test_cached_rows_are_not_modified(self):
+        self.report()
+        self.report()[0]['service_name'] = 'Otro'
+        self.assertEqual(self.report()[0]['service_name'], 'Limpieza')
+
+
+class OverdueTests(TestCase):
+    """Paso de SENT a OVERDUE y vuelta a SENT al ampliar el vencimiento."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        patient_user = User.objects.create(username='paciente', role=User.Roles.PATIENT)
+        cls.patient = PatientProfile.objects.create(user=patient_user)
+        cls.today = timezone.localdate()
+
+    def invoice(self, status, due_in_days):
+        return Invoice.objects.create(
+            patient=self.patient,
+            issued_by=self.admin,
+            status=status,
+            due_date=self.today + timedelta(days=due_in_days),
+        )
+
+    def test_nightly_job_moves_both_directions(self):
+        expired = self.invoice(Invoice.Status.SENT, -1)
+        extended = self.invoice(Invoice.Status.OVERDUE, 5)
+        still_overdue = self.invoice(Invoice.Status.OVERDUE, -3)
+        self.assertEqual(reopen_extended(self.today), 1)
+        self.assertEqual(mark_overdue(self.today), 1)
+        statuses = dict(Invoice.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[expired.pk], Invoice.Status.OVERDUE)
+        self.assertEqual(statuses[extended.pk], Invoice.Status.SENT)
+        self.assertEqual(statuses[still_overdue.pk], Invoice.Status.OVERDUE)
+        self.assertEqual(check_rollup(), [])
+
+    def test_editing_due_date_updates_status(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        invoice = self.invoice(Invoice.Status.OVERDUE, -2)
+
+        response = client.patch(
+            f'/api/invoices/{invoice.pk}/', {'due_date': self.today + timedelta(days=10)}, format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.status, Invoice.Status.SENT)
+
+        response = client.patch(
+            f'/api/invoices/{invoice.pk}/', {'due_date': self.today - timedelta(days=1)}, format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.status, Invoice.Status.OVERDUE)
+        self.assertEqual(check_rollup(), [])
+
+
+class BillingRollupTests(TestCase):
+    """El agregado incremental coincide con una reconstrucción completa."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        patient_user = User.objects.create(username='paciente', role=User.Roles.PATIENT)
+        cls.patient = PatientProfile.objects.create(user=patient_user)
+        cls.service = Service.objects.create(name='Limpieza', base_price=Decimal('40.00'))
+
+    def invoice(self, status=Invoice.Status.DRAFT, amount='40.00'):
+        invoice = Invoice.objects.create(patient=self.patient, issued_by=self.admin, status=status)
+        InvoiceItem.objects.create(invoice=invoice, service=self.service, quantity=1, unit_price=Decimal(amount))
+        invoice.recalculate_total()
+        return invoice
+
+    def rollup(self):
+        return {
+            (row.day, row.status): (row.invoice_count, row.total)
+            for row in BillingDailyRollup.objects.all()
+            if row.invoice_count or row.total
+        }
+
+    def assertMatchesRebuild(self):
+        incremental = self.rollup()
+        rebuild_rollup()
+        self.assertEqual(incremental, self.rollup())
+        self.assertEqual(check_rollup(), [])
+
+    def test_create(self):
+        self.invoice()
+        self.invoice(Invoice.Status.SENT, '25.50')
+        self.assertMatchesRebuild()
+        today = timezone.localdate()
+        self.assertEqual(self.rollup()[(today, Invoice.Status.SENT)], (1, Decimal('25.50')))
+
+    def test_status_change(self):
+        invoice = self.invoice()
+        invoice.status = Invoice.Status.SENT
+        invoice.save()
+        reloaded = Invoice.objects.get(pk=invoice.pk)
+        reloaded.status = Invoice.Status.PAID
+        reloaded.save(update_fields=['status'])
+        self.assertMatchesRebuild()
+        self.assertNotIn((timezone.localdate(), Invoice.Status.DRAFT), self.rollup())
+
+    def test_total_change(self):
+        invoice = self.invoice()
+        InvoiceItem.objects.create(invoice=invoice, service=self.service, quantity=2, unit_price=Decimal('15.00'))
+        invoice.recalculate_total()
+        self.assertMatchesRebuild()
+        self.assertEqual(self.rollup()[(timezone.localdate(), Invoice.Status.DRAFT)], (1, Decimal('70.00')))
+
+    def test_issue_date_change(self):
+        invoice = self.invoice(Invoice.Status.SENT)
+        invoice.issued_at = timezone.localdate() - timedelta(days=3)
+        invoice.save()
+        self.assertMatchesRebuild()
+
+    def test_delete(self):
+        kept, deleted = self.invoice(), self.invoice(amount='10.00')
+        deleted.delete()
+        Invoice.objects.get(pk=kept.pk).delete()
+        self.assertMatchesRebuild()
+        self.assertEqual(self.rollup(), {})
+
+    def test_check_command(self):
+        self.invoice(Invoice.Status.SENT)
+        out = io.StringIO()
+        call_command('billing_rollup', 'check', stdout=out)
+        self.assertIn('coincide', out.getvalue())
+
+        BillingDailyRollup.objects.update(total=F('total') + 1)
+        out = io.StringIO()
+        with self.assertRaisesMessage(CommandError, '1 diferencias'):
+            call_command('billing_rollup', 'check', stdout=out)
+        self.assertIn(str(timezone.localdate()), out.getvalue())
+
+        call_command('billing_rollup', 'rebuild', stdout=io.StringIO())
+        call_command('billing_rollup', 'check', stdout=io.StringIO())
+
+    def test_check_command_rejects_bad_dates(self):
+        with self.assertRaises(CommandError):
+            call_command('billing_rollup', 'check', '--from', '2026-02-30')
+
+
+class DashboardTests(TestCase):
+    """Instantánea del dashboard: una consulta por tabla e invalidación por generación."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        professional_user = User.objects.create(username='doctora', role=User.Roles.PROFESSIONAL)
+        cls.professional = ProfessionalProfile.objects.create(
+            user=professional_user, specialty='General', license_number='L-1',
+        )
+        cls.room = Room.objects.create(name='Sala 1')
+        patient_user = User.objects.create(username='paciente', role=User.Roles.PATIENT)
+        cls.patient = PatientProfile.objects.create(user=patient_user)
+
+    def setUp(self):
+        dashboard.get_dashboard_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def appointment(self, status=Appointment.Status.PENDING):
+        start = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+        return Appointment.objects.create(
+            patient=self.patient,
+            professional=self.professional,
+            room=self.room,
+            start_time=start,
+            end_time=start + timedelta(minutes=30),
+            status=status,
+            treatment_type='Revisión',
+        )
+
+    def assertRecomputedAfter(self, write):
+        with mock.patch.object(dashboard, 'compute_dashboard', wraps=dashboard.compute_dashboard) as compute:
+            dashboard.dashboard_snapshot()
+            dashboard.dashboard_snapshot()
+            self.assertEqual(compute.call_count, 1)
+            generation = dashboard.get_dashboard_cache().get(dashboard.GENERATION_KEY, 0)
+            with self.captureOnCommitCallbacks(execute=True):
+                write()
+            self.assertGreater(dashboard.get_dashboard_cache().get(dashboard.GENERATION_KEY, 0), generation)
+            dashboard.dashboard_snapshot()
+            self.assertEqual(compute.call_count, 2)
+
+    def test_appointment_save_invalidates(self):
+        self.assertRecomputedAfter(self.appointment)
+
+    def test_bulk_transition_invalidates(self):
+        appointment = self.appointment()
+
+        def approve():
+            response = self.client.post('/api/appointments/bulk-approve/', {'ids': [appointment.pk]}, format='json')
+            self.assertEqual(response.data['updated'], 1)
+
+        self.assertRecomputedAfter(approve)
+
+    def test_invoice_write_invalidates(self):
+        self.assertRecomputedAfter(
+            lambda: Invoice.objects.create(patient=self.patient, issued_by=self.admin, status=Invoice.Status.SENT),
+        )
+
+    def test_one_query_per_table(self):
+        self.appointment(Appointment.Status.CONFIRMED)
+        Invoice.objects.create(patient=self.patient, issued_by=self.admin, status=Invoice.Status.SENT)
+        # Citas, pacientes, agregado de los días cerrados y facturas de hoy
+        with self.assertNumQueries(4):
+            stats = dashboard.compute_dashboard(timezone.localdate().replace(day=15))
+        self.assertEqual(stats['patients']['total'], 1)
+        # El día 1 no hay días cerrados en el mes: el agregado no se consulta
+        with self.assertNumQueries(3):
+            dashboard.compute_dashboard(timezone.localdate().replace(day=1))
+
+    def test_endpoint_serves_the_cached_snapshot(self):
+        first = self.client.get('/api/reports/dashboard/')
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/reports/dashboard/')
+        self.assertEqual(second.data['generated_at'], first.data['generated_at'])
+
+
+class ExportTests(TestCase):
+    """Exportaciones CSV/XLSX: celdas con fórmulas y filtro de estado."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        patient_user = User.objects.create(
+            username='paciente', role=User.Roles.PATIENT, first_name='=HYPERLINK("http://x")', last_name='Ruiz',
+        )
+        patient = PatientProfile.objects.create(user=patient_user)
+        Invoice.objects.create(patient=patient, issued_by=cls.admin, status=Invoice.Status.SENT)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def export(self, path, **params):
+        response = self.client.get(f'/api/exports/{path}', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv_cells_cannot_start_a_formula(self):
+        content = self.export('invoices.csv', columns='patient,total').decode('utf-8-sig')
+        _, (patient, total) = csv.reader(io.StringIO(content))
+        self.assertEqual(patient, "'=HYPERLINK(\"http://x\") Ruiz")
+        self.assertEqual(total, '0.00')
+
+    def test_xlsx_cells_cannot_start_a_formula(self):
+        content = self.export('invoices.xlsx', columns='patient')
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            sheet = archive.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertIn('>\'=HYPERLINK', sheet)
+
+    def test_status_filter(self):
+        content = self.export('invoices.csv', status=Invoice.Status.PAID).decode('utf-8-sig')
+        self.assertEqual(len(content.splitlines()), 1)
+        response = self.client.get('/api/exports/billing-by-status.csv', {'status': Invoice.Status.PAID})
+        self.assertEqual(response.status_code, 400)
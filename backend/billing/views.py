@@ -1,14 +1,30 @@
 from datetime import datetime, timedelta
 from decimal import Decimal
+from pathlib import Path
 
 from django.db.models import Sum, Count, Q
+from django.http import FileResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.http import parse_etags
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
-from .models import Service, Invoice, InvoiceItem, Budget
-from .serializers import ServiceSerializer, InvoiceSerializer, BudgetSerializer
+from .batch_invoicing import invoice_appointments
+from .models import Service, Invoice, InvoiceExportJob, InvoiceItem, Budget
+from .overdue import status_for_due_date
+from .pdf import context_hash, get_invoice_pdf, invoice_context
+from .serializers import (
+    BudgetSerializer,
+    InvoiceExportJobSerializer,
+    InvoiceExportRequestSerializer,
+    InvoiceFromAppointmentsSerializer,
+    InvoiceListSerializer,
+    InvoiceSerializer,
+    ServiceSerializer,
+)
+from core.filters import parse_filter
 from users.permissions import IsAdmin, IsProfessionalOrAdmin
 
 
@@ -22,38 +38,83 @@ class ServiceViewSet(viewsets.ModelViewSet):
         return [permissions.IsAuthenticated()]
 
 
+def parse_amount(value):
+    """Importe de un filtro; NaN e infinito no son importes válidos"""
+    amount = Decimal(value)
+    return amount if amount.is_finite() else None
+
+
+def filter_invoices(queryset, params, staff=True):
+    """Filtros del listado de facturas; todos resueltos con índices de Invoice"""
+    status_filter = params.get('status')
+    if status_filter:
+        # OVERDUE es un estado guardado (billing.overdue)
+        queryset = queryset.filter(status=status_filter)
+    
+    date_from = parse_filter(params, 'date_from', parse_date)
+    if date_from:
+        queryset = queryset.filter(issued_at__gte=date_from)
+    date_to = parse_filter(params, 'date_to', parse_date)
+    if date_to:
+        queryset = queryset.filter(issued_at__lte=date_to)
+    
+    min_total = parse_filter(params, 'min_total', parse_amount)
+    if min_total is not None:
+        queryset = queryset.filter(total__gte=min_total)
+    max_total = parse_filter(params, 'max_total', parse_amount)
+    if max_total is not None:
+        queryset = queryset.filter(total__lte=max_total)
+    
+    # Paciente y emisor: solo para profesionales y admins
+    if staff:
+        patient_id = parse_filter(params, 'patient_id', int)
+        if patient_id:
+            queryset = queryset.filter(patient_id=patient_id)
+        issued_by = parse_filter(params, 'issued_by', int)
+        if issued_by:
+            queryset = queryset.filter(issued_by_id=issued_by)
+    return queryset
+
+
 class InvoiceViewSet(viewsets.ModelViewSet):
     serializer_class = InvoiceSerializer
+    # Los empates en el primer campo se paginan por offset (ver core.pagination)
+    cursor_ordering = ('-issued_at', '-id')
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_serializer_class(self):
+        # El listado solo lleva totales y número de líneas; las líneas, en el detalle
+        if self.action == 'list':
+            return InvoiceListSerializer
+        return InvoiceSerializer
+
     def get_queryset(self):
         user = self.request.user
         queryset = Invoice.objects.select_related('patient__user', 'issued_by')
+        if self.action == 'list':
+            queryset = queryset.annotate(item_count=Count('items'))
+        elif self.action == 'pdf':
+            queryset = queryset.prefetch_related('items__service')
+        elif self.action in ['update', 'partial_update']:
+            # La sincronización de líneas parte de las existentes
+            queryset = queryset.prefetch_related('items')
         
         if user.role == user.Roles.PATIENT:
             patient_profile = getattr(user, 'patient_profile', None)
             if patient_profile:
-                return queryset.filter(patient=patient_profile)
+                return filter_invoices(queryset.filter(patient=patient_profile), self.request.query_params, staff=False)
             return queryset.none()
         
         # Profesionales y admins ven todas las facturas
-        status_filter = self.request.query_params.get('status')
-        if status_filter:
-            if status_filter == 'OVERDUE':
-                # Filtrar facturas vencidas (SENT con due_date pasado)
-                from django.utils import timezone
-                queryset = queryset.filter(
-                    status=Invoice.Status.SENT,
-                    due_date__lt=timezone.now().date()
-                )
-            else:
-                queryset = queryset.filter(status=status_filter)
-        
-        return queryset
+        return filter_invoices(queryset, self.request.query_params)
 
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [IsAdmin()]
+        if self.action == 'from_appointments':
+            return [IsAdmin()]
+        if self.action == 'export_pdf':
+            return [IsProfessionalOrAdmin()]
         return [permissions.IsAuthenticated()]
 
     def perform_create(self, serializer):
@@ -67,6 +128,11 @@ class InvoiceViewSet(viewsets.ModelViewSet):
             from datetime import timedelta
             invoice.due_date = invoice.issued_at + timedelta(days=30)
             invoice.save(update_fields=['due_date'])
+        # Al cambiar el vencimiento, SENT/OVERDUE se ajusta sin esperar al comando nocturno
+        new_status = status_for_due_date(invoice)
+        if new_status != invoice.status:
+            invoice.status = new_status
+            invoice.save(update_fields=['status'])
 
     @action(detail=True, methods=['post'])
     def mark_paid(self, request, pk=None):
@@ -81,16 +147,13 @@ class InvoiceViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['get'])
     def pdf(self, request, pk=None):
-        """Generar y descargar PDF de la factura"""
-        from django.http import HttpResponse
-        from io import BytesIO
-        from reportlab.lib.pagesizes import letter, A4
-        from reportlab.lib import colors
-        from reportlab.lib.units import cm
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.enums import TA_CENTER, TA_RIGHT
-        
+        """
+        Descargar el PDF de la factura.
+
+        El PDF se genera una vez por contenido y se sirve desde la caché en
+        disco (billing.pdf); el hash del contenido es el ETag, así que con
+        ``If-None-Match`` la respuesta es 304 sin leer el fichero.
+        """
         invoice = self.get_object()
         
         # Verificar permisos
@@ -99,139 +162,101 @@ class InvoiceViewSet(viewsets.ModelViewSet):
             if not patient_profile or invoice.patient != patient_profile:
                 return Response({'error': 'No autorizado'}, status=status.HTTP_403_FORBIDDEN)
         
-        # Crear PDF en memoria
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=2*cm, leftMargin=2*cm, topMargin=2*cm, bottomMargin=2*cm)
-        elements = []
-        styles = getSampleStyleSheet()
-        
-        # Estilos personalizados
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=20,
-            textColor=colors.HexColor('#667eea'),
-            spaceAfter=30,
-            alignment=TA_CENTER
-        )
-        
-        # Título
-        elements.append(Paragraph('FACTURA', title_style))
-        elements.append(Spacer(1, 0.5*cm))
-        
-        # Información de la factura
-        status_labels = {
-            Invoice.Status.DRAFT: 'Borrador',
-            Invoice.Status.SENT: 'Enviada',
-            Invoice.Status.PAID: 'Pagada',
-            Invoice.Status.CANCELLED: 'Cancelada',
-            Invoice.Status.OVERDUE: 'Vencida',
-        }
-        invoice_data = [
-            ['Nº Factura:', f'FAC-{invoice.id:04d}'],
-            ['Fecha:', invoice.issued_at.strftime('%d/%m/%Y')],
-            ['Estado:', status_labels.get(invoice.status, invoice.status)],
-        ]
-        if invoice.due_date:
-            invoice_data.append(['Vencimiento:', invoice.due_date.strftime('%d/%m/%Y')])
-        
-        invoice_table = Table(invoice_data, colWidths=[4*cm, 10*cm])
-        invoice_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f0f4ff')),
-            ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#667eea')),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-            ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ]))
-        elements.append(invoice_table)
-        elements.append(Spacer(1, 0.5*cm))
-        
-        # Información del paciente
-        patient_data = [
-            ['Paciente:', f"{invoice.patient.user.first_name} {invoice.patient.user.last_name}"],
-            ['Email:', invoice.patient.user.email or ''],
-            ['Teléfono:', invoice.patient.user.phone or ''],
-        ]
-        if invoice.patient.user.document_id:
-            patient_data.append(['DNI/NIE:', invoice.patient.user.document_id])
-        
-        patient_table = Table(patient_data, colWidths=[4*cm, 10*cm])
-        patient_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f0f4ff')),
-            ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#667eea')),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-            ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ]))
-        elements.append(patient_table)
-        elements.append(Spacer(1, 1*cm))
-        
-        # Items de la factura
-        items_data = [['Servicio', 'Cantidad', 'Precio Unit.', 'Total']]
-        for item in invoice.items.all():
-            items_data.append([
-                item.service.name,
-                str(item.quantity),
-                f'{item.unit_price:.2f} €',
-                f'{item.total:.2f} €'
-            ])
-        
-        items_table = Table(items_data, colWidths=[8*cm, 2*cm, 2*cm, 2*cm])
-        items_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#667eea')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('TOPPADDING', (0, 0), (-1, 0), 12),
-            ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f9f9f9')]),
-            ('FONTSIZE', (0, 1), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 1), (-1, -1), 8),
-            ('TOPPADDING', (0, 1), (-1, -1), 8),
-        ]))
-        elements.append(items_table)
-        elements.append(Spacer(1, 0.5*cm))
-        
-        # Total
-        total_data = [
-            ['', '', 'TOTAL:', f'{invoice.total:.2f} €']
-        ]
-        total_table = Table(total_data, colWidths=[8*cm, 2*cm, 2*cm, 2*cm])
-        total_table.setStyle(TableStyle([
-            ('ALIGN', (2, 0), (-1, -1), 'RIGHT'),
-            ('FONTNAME', (2, 0), (-1, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (2, 0), (-1, -1), 14),
-            ('TEXTCOLOR', (2, 0), (-1, -1), colors.HexColor('#667eea')),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ('TOPPADDING', (0, 0), (-1, -1), 12),
-        ]))
-        elements.append(total_table)
-        
-        # Notas
-        if invoice.notes:
-            elements.append(Spacer(1, 1*cm))
-            elements.append(Paragraph('<b>Notas:</b>', styles['Heading3']))
-            elements.append(Paragraph(invoice.notes, styles['Normal']))
-        
-        # Construir PDF
-        doc.build(elements)
-        buffer.seek(0)
-        
-        # Preparar respuesta
-        response = HttpResponse(buffer, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="factura_{invoice.id:04d}.pdf"'
+        context = invoice_context(invoice)
+        etag = f'"{context_hash(context)}"'
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            path, _ = get_invoice_pdf(invoice, context)
+            response = FileResponse(
+                path.open('rb'),
+                as_attachment=True,
+                filename=f'factura_{invoice.id:04d}.pdf',
+                content_type='application/pdf',
+            )
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
         return response
 
+    @action(detail=False, methods=['post'], url_path='export-pdf')
+    def export_pdf(self, request):
+        """
+        Exportar en un ZIP los PDF de las facturas emitidas en un periodo.
+
+        Solo se encola el trabajo: lo ejecuta el worker ``run_invoice_exports``
+        (billing.bulk_pdf). El progreso y la descarga están en
+        /api/invoice-exports/{id}/.
+        """
+        serializer = InvoiceExportRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = InvoiceExportJob.objects.create(
+            requested_by=request.user,
+            date_from=serializer.validated_data['date_from'],
+            date_to=serializer.validated_data['date_to'],
+            invoice_status=serializer.validated_data.get('status', ''),
+        )
+        return Response(
+            InvoiceExportJobSerializer(job, context={'request': request}).data,
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(detail=False, methods=['post'], url_path='from-appointments')
+    def from_appointments(self, request):
+        """
+        Facturar por lotes las citas completadas sin facturar de un periodo.
+
+        Una factura por paciente y una línea por cita (billing.batch_invoicing);
+        con ``dry_run`` solo se devuelve lo que se facturaría.
+        """
+        serializer = InvoiceFromAppointmentsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        result = invoice_appointments(
+            date_from=data['date_from'],
+            date_to=data['date_to'],
+            issued_by=request.user,
+            status=data['status'],
+            dry_run=data['dry_run'],
+        )
+        return Response(
+            result,
+            status=status.HTTP_200_OK if data['dry_run'] else status.HTTP_201_CREATED,
+        )
+
+
+class InvoiceExportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Estado y descarga de las exportaciones masivas de PDF"""
+    serializer_class = InvoiceExportJobSerializer
+    cursor_ordering = ('-created_at', '-id')
+    permission_classes = [IsProfessionalOrAdmin]
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = InvoiceExportJob.objects.all()
+        if user.role != user.Roles.ADMIN:
+            queryset = queryset.filter(requested_by=user)
+        return queryset
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Descargar el ZIP de una exportación terminada"""
+        job = self.get_object()
+        if job.status != InvoiceExportJob.Status.DONE:
+            return Response(
+                {'error': 'La exportación aún no ha terminado.', 'status': job.status},
+                status=status.HTTP_409_CONFLICT,
+            )
+        return FileResponse(
+            job.archive.open('rb'),
+            as_attachment=True,
+            filename=Path(job.archive.name).name,
+            content_type='application/zip',
+        )
+
 
 class BudgetViewSet(viewsets.ModelViewSet):
     serializer_class = BudgetSerializer
+    cursor_ordering = ('-created_at', '-id')
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
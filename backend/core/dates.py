@@ -0,0 +1,21 @@
+"""
+Utilidades de fechas en la zona horaria local (TIME_ZONE, Europe/Madrid).
+
+Las búsquedas ``__date`` envuelven la columna en una conversión de zona
+horaria e impiden usar índices. En su lugar se filtra por rangos semiabiertos
+[medianoche local, medianoche local del día siguiente) sobre la columna.
+"""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+
+def local_datetime(day, hour=time.min):
+    """Fecha y hora local (aware) para un día y una hora dados."""
+    return timezone.make_aware(datetime.combine(day, hour), timezone.get_current_timezone())
+
+
+def local_day_bounds(date_from, date_to=None):
+    """Rango [inicio, fin) que cubre los días locales de date_from a date_to (incluido)."""
+    date_to = date_to or date_from
+    return local_datetime(date_from), local_datetime(date_to + timedelta(days=1))
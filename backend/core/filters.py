@@ -0,0 +1,23 @@
+"""
+Lectura de parámetros de filtro de las peticiones (query params).
+"""
+from rest_framework.exceptions import ValidationError
+
+
+def parse_filter(params, name, parser):
+    """
+    Valor del parámetro ``name`` convertido con ``parser`` o None si no viene.
+
+    Un valor que ``parser`` no acepta (excepción o None) responde 400 con el
+    nombre del parámetro.
+    """
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parser(value)
+    except (ArithmeticError, ValueError):
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: f'Valor no válido: {value}'})
+    return parsed
@@ -0,0 +1,79 @@
+"""
+Paginación por cursor (keyset) común a todos los endpoints de listado.
+
+Cada viewset declara ``cursor_ordering`` con columnas indexadas; el cursor
+codifica la posición en esa ordenación, por lo que el coste de cada página no
+depende de lo lejos que esté del principio.
+
+``CursorPagination`` de DRF solo se posiciona sobre el primer campo de la
+ordenación (``start_time`` en citas, ``issued_at`` en facturas); el ``id``
+final solo hace el orden determinista. Las filas empatadas en ese primer
+campo se recorren con un desplazamiento (offset) codificado en el cursor: con
+muchos empates (p. ej. todas las facturas de un mismo día) el coste crece con
+el número de empates, y altas o bajas entre filas empatadas entre dos
+peticiones pueden desplazar la página. Además, el enlace ``previous`` de una
+página cuyo primer elemento empata con la página anterior puede volver vacío:
+el recorrido con ``next`` es exacto, el retroceso solo entre valores distintos.
+
+Durante el periodo de transición (``API_PAGINATION['LEGACY_UNPAGINATED']``)
+las peticiones sin ``cursor`` ni ``page_size`` siguen recibiendo la lista
+completa, y cualquier cliente puede forzarla con ``?paginate=false``.
+"""
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+DEFAULT_SETTINGS = {
+    'PAGE_SIZE': 50,
+    'MAX_PAGE_SIZE': 500,
+    'LEGACY_UNPAGINATED': True,
+}
+
+
+def get_pagination_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'API_PAGINATION', {})}
+
+
+class KeysetPagination(CursorPagination):
+    page_size_query_param = 'page_size'
+    ordering = ('id',)
+
+    def __init__(self):
+        config = get_pagination_settings()
+        self.page_size = config['PAGE_SIZE']
+        self.max_page_size = config['MAX_PAGE_SIZE']
+        self.count = None
+
+    def is_requested(self, request):
+        """Indica si la petición debe paginarse."""
+        if request.query_params.get('paginate', '').lower() in ('0', 'false', 'no'):
+            return False
+        if self.cursor_query_param in request.query_params or self.page_size_query_param in request.query_params:
+            return True
+        return not get_pagination_settings()['LEGACY_UNPAGINATED']
+
+    def get_ordering(self, request, queryset, view):
+        return tuple(getattr(view, 'cursor_ordering', self.ordering))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        # El COUNT(*) recorre todo el conjunto filtrado: solo bajo petición
+        if request.query_params.get('count', '').lower() in ('1', 'true', 'yes'):
+            self.count = queryset.count()
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        payload = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            payload['count'] = self.count
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count'] = {'type': 'integer', 'example': 123}
+        return response_schema
@@ -0,0 +1,89 @@
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from billing.models import Invoice
+from patients.models import PatientProfile
+from users.models import User
+
+from .pagination import get_pagination_settings
+
+
+def pagination(**overrides):
+    return override_settings(API_PAGINATION={**get_pagination_settings(), **overrides})
+
+
+class KeysetPaginationTests(TestCase):
+    """Paginación por cursor sobre el listado de facturas (ordenado por -issued_at, -id)."""
+
+    INVOICES = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        patient = PatientProfile.objects.create(
+            user=User.objects.create(username='paciente', role=User.Roles.PATIENT),
+        )
+        # Todas del mismo día: empatan en issued_at y se paginan por offset
+        cls.ids = [
+            Invoice.objects.create(patient=patient, issued_by=cls.admin).pk
+            for _ in range(cls.INVOICES)
+        ][::-1]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def get(self, url='/api/invoices/', params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_cursor_walks_every_row_once(self):
+        seen = []
+        page = self.get(params={'page_size': 2})
+        self.assertIsNone(page['previous'])
+        while True:
+            self.assertLessEqual(len(page['results']), 2)
+            seen.extend(row['id'] for row in page['results'])
+            if not page['next']:
+                break
+            page = self.get(page['next'])
+        self.assertEqual(seen, self.ids)
+
+    def test_previous_link_with_distinct_dates(self):
+        # El retroceso solo es exacto si el primer campo no empata (ver core.pagination)
+        today = timezone.localdate()
+        for days, pk in enumerate(self.ids):
+            Invoice.objects.filter(pk=pk).update(issued_at=today - timedelta(days=days))
+        second = self.get(self.get(params={'page_size': 2})['next'])
+        self.assertEqual([row['id'] for row in second['results']], self.ids[2:4])
+        previous = self.get(second['previous'])
+        self.assertEqual([row['id'] for row in previous['results']], self.ids[:2])
+
+    def test_page_size_is_capped(self):
+        with pagination(MAX_PAGE_SIZE=3):
+            page = self.get(params={'page_size': 100})
+        self.assertEqual(len(page['results']), 3)
+        self.assertIsNotNone(page['next'])
+
+    def test_count_only_on_request(self):
+        self.assertNotIn('count', self.get(params={'page_size': 2}))
+        with self.assertNumQueries(2):
+            page = self.get(params={'page_size': 2, 'count': 'true'})
+        self.assertEqual(page['count'], self.INVOICES)
+
+    def test_paginate_false_returns_the_full_list(self):
+        with pagination(LEGACY_UNPAGINATED=False):
+            data = self.get(params={'paginate': 'false', 'page_size': 2})
+        self.assertEqual(sorted(row['id'] for row in data), sorted(self.ids))
+
+    def test_legacy_unpaginated_fallback(self):
+        with pagination(LEGACY_UNPAGINATED=True):
+            self.assertEqual(sorted(row['id'] for row in self.get()), sorted(self.ids))
+            self.assertEqual(len(self.get(params={'page_size': 2})['results']), 2)
+        with pagination(LEGACY_UNPAGINATED=False, PAGE_SIZE=3):
+            page = self.get()
+        self.assertEqual([row['id'] for row in page['results']], self.ids[:3])
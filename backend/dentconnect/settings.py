@@ -161,6 +161,15 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.KeysetPagination',
+}
+
+# Paginación por cursor (core.pagination.KeysetPagination)
+API_PAGINATION = {
+    'PAGE_SIZE': int(os.environ.get('API_PAGE_SIZE', '50')),
+    'MAX_PAGE_SIZE': int(os.environ.get('API_MAX_PAGE_SIZE', '500')),
+    # Periodo de transición: sin ``cursor`` ni ``page_size`` se devuelve la lista completa
+    'LEGACY_UNPAGINATED': os.environ.get('API_LEGACY_UNPAGINATED', 'True') == 'True',
 }
 
 SPECTACULAR_SETTINGS = {
@@ -184,3 +193,83 @@ else:
     # En producción, solo orígenes específicos
     CORS_ALLOWED_ORIGINS = [origin for origin in os.environ.get('CORS_ALLOWED_ORIGINS', '').split(',') if origin]
 CORS_ALLOW_CREDENTIALS = True
+
+# Índice en memoria de intervalos de citas (appointments.intervals).
+# Cada proceso mantiene su propio índice: se construye al arrancar y, pasados
+# MAX_AGE segundos, se reconstruye en segundo plano para incorporar las citas
+# escritas por otros workers. Los solapamientos que encuentra se confirman en la BD.
+APPOINTMENT_INTERVAL_INDEX = {
+    'ENABLED': os.environ.get('APPOINTMENT_INTERVAL_INDEX', 'True') == 'True',
+    'MAX_AGE': int(os.environ.get('APPOINTMENT_INTERVAL_INDEX_MAX_AGE', '300')),
+    # Días hacia atrás cubiertos; las comprobaciones anteriores consultan la BD
+    'HORIZON_DAYS': int(os.environ.get('APPOINTMENT_INTERVAL_INDEX_HORIZON_DAYS', '1')),
+}
+
+# Entrega asíncrona de notificaciones (appointments.outbox).
+# Las peticiones solo insertan filas en Notification; el comando
+# ``deliver_notifications`` las reclama por lotes y las envía por el canal.
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_FILE_PATH = os.environ.get('EMAIL_FILE_PATH', str(BASE_DIR / 'outbox' / 'email'))
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'DentConnect <no-reply@dentconnect.local>')
+
+NOTIFICATION_BACKENDS = {
+    'EMAIL': 'appointments.delivery.EmailBackend',
+    'SMS': 'appointments.delivery.FakeSMSBackend',
+    'PUSH': 'appointments.delivery.LogBackend',
+    'IN_APP': 'appointments.delivery.InAppBackend',
+}
+
+NOTIFICATION_DELIVERY = {
+    'BATCH_SIZE': int(os.environ.get('NOTIFICATION_BATCH_SIZE', '100')),
+    'MAX_ATTEMPTS': int(os.environ.get('NOTIFICATION_MAX_ATTEMPTS', '5')),
+    # Espera antes del reintento n: BACKOFF_SECONDS * 2 ** (n - 1), como máximo MAX_BACKOFF_SECONDS
+    'BACKOFF_SECONDS': int(os.environ.get('NOTIFICATION_BACKOFF_SECONDS', '30')),
+    'MAX_BACKOFF_SECONDS': int(os.environ.get('NOTIFICATION_MAX_BACKOFF_SECONDS', '3600')),
+    # Tiempo tras el cual una notificación reclamada por un worker caído vuelve a la cola (cuenta un intento)
+    'LEASE_SECONDS': int(os.environ.get('NOTIFICATION_LEASE_SECONDS', '300')),
+    # Pasarela SMS simulada: fichero de salida, latencia (ms) y tasa de fallos
+    'FAKE_SMS_FILE': os.environ.get('FAKE_SMS_FILE', str(BASE_DIR / 'outbox' / 'sms.log')),
+    'FAKE_SMS_LATENCY_MS': int(os.environ.get('FAKE_SMS_LATENCY_MS', '0')),
+    'FAKE_SMS_FAILURE_RATE': float(os.environ.get('FAKE_SMS_FAILURE_RATE', '0')),
+}
+
+# Retención de notificaciones (comando purge_notifications).
+NOTIFICATION_RETENTION = {
+    # Las notificaciones leídas (y ya entregadas) con más de N días salen de la tabla
+    'READ_MAX_AGE_DAYS': int(os.environ.get('NOTIFICATION_READ_MAX_AGE_DAYS', '90')),
+    # 'archive': se copian a NotificationArchive; 'delete': se eliminan
+    'MODE': os.environ.get('NOTIFICATION_RETENTION_MODE', 'archive'),
+    # Antigüedad máxima del archivo (0 = conservar siempre)
+    'ARCHIVE_MAX_AGE_DAYS': int(os.environ.get('NOTIFICATION_ARCHIVE_MAX_AGE_DAYS', '730')),
+    'BATCH_SIZE': int(os.environ.get('NOTIFICATION_RETENTION_BATCH_SIZE', '1000')),
+}
+
+# Caché: en local memoria del proceso; en producción un backend compartido
+# (p. ej. CACHE_BACKEND=django.core.cache.backends.redis.RedisCache)
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'dentconnect'),
+    },
+}
+
+# Instantánea de estadísticas del dashboard (billing.dashboard)
+DASHBOARD_CACHE = {
+    'ALIAS': os.environ.get('DASHBOARD_CACHE_ALIAS', 'default'),
+    'TIMEOUT': int(os.environ.get('DASHBOARD_CACHE_TIMEOUT', '60')),
+}
+
+# Caché en disco de los PDF de facturas (billing.pdf)
+INVOICE_PDF = {
+    'CACHE_DIR': os.environ.get('INVOICE_PDF_CACHE_DIR', str(MEDIA_ROOT / 'invoices')),
+}
+
+# Exportación masiva de PDF de facturas (billing.bulk_pdf)
+INVOICE_EXPORT = {
+    # Procesos que generan PDF en paralelo
+    'WORKERS': int(os.environ.get('INVOICE_EXPORT_WORKERS', str(min(4, os.cpu_count() or 1)))),
+    # Facturas por tanda: acota los PDF en memoria mientras se escriben en el ZIP
+    'CHUNK_SIZE': int(os.environ.get('INVOICE_EXPORT_CHUNK_SIZE', '50')),
+    # Segundos sin progreso tras los que un trabajo RUNNING se da por interrumpido
+    'STALE_SECONDS': int(os.environ.get('INVOICE_EXPORT_STALE_SECONDS', '900')),
+}
@@ -24,8 +24,8 @@ from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
 
 from appointments.views import AppointmentViewSet, NotificationViewSet
-from billing.reports import activity_report, billing_report, dashboard_stats
-from billing.views import BudgetViewSet, InvoiceViewSet, ServiceViewSet
+from billing.reports import activity_report, billing_report, dashboard_stats, export_data, revenue_report
+from billing.views import BudgetViewSet, InvoiceExportJobViewSet, InvoiceViewSet, ServiceViewSet
 from patients.views import ClinicalRecordViewSet, DocumentViewSet, PatientViewSet
 from resources.views import EquipmentViewSet, RoomViewSet
 from staff.views import ProfessionalViewSet
@@ -49,6 +49,7 @@ router.register(r'clinical-records', ClinicalRecordViewSet, basename='clinical-r
 router.register(r'documents', DocumentViewSet, basename='document')
 router.register(r'services', ServiceViewSet, basename='service')
 router.register(r'invoices', InvoiceViewSet, basename='invoice')
+router.register(r'invoice-exports', InvoiceExportJobViewSet, basename='invoice-export')
 router.register(r'budgets', BudgetViewSet, basename='budget')
 
 
@@ -84,6 +85,8 @@ urlpatterns = [
     path('api/reports/dashboard/', dashboard_stats, name='dashboard-stats'),
     path('api/reports/billing/', billing_report, name='billing-report'),
     path('api/reports/activity/', activity_report, name='activity-report'),
+    path('api/reports/revenue/', revenue_report, name='revenue-report'),
+    path('api/exports/<slug:dataset>.<str:file_format>', export_data, name='export-data'),
     path('api/', include(router.urls)),
 ]
 
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.14 on 2026-10-18 14:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0005_rename_patients_ed_patient_5a8f2a_idx_patients_ed_patient_499926_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='clinicalrecord',
+            index=models.Index(fields=['created_at', 'id'], name='patients_cl_created_370de0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['uploaded_at', 'id'], name='patients_do_uploade_406270_idx'),
+        ),
+    ]
@@ -50,6 +50,9 @@ class ClinicalRecord(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+        ]
 
     def __str__(self) -> str:
         return f"Registro clínico {self.treatment} - {self.patient}"
@@ -87,6 +90,9 @@ class Document(models.Model):
 
     class Meta:
         ordering = ['-uploaded_at']
+        indexes = [
+            models.Index(fields=['uploaded_at', 'id']),
+        ]
 
     def __str__(self) -> str:
         return f"{self.title} - {self.patient}"
@@ -189,6 +189,7 @@ class PatientViewSet(viewsets.ModelViewSet):
 
 class ClinicalRecordViewSet(viewsets.ModelViewSet):
     serializer_class = ClinicalRecordSerializer
+    cursor_ordering = ('-created_at', '-id')
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
@@ -227,6 +228,7 @@ class ClinicalRecordViewSet(viewsets.ModelViewSet):
 
 class DocumentViewSet(viewsets.ModelViewSet):
     serializer_class = DocumentSerializer
+    cursor_ordering = ('-uploaded_at', '-id')
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
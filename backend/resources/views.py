@@ -1,9 +1,13 @@
+from django.utils.dateparse import parse_date
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from .models import Room, Equipment
 from .serializers import RoomSerializer, EquipmentSerializer
+from appointments.availability import free_slots_for
+from core.dates import local_day_bounds
+from core.filters import parse_filter
 from users.permissions import IsAdmin, IsProfessionalOrAdmin
 
 
@@ -38,18 +42,24 @@ class RoomViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['get'])
     def availability(self, request, pk=None):
-        """Consultar disponibilidad de una sala"""
+        """Consultar disponibilidad de una sala (ocupación de un día o franjas libres por rango)"""
         room = self.get_object()
-        date = request.query_params.get('date')
+
+        if request.query_params.get('date_from'):
+            return Response(free_slots_for(request.query_params, room=room))
+
+        date = parse_filter(request.query_params, 'date', parse_date)
         
         if not date:
             return Response({'error': 'Se requiere el parámetro date'}, status=400)
         
         from appointments.models import Appointment
         
+        day_start, day_end = local_day_bounds(date)
         occupied = Appointment.objects.filter(
             room=room,
-            start_time__date=date,
+            start_time__gte=day_start,
+            start_time__lt=day_end,
             status__in=['PENDING', 'CONFIRMED'],
         )
         
@@ -82,3 +92,38 @@ class EquipmentViewSet(viewsets.ModelViewSet):
         if room_id:
             queryset = queryset.filter(room_id=room_id)
         return queryset
+
+    @action(detail=True, methods=['get'])
+    def availability(self, request, pk=None):
+        """Consultar disponibilidad de un equipo (reservas de un día o franjas libres por rango)"""
+        equipment = self.get_object()
+
+        if request.query_params.get('date_from'):
+            return Response(free_slots_for(request.query_params, equipment=equipment))
+
+        date = parse_filter(request.query_params, 'date', parse_date)
+        
+        if not date:
+            return Response({'error': 'Se requiere el parámetro date'}, status=400)
+        
+        from appointments.models import Appointment
+        
+        day_start, day_end = local_day_bounds(date)
+        occupied = Appointment.objects.filter(
+            equipment=equipment,
+            start_time__gte=day_start,
+            start_time__lt=day_end,
+            status__in=['PENDING', 'CONFIRMED'],
+        )
+        
+        return Response({
+            'equipment': equipment.name,
+            'status': equipment.status,
+            'occupied_slots': [
+                {
+                    'start': apt.start_time.isoformat(),
+                    'end': apt.end_time.isoformat(),
+                }
+                for apt in occupied
+            ],
+        })
@@ -1,6 +1,8 @@
 from django.conf import settings
 from django.db import models
 
+WEEKDAY_CODES = ['LUN', 'MAR', 'MIE', 'JUE', 'VIE', 'SAB', 'DOM']
+
 
 class ProfessionalProfile(models.Model):
     user = models.OneToOneField(
@@ -20,3 +22,29 @@ class ProfessionalProfile(models.Model):
 
     def __str__(self) -> str:
         return f"{self.user.get_full_name()} ({self.specialty})"
+
+    def get_working_weekdays(self) -> set[int]:
+        """Días laborables como índices de weekday() (0 = lunes).
+
+        Acepta rangos ("LUN-VIE"), listas ("LUN,MIE,VIE") o combinaciones.
+        Si no se puede interpretar, se asume de lunes a viernes.
+        """
+        normalized = (
+            self.working_days.upper()
+            .replace('MIÉ', 'MIE')
+            .replace('SÁB', 'SAB')
+            .replace(' ', '')
+        )
+        weekdays = set()
+        for part in filter(None, normalized.replace(';', ',').split(',')):
+            bounds = part.split('-')
+            if not all(bound[:3] in WEEKDAY_CODES for bound in bounds):
+                continue
+            first = WEEKDAY_CODES.index(bounds[0][:3])
+            last = WEEKDAY_CODES.index(bounds[-1][:3])
+            if first <= last:
+                weekdays.update(range(first, last + 1))
+            else:
+                weekdays.update(range(first, 7))
+                weekdays.update(range(0, last + 1))
+        return weekdays or set(range(5))
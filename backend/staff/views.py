@@ -1,9 +1,13 @@
+from django.utils.dateparse import parse_date
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from .models import ProfessionalProfile
 from .serializers import ProfessionalSerializer
+from appointments.availability import free_slots_for
+from core.dates import local_day_bounds
+from core.filters import parse_filter
 from users.permissions import IsAdmin, IsProfessionalOrAdmin
 
 
@@ -41,18 +45,24 @@ class ProfessionalViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['get'])
     def availability(self, request, pk=None):
-        """Consultar disponibilidad de un profesional"""
+        """Consultar disponibilidad de un profesional (ocupación de un día o franjas libres por rango)"""
         professional = self.get_object()
-        date = request.query_params.get('date')
+
+        if request.query_params.get('date_from'):
+            return Response(free_slots_for(request.query_params, professional=professional))
+
+        date = parse_filter(request.query_params, 'date', parse_date)
         
         if not date:
             return Response({'error': 'Se requiere el parámetro date'}, status=status.HTTP_400_BAD_REQUEST)
         
         from appointments.models import Appointment
         
+        day_start, day_end = local_day_bounds(date)
         occupied = Appointment.objects.filter(
             professional=professional,
-            start_time__date=date,
+            start_time__gte=day_start,
+            start_time__lt=day_end,
             status__in=['PENDING', 'CONFIRMED'],
         )
         
@@ -21,6 +21,7 @@ class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all().order_by('-date_joined')
     serializer_class = UserSerializer
     permission_classes = [IsAdmin]
+    cursor_ordering = ('-id',)
 
     @action(detail=True, methods=['post'])
     def activate(self, request, pk=None):
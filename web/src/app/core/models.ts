@@ -95,7 +95,8 @@ export interface Invoice {
   due_date?: string;
   notes?: string;
   total: number;
-  items: InvoiceItem[];
+  items?: InvoiceItem[]; // Solo en el detalle
+  item_count?: number; // Solo en el listado
 }
 
 export interface Budget {
@@ -1014,8 +1014,13 @@ export class InvoicesComponent implements OnInit {
   }
 
   getServicesList(invoice: Invoice): string {
-    if (!invoice.items || invoice.items.length === 0) return 'Sin servicios';
-    return invoice.items.map(item => item.service_detail?.name || 'Servicio').join(', ');
+    if (invoice.items && invoice.items.length > 0) {
+      return invoice.items.map(item => item.service_detail?.name || 'Servicio').join(', ');
+    }
+    // El listado solo trae el número de líneas; el detalle se carga al abrir la factura
+    const count = invoice.item_count || 0;
+    if (count === 0) return 'Sin servicios';
+    return count === 1 ? '1 servicio' : `${count} servicios`;
   }
 
   getStatusLabel(status: string): string {